@@ -0,0 +1,388 @@
+# benchmark_suite.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import hashlib
+import tempfile
+import numpy as np
+import face_recognition
+from PIL import Image
+from sklearn.svm import SVC
+from sklearn.preprocessing import LabelEncoder
+from face_database import FaceDatabase
+from image_pipeline import crop_image, encode_training_image, classify_image, identify_image
+from distributed_sort import write_output
+from result_cache import ResultCache, file_content_hash
+from sort_index import OUTPUT_MODE_COPY
+from training_memory import SVM_CACHE_MB
+from stage_profiler import StageProfiler
+from face_detection import POLICIES, POLICY_HOG
+from quality_tiers import QUALITY_TIERS, DEFAULT_TIER, tier_settings, inference_settings, save_model_bundle
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+TRAIN_DIR = os.path.join(PROJECT_ROOT, "train_data")  # 合成画像に貼り付ける顔の取得元
+BENCH_DIR = os.path.join(PROJECT_ROOT, ".pica_bench")  # 生成したコーパスと実行結果の保存先
+BASELINE_FILE = os.path.join(PROJECT_ROOT, "benchmark_baseline.json")
+
+DEFAULT_SEED = 0
+DEFAULT_NUM_IMAGES = 60
+DEFAULT_DETECTOR = POLICY_HOG  # CPUのみの環境を想定（GPUがある場合は --detector cnn、切り替え方式は adaptive）
+DEFAULT_TOLERANCE = 0.15  # ベースラインからこの割合以上遅くなったら性能低下とみなす
+MIN_STAGE_MS = 1.0        # これより短いステージは計測誤差が大きいため比較しない
+
+# 合成コーパスの構成（解像度と顔の数はシードから決定的に選ぶ）
+RESOLUTIONS = [(640, 480), (1024, 768), (1600, 1200), (1920, 1080), (3000, 2000)]
+FACE_COUNTS = [0, 1, 1, 1, 2, 3, 5]
+SOURCE_FACES_PER_PERSON = 20   # 1人あたりに使う顔画像の上限
+TRAIN_IMAGES_PER_PERSON = 6    # 学習ベンチマーク用の1人1枚の画像数
+CONF_THRESHOLD = 0.5
+BENCHMARKS = ("crop", "train", "sort", "identify")
+
+# --- 2. コーパスの生成と読み込み ---
+
+def collect_source_faces(train_dir=TRAIN_DIR, per_person=SOURCE_FACES_PER_PERSON):
+    """train_data から貼り付け用の顔画像（人物名 → パスのリスト）を集める（順序は固定）"""
+    sources = {}
+    if not os.path.isdir(train_dir):
+        return sources
+    for name in sorted(os.listdir(train_dir)):
+        person_dir = os.path.join(train_dir, name)
+        if name.startswith('.') or not os.path.isdir(person_dir):
+            continue
+        files = sorted(f for f in os.listdir(person_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        if files:
+            sources[name] = [os.path.join(person_dir, f) for f in files[:per_person]]
+    return sources
+
+def source_fingerprint(sources):
+    """貼り付け用の顔画像（人物名と内容）のハッシュ。train_data が変わればコーパスも別物として扱う"""
+    h = hashlib.sha256()
+    for name in sorted(sources):
+        for path in sources[name]:
+            h.update(f"{name}/{file_content_hash(path)}\n".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+def make_background(rng, width, height):
+    """グラデーション + ノイズの背景（写真に近い、圧縮しにくい画像にする）"""
+    base = rng.integers(40, 215, size=(2, 3)).astype(np.float32)
+    ramp = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    image = base[0] * (1.0 - ramp) + base[1] * ramp
+    image = np.broadcast_to(image, (height, width, 3)).copy()
+    image += rng.normal(0.0, 12.0, size=(height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+def paste_faces(rng, canvas, sources, names):
+    """顔画像を重ならない位置に貼り付ける。戻り値: 貼り付けた人物名のリスト"""
+    width, height = canvas.size
+    placed_boxes = []
+    placed_names = []
+    for name in names:
+        face_path = sources[name][int(rng.integers(len(sources[name])))]
+        face = Image.open(face_path).convert("RGB")
+        size = int(min(width, height) * rng.uniform(0.18, 0.32))
+        face = face.resize((size, int(size * face.height / face.width)), Image.Resampling.LANCZOS)
+        for _ in range(20):
+            left = int(rng.integers(0, max(1, width - face.width)))
+            top = int(rng.integers(0, max(1, height - face.height)))
+            box = (left, top, left + face.width, top + face.height)
+            if all(box[2] <= b[0] or box[0] >= b[2] or box[3] <= b[1] or box[1] >= b[3] for b in placed_boxes):
+                canvas.paste(face, (left, top))
+                placed_boxes.append(box)
+                placed_names.append(name)
+                break
+    return placed_names
+
+def generate_corpus(corpus_dir, num_images=DEFAULT_NUM_IMAGES, seed=DEFAULT_SEED, train_dir=TRAIN_DIR):
+    """
+    シードから決定的に合成コーパスを作る。
+    images/ : 解像度・顔の数がさまざまな画像（切り抜き・振り分け・識別用）
+    train/  : 人物ごとのフォルダに1人1顔の画像（学習用）
+    """
+    rng = np.random.default_rng(seed)
+    sources = collect_source_faces(train_dir)
+    if not sources:
+        raise FileNotFoundError(f"'{train_dir}' に顔画像がないため、合成コーパスを作成できません。")
+    names = list(sources)
+    images_dir = os.path.join(corpus_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+
+    manifest = {"seed": seed, "num_images": num_images, "source_fingerprint": source_fingerprint(sources),
+                "persons": names, "images": [], "train": []}
+    for i in range(num_images):
+        width, height = RESOLUTIONS[int(rng.integers(len(RESOLUTIONS)))]
+        num_faces = min(FACE_COUNTS[int(rng.integers(len(FACE_COUNTS)))], len(names))
+        canvas = make_background(rng, width, height)
+        chosen = [names[j] for j in rng.permutation(len(names))[:num_faces]]
+        identities = paste_faces(rng, canvas, sources, chosen)
+        filename = f"bench_{i:05d}.jpg"
+        canvas.save(os.path.join(images_dir, filename), quality=90)
+        manifest["images"].append({"filename": filename, "width": width, "height": height,
+                                   "identities": identities})
+
+    for name in names:
+        person_dir = os.path.join(corpus_dir, "train", name)
+        os.makedirs(person_dir, exist_ok=True)
+        for j in range(TRAIN_IMAGES_PER_PERSON):
+            width, height = RESOLUTIONS[int(rng.integers(2))]  # 学習用は小さめの画像
+            canvas = make_background(rng, width, height)
+            paste_faces(rng, canvas, sources, [name])
+            filename = f"{name}_{j:03d}.jpg"
+            canvas.save(os.path.join(person_dir, filename), quality=90)
+            manifest["train"].append({"filename": os.path.join(name, filename), "identity": name})
+
+    with open(os.path.join(corpus_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+def load_corpus(corpus_dir=None, num_images=DEFAULT_NUM_IMAGES, seed=DEFAULT_SEED, log=print, train_dir=TRAIN_DIR):
+    """
+    コーパスを読み込む。corpus_dir を省略した場合は、シード・枚数・train_data の顔画像のハッシュごとの
+    合成コーパスを .pica_bench/ に作成して再利用する（2回目以降は生成しない）。
+    戻り値: {"dir", "images": [パス], "train": [(パス, 人物名)], "manifest"}
+    """
+    if corpus_dir is None:
+        sources = collect_source_faces(train_dir)
+        if not sources:
+            raise FileNotFoundError(f"'{train_dir}' に顔画像がありません。--corpus で既存のコーパスを指定してください。")
+        corpus_dir = os.path.join(BENCH_DIR, f"corpus_s{seed}_n{num_images}_{source_fingerprint(sources)}")
+    elif not os.path.exists(os.path.join(corpus_dir, "manifest.json")):
+        raise FileNotFoundError(f"'{corpus_dir}' に manifest.json がありません。")
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    else:
+        log(f"合成コーパスを作成中: {corpus_dir}")
+        manifest = generate_corpus(corpus_dir, num_images, seed, train_dir=train_dir)
+    return {
+        "dir": corpus_dir,
+        "images": [os.path.join(corpus_dir, "images", item["filename"]) for item in manifest["images"]],
+        "train": [(os.path.join(corpus_dir, "train", item["filename"]), item["identity"])
+                  for item in manifest["train"]],
+        "manifest": manifest,
+    }
+
+# --- 3. 各ツールの処理（ツールと同じ image_pipeline の1枚分の処理をGUIなしで実行） ---
+
+def bench_crop(corpus, detector, profiler, work_dir, model=None, quality=None):
+    """顔切り抜きツール: 検出 → 切り抜き → 保存"""
+    db = FaceDatabase(os.path.join(work_dir, "crop.db"))
+    output_dir = os.path.join(work_dir, "crop_output")
+    os.makedirs(output_dir, exist_ok=True)
+    for image_path in corpus["images"]:
+        profiler.count("images")
+        crop_image(db, image_path, output_dir, detector, quality, profiler)
+    with profiler.stage("db"):
+        db.close()
+    return None
+
+def bench_train(corpus, detector, profiler, work_dir, model=None, quality=None):
+    """学習ツール: 1人1顔の画像から特徴量を抽出し、SVMを学習する。戻り値: (clf, le) または None"""
+    db = FaceDatabase(os.path.join(work_dir, "train.db"))
+    known_encodings = []
+    known_names = []
+    for image_path, name in corpus["train"]:
+        profiler.count("images")
+        encodings = encode_training_image(db, image_path, name, detector, quality, profiler)
+        if encodings:
+            known_encodings.append(encodings[0])
+            known_names.append(name)
+    with profiler.stage("db"):
+        db.close()
+
+    if len(set(known_names)) < 2:
+        return None  # SVMの学習には2人以上必要
+    with profiler.stage("fit"):
+        le = LabelEncoder()
+        clf = SVC(kernel='linear', C=1, gamma='scale', probability=True, cache_size=SVM_CACHE_MB)
+        clf.fit(known_encodings, le.fit_transform(known_names))
+    with profiler.stage("io"):
+        save_model_bundle(os.path.join(work_dir, "model.pkl"), clf, le, quality or tier_settings())
+    return clf, le
+
+def bench_sort(corpus, detector, profiler, work_dir, model=None, quality=None):
+    """振り分けツール: 検出 → 識別 → フォルダへ配置 → インデックス書き込み"""
+    clf, le = model
+    db = FaceDatabase(os.path.join(work_dir, "sort.db"))
+    results = []
+    for image_path in corpus["images"]:
+        profiler.count("images")
+        faces = classify_image(db, image_path, clf, le, CONF_THRESHOLD, detector, quality, "bench", profiler)
+        profiler.count("faces", len(faces))
+        results.append({"filename": os.path.basename(image_path), "faces": faces, "error": False})
+    with profiler.stage("db"):
+        db.close()
+    # フォルダへの配置と出力は分散振り分けと同じ処理（sort_faces_gui.py と同じ出力）
+    write_output(os.path.join(corpus["dir"], "images"), os.path.join(work_dir, "sort_output"), results, le.classes_,
+                 False, OUTPUT_MODE_COPY, profiler)
+    return None
+
+def bench_identify(corpus, detector, profiler, work_dir, model=None, quality=None):
+    """識別アプリ: 検出 → 識別 → サムネイル作成 → キャッシュ保存"""
+    clf, le = model
+    db = FaceDatabase(os.path.join(work_dir, "identify.db"))
+    cache = ResultCache("bench", cache_dir=os.path.join(work_dir, "cache"))
+    for image_path in corpus["images"]:
+        profiler.count("images")
+        with profiler.stage("cache"):
+            cache_key = cache.key_for(image_path)
+        entry = identify_image(db, cache, image_path, cache_key, clf, le, CONF_THRESHOLD, detector, quality, "bench",
+                               profiler)
+        profiler.count("faces", len(entry["face_locations"]))
+    with profiler.stage("db"):
+        db.close()
+    return None
+
+BENCHMARK_FUNCTIONS = {"crop": bench_crop, "train": bench_train, "sort": bench_sort, "identify": bench_identify}
+
+# --- 4. 実行 ---
+
+def warm_up(detector):
+    """モデルの初回読み込みを計測に含めないよう、小さな画像で1回検出しておく"""
+    dummy = np.zeros((64, 64, 3), dtype=np.uint8)
+    for model in (("hog", "cnn") if detector not in ("hog", "cnn") else (detector,)):
+        face_recognition.face_locations(dummy, model=model)
+
+def run_benchmarks(corpus, detector=DEFAULT_DETECTOR, names=BENCHMARKS, repeat=1, log=print,
+                   tier=DEFAULT_TIER, train_tier=DEFAULT_TIER):
+    """
+    ベンチマークを実行する。各ベンチマークは毎回新しい作業フォルダ・DB・キャッシュで行い、
+    repeat 回のうち最も速かった結果を採用する。
+    sort / identify は train で学習したモデルを使う（学習できない場合は計測しない）。
+    train は train_tier、それ以外は tier の品質設定で実行する（ランドマークモデルは学習時に合わせる）。
+    戻り値: {ベンチマーク名: StageProfiler.summary()}
+    """
+    warm_up(detector)
+    results = {}
+    model = None
+    order = [name for name in BENCHMARKS if name in names or (name == "train" and {"sort", "identify"} & set(names))]
+    for name in order:
+        if name in ("sort", "identify") and model is None:
+            continue
+        best = None
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix=f"pica_bench_{name}_")
+            profiler = StageProfiler(name)
+            try:
+                profiler.start()
+                if name == "train":
+                    quality = tier_settings(train_tier)
+                else:
+                    quality = inference_settings(tier, tier_settings(train_tier) if model is not None else None)
+                output = BENCHMARK_FUNCTIONS[name](corpus, detector, profiler, work_dir, model, quality)
+                profiler.stop()
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            summary = profiler.summary()
+            if best is None or summary["images_per_sec"] > best["images_per_sec"]:
+                best = summary
+            if name == "train":
+                model = output
+        if name == "train" and model is None:
+            log("⚠️ 学習用の顔が2人分以上ないため、sort / identify は計測しません。")
+        if name in names:
+            results[name] = best
+            log(f"{name:<10}{best['images_per_sec']:>10.2f} 枚/秒  (顔/画像 {best['faces_per_image']:.2f}, "
+                f"{best['wall_sec']:.1f}s)")
+    return results
+
+# --- 5. ベースラインとの比較 ---
+
+def environment_info():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpu_count": os.cpu_count()}
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    ベースラインと比較し、性能低下の一覧を返す。
+    - 画像/秒 がベースラインの (1 - tolerance) 倍を下回った
+    - ステージの p50 がベースラインの (1 + tolerance) 倍を上回った（MIN_STAGE_MS 未満のステージは除く）
+    戻り値: [説明文, ...]（空なら性能低下なし）
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        if base["images_per_sec"] > 0 and current["images_per_sec"] < base["images_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: 画像/秒 {base['images_per_sec']:.2f} → {current['images_per_sec']:.2f}")
+        for stage, stats in current["stages"].items():
+            base_stage = base["stages"].get(stage)
+            if base_stage is None or base_stage["p50_ms"] < MIN_STAGE_MS:
+                continue
+            if stats["p50_ms"] > base_stage["p50_ms"] * (1 + tolerance):
+                regressions.append(f"{name}/{stage}: p50 {base_stage['p50_ms']:.1f}ms → {stats['p50_ms']:.1f}ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PICA ベンチマーク（GUIなし・CPUのみで実行可能）")
+    parser.add_argument("--corpus", help="既存のコーパスフォルダ（省略時は合成コーパスを作成）")
+    parser.add_argument("--images", type=int, default=DEFAULT_NUM_IMAGES, help="合成コーパスの画像数")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="合成コーパスのシード")
+    parser.add_argument("--detector", default=DEFAULT_DETECTOR, choices=POLICIES, help="検出ポリシー")
+    parser.add_argument("--tier", default=DEFAULT_TIER, choices=list(QUALITY_TIERS), help="品質ティア（学習以外）")
+    parser.add_argument("--train-tier", default=DEFAULT_TIER, choices=list(QUALITY_TIERS), help="学習の品質ティア")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=1, help="繰り返し回数（最速の結果を採用）")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="ベースラインのJSONファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="許容する低下率 (0〜1)")
+    parser.add_argument("--output", help="結果のJSONの保存先（省略時は .pica_bench/ に保存）")
+    args = parser.parse_args(argv)
+
+    try:
+        corpus = load_corpus(args.corpus, args.images, args.seed)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        return 2
+    print(f"コーパス: {corpus['dir']} ({len(corpus['images'])} 枚, 学習用 {len(corpus['train'])} 枚)")
+    print(f"検出モデル: {args.detector} | 品質ティア: {args.tier} (学習: {args.train_tier})\n")
+    results = run_benchmarks(corpus, args.detector, args.only, max(1, args.repeat),
+                             tier=args.tier, train_tier=args.train_tier)
+
+    config = {"detector": args.detector, "tier": args.tier, "train_tier": args.train_tier,
+              "corpus": os.path.basename(os.path.normpath(corpus["dir"])),
+              "images": len(corpus["images"]), "seed": corpus["manifest"].get("seed"),
+              "source": corpus["manifest"].get("source_fingerprint")}
+    report = {"config": config, "environment": environment_info(),
+              "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "benchmarks": results}
+
+    output_path = args.output or os.path.join(BENCH_DIR, f"results_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果: {output_path}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("❌ ベースラインがないため比較できません（基準のマシンで --save-baseline を付けて作成してください）。")
+        return 2
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(f"❌ ベースラインと条件が異なるため比較できません: {baseline.get('config')} / 今回: {config}")
+        print("   同じ条件で実行するか、基準のマシンで --save-baseline を付けてベースラインを作り直してください。")
+        return 2
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ 性能低下 (許容 {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n✅ ベースラインからの性能低下なし (許容 {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+# distributed_sort.py
+
+import os
+import sys
+import time
+import socket
+import secrets
+import argparse
+import ipaddress
+import threading
+import subprocess
+from collections import defaultdict, deque
+from multiprocessing.connection import Listener, Client
+from face_database import FaceDatabase, DB_FILE
+from image_pipeline import classify_image
+from result_cache import model_version
+from stage_profiler import StageProfiler, timed
+from face_detection import POLICIES, POLICY_ADAPTIVE
+from quality_tiers import QUALITY_TIERS, TIER_FAST, load_model_bundle, inference_settings
+from sort_index import (decide_folders, make_record, make_result_image, write_sidecar, write_index, place_file,
+                        save_results, INDEX_CSV_NAME, OUTPUT_MODES, OUTPUT_MODE_COPY)
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILE = os.path.join(PROJECT_ROOT, "face_classifier_model.pkl")
+DEFAULT_HOST = "127.0.0.1"   # 他のマシンのワーカーを受け付ける場合は 0.0.0.0
+DEFAULT_PORT = 47251
+AUTHKEY_ENV = "PICA_AUTHKEY" # 接続時の共有キーを渡す環境変数（コマンドライン引数は ps で他のユーザーから見えるため）
+DEFAULT_THRESHOLD = 0.77
+DETECTION_POLICY = POLICY_ADAPTIVE
+QUALITY_TIER = TIER_FAST
+
+SHARD_SIZE = 32       # 1回の割り当て（シャード）のファイル数
+LEASE_SEC = 300       # ワーカーからこの秒数結果が届かなければ、割り当てを取り消して他のワーカーに回す
+MAX_ATTEMPTS = 3      # ファイルごとの最大試行回数（超えたら Unknown (Error) に振り分ける）
+STEAL_MIN_FILES = 2   # 残りがこの件数以上の割り当てから、未処理の後半を空いたワーカーに回す
+WAIT_SEC = 1.0        # 割り当てるファイルがないときにワーカーを待たせる秒数
+CONNECT_TIMEOUT_SEC = 30  # ワーカーがコーディネーターへの接続を試み続ける秒数
+STATUS_INTERVAL_SEC = 5   # コーディネーターが進捗を表示する間隔
+
+# --- 2. コーディネーター: シャードの貸し出しと回収 ---
+
+class ShardCoordinator:
+    """
+    ファイル一覧をシャードに分けてワーカーに貸し出し（リース）、結果を集める。
+    - ワーカーは1ファイルごとに結果を送り、応答として「このシャードで続けて処理するファイル」を受け取る
+      （結果が届くたびにリースを延長する）
+    - 接続が切れた・リースが切れたワーカーの未処理ファイルはキューに戻す（試行回数は処理中だったファイルだけ加算）
+    - キューが空になったら、残りの多いシャードの後半を空いたワーカーに回す（ワークスティーリング）
+    - 同じファイルの結果が2回届いた場合は、先に届いた方を使う
+    """
+
+    def __init__(self, filenames, shard_size=SHARD_SIZE, lease_sec=LEASE_SEC, max_attempts=MAX_ATTEMPTS):
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+        self.pending = deque(list(filenames[i:i + shard_size]) for i in range(0, len(filenames), shard_size))
+        self.leases = {}                   # {シャードID: {"worker", "files"(未処理), "deadline"}}
+        self.attempts = defaultdict(int)   # {ファイル名: 失敗回数}
+        self.results = {}                  # {ファイル名: 結果}
+        self.total = len(filenames)
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.stats = defaultdict(int)      # shards / stolen / retried / failed / duplicates
+        self.worker_files = defaultdict(int)  # {ワーカー: 処理したファイル数}
+        self.workers = set()               # 接続中のワーカー
+        self._next_id = 0
+        if not filenames:
+            self.done.set()
+
+    def connect(self, worker):
+        with self._lock:
+            self.workers.add(worker)
+
+    def request(self, worker):
+        """ワーカーに次の割り当てを返す（{"type": "shard" / "wait" / "done", ...}）"""
+        with self._lock:
+            if self.done.is_set():
+                return {"type": "done"}
+            files = None
+            while self.pending and not files:
+                files = [f for f in self.pending.popleft() if f not in self.results]
+            if not files:
+                files = self._steal_locked(worker)
+            if not files:
+                return {"type": "wait", "seconds": WAIT_SEC}
+            shard_id = self._next_id
+            self._next_id += 1
+            self.leases[shard_id] = {"worker": worker, "files": files, "deadline": time.time() + self.lease_sec}
+            self.stats["shards"] += 1
+            return {"type": "shard", "shard_id": shard_id, "files": list(files)}
+
+    def _steal_locked(self, worker):
+        """他のワーカーの割り当てのうち、残りが最も多いものの後半を取り上げる"""
+        candidates = [lease for lease in self.leases.values()
+                      if lease["worker"] != worker and len(lease["files"]) >= STEAL_MIN_FILES]
+        if not candidates:
+            return None
+        victim = max(candidates, key=lambda lease: len(lease["files"]))
+        keep = (len(victim["files"]) + 1) // 2  # 先頭（処理中のファイル）は元のワーカーに残す
+        victim["files"], stolen = victim["files"][:keep], victim["files"][keep:]
+        self.stats["stolen"] += len(stolen)
+        return stolen
+
+    def report(self, worker, shard_id, result):
+        """
+        1ファイル分の結果を受け取る。処理中の例外（result["failed"]）は再試行に回す。
+        戻り値: このシャードで続けて処理するファイルのリスト（空なら次の割り当てを要求する）
+        """
+        with self._lock:
+            filename = result["filename"]
+            if result.get("failed"):
+                self._requeue_locked([filename])
+            elif filename in self.results:
+                self.stats["duplicates"] += 1
+            else:
+                self.results[filename] = result
+                self.worker_files[worker] += 1
+            lease = self.leases.get(shard_id)
+            if lease is None:
+                remaining = []  # リースが切れている（他のワーカーに回した）
+            else:
+                if filename in lease["files"]:
+                    lease["files"].remove(filename)
+                lease["deadline"] = time.time() + self.lease_sec
+                remaining = list(lease["files"])
+                if not remaining:
+                    del self.leases[shard_id]
+            self._check_done_locked()
+            return remaining
+
+    def release(self, worker):
+        """ワーカーとの接続が切れたら、そのワーカーの未処理ファイルをキューに戻す"""
+        with self._lock:
+            self.workers.discard(worker)
+            for shard_id, lease in list(self.leases.items()):
+                if lease["worker"] == worker:
+                    del self.leases[shard_id]
+                    self._requeue_lease_locked(lease)
+            self._check_done_locked()
+
+    def expire(self):
+        """リースの期限が切れた割り当てをキューに戻す（応答のないワーカー対策）"""
+        with self._lock:
+            now = time.time()
+            for shard_id, lease in list(self.leases.items()):
+                if lease["deadline"] < now:
+                    del self.leases[shard_id]
+                    self._requeue_lease_locked(lease)
+            self._check_done_locked()
+
+    def _requeue_lease_locked(self, lease):
+        """
+        取り消したリースのファイルをキューに戻す。ワーカーは先頭から1件ずつ処理するので、
+        試行回数を加算するのは先頭（処理中だったファイル）だけ。残りは未着手なのでそのまま戻す。
+        """
+        self._requeue_locked(lease["files"][:1])
+        untouched = [f for f in lease["files"][1:] if f not in self.results]
+        if untouched:
+            self.pending.append(untouched)
+
+    def _requeue_locked(self, files):
+        """処理に失敗したファイルの試行回数を加算してキューに戻す（上限に達したら Unknown (Error) にする）"""
+        retry = []
+        for filename in files:
+            if filename in self.results:
+                continue
+            self.attempts[filename] += 1
+            if self.attempts[filename] >= self.max_attempts:
+                self.results[filename] = {"filename": filename, "faces": [], "error": True}
+                self.stats["failed"] += 1
+            else:
+                retry.append(filename)
+        if retry:
+            self.pending.append(retry)
+            self.stats["retried"] += len(retry)
+
+    def _check_done_locked(self):
+        if len(self.results) >= self.total:
+            self.done.set()
+
+    def progress(self):
+        with self._lock:
+            return len(self.results), self.total, len(self.workers)
+
+def serve_worker(coordinator, conn, config):
+    """1つのワーカー接続を処理する（接続ごとのスレッド）"""
+    worker = None
+    try:
+        hello = conn.recv()
+        worker = hello.get("worker")
+        if hello.get("model_version") != config["model_version"]:
+            conn.send({"type": "reject", "reason": f"モデルのバージョンが異なります "
+                                                   f"(コーディネーター: {config['model_version']}, "
+                                                   f"ワーカー: {hello.get('model_version')})"})
+            return
+        coordinator.connect(worker)
+        conn.send(dict(config, type="config"))
+        while True:
+            message = conn.recv()
+            if message["type"] == "request":
+                reply = coordinator.request(worker)
+                conn.send(reply)
+                if reply["type"] == "done":
+                    break
+            elif message["type"] == "result":
+                files = coordinator.report(worker, message["shard_id"], message["result"])
+                conn.send({"type": "ack", "files": files})
+    except (EOFError, OSError):
+        pass  # ワーカーの終了・切断（未処理分は release でキューに戻す）
+    finally:
+        if worker is not None:
+            coordinator.release(worker)
+        conn.close()
+
+# --- 3. コーディネーター: 実行と結果の統合 ---
+
+def run_coordinator(test_dir, output_dir, threshold=DEFAULT_THRESHOLD, multi_label=False,
+                    output_mode=OUTPUT_MODE_COPY, host=DEFAULT_HOST, port=DEFAULT_PORT, authkey=None,
+                    local_workers=0, tier=QUALITY_TIER, detector=DETECTION_POLICY, model_file=MODEL_FILE,
+                    shard_size=SHARD_SIZE, lease_sec=LEASE_SEC, log=print):
+    """
+    入力フォルダの画像をワーカーに分散して識別し、結果を出力フォルダとインデックスにまとめる。
+    local_workers > 0 なら、このマシンでワーカーのプロセスを起動する。
+    authkey: 接続時の共有キー（省略時は無作為に生成して表示する）
+    戻り値: 終了コード（0: 成功）
+    """
+    if not os.path.isdir(test_dir):
+        log(f"🚨 エラー: 入力フォルダ '{test_dir}' が見つかりません。")
+        return 1
+    _, le, _ = load_model_bundle(model_file)
+    filenames = sorted(f for f in os.listdir(test_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if not filenames:
+        log("🚨 警告: 入力フォルダに画像ファイルが見つかりませんでした。")
+        return 1
+
+    profiler = StageProfiler("sort_distributed")
+    profiler.start()
+    coordinator = ShardCoordinator(filenames, shard_size, lease_sec)
+    config = {"test_dir": os.path.abspath(test_dir), "threshold": threshold, "tier": tier, "detector": detector,
+              "model_version": model_version(model_file)}
+
+    # 接続は pickle でやり取りするため、キーを知らない相手に接続させない（固定のキーは使わない）
+    generated = not authkey
+    authkey = authkey or secrets.token_hex(16)
+    listener = Listener((host, port), authkey=authkey.encode())
+    address = listener.address
+    log(f"✅ コーディネーター: {address[0]}:{address[1]} | ファイル数={len(filenames)}, "
+        f"シャード={shard_size} 件, しきい値={threshold}, 品質ティア={tier}")
+    if generated and not is_loopback(host):
+        log(f"接続キー: {authkey}（ワーカーは環境変数 {AUTHKEY_ENV} に設定して起動してください）")
+
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                return  # listener を閉じた
+            except Exception:
+                continue  # 認証の失敗など（その接続だけ無視する）
+            threading.Thread(target=serve_worker, args=(coordinator, conn, config), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+    connect_host = "127.0.0.1" if address[0] in ("0.0.0.0", "") else address[0]
+    worker_env = dict(os.environ, **{AUTHKEY_ENV: authkey}) # キーは引数ではなく環境変数で渡す
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker",
+                          "--connect", f"{connect_host}:{address[1]}"], env=worker_env)
+        for _ in range(local_workers)
+    ]
+
+    # 全ファイルの結果が揃うまで待つ（期限切れのリースの回収と進捗の表示）
+    start_time = time.time()
+    last_status = 0.0
+    try:
+        with profiler.stage("distribute"):
+            while not coordinator.done.wait(1.0):
+                coordinator.expire()
+                done, total, workers = coordinator.progress()
+                if processes and workers == 0 and all(p.poll() is not None for p in processes):
+                    log("🚨 エラー: すべてのローカルワーカーが終了しました。")
+                    return 1
+                if time.time() - last_status >= STATUS_INTERVAL_SEC:
+                    last_status = time.time()
+                    rate = done / max(time.time() - start_time, 1e-9)
+                    log(f"  > {done} / {total} ファイル | ワーカー {workers} 台 | {rate:.2f} 枚/秒")
+
+        results = [coordinator.results[f] for f in filenames]
+        write_output(test_dir, output_dir, results, le.classes_, multi_label, output_mode, profiler)
+    finally:
+        listener.close()
+        for process in processes:
+            try:
+                process.wait(timeout=WAIT_SEC * 5)  # 「完了」を受け取って終了するのを待つ
+            except subprocess.TimeoutExpired:
+                process.terminate()
+
+    profiler.count("images", len(filenames))
+    profiler.count("faces", sum(len(result["faces"]) for result in results))
+    for key, value in coordinator.stats.items():
+        profiler.count(key, value)
+    profile_path = profiler.stop()
+    log("\n--- 処理統計 ---")
+    log(profiler.summary_text())
+    if profile_path:
+        log(f"cProfileの結果: {profile_path}")
+    log("ワーカー別: " + ", ".join(f"{w}={n}" for w, n in sorted(coordinator.worker_files.items())))
+    log(f"\n✅ 処理完了！ {len(filenames)} ファイルを振り分けました。結果: '{output_dir}'")
+    log(f"顔・矩形・確信度の一覧: {os.path.join(output_dir, INDEX_CSV_NAME)}")
+    return 0
+
+def write_output(test_dir, output_dir, results, classes, multi_label, output_mode, profiler=None):
+    """ワーカーの結果から、sort_faces_gui.py と同じ出力（フォルダ・サイドカー・インデックス・確率）を作る"""
+    os.makedirs(output_dir, exist_ok=True)
+    index_records = []
+    result_images = []
+    for result in results:
+        filename, faces = result["filename"], result["faces"]
+        image_path = os.path.join(test_dir, filename)
+        folders = [("Unknown (Error)", 0.0)] if result["error"] else decide_folders(faces, multi_label)
+        for name, _ in folders:
+            output_folder_path = os.path.join(output_dir, name)
+            os.makedirs(output_folder_path, exist_ok=True)
+            with timed(profiler, "io"):
+                place_file(image_path, os.path.join(output_folder_path, filename), output_mode)
+        index_records.append(make_record(filename, image_path, faces, [name for name, _ in folders]))
+        result_images.append(make_result_image(filename, image_path, faces, [name for name, _ in folders],
+                                               len(classes), result["error"]))
+    with timed(profiler, "index"):
+        for record in index_records:
+            write_sidecar(output_dir, record)
+        write_index(output_dir, index_records)
+        save_results(output_dir, classes, result_images)
+
+# --- 4. ワーカー ---
+
+def connect(address, authkey, timeout=CONNECT_TIMEOUT_SEC):
+    """コーディネーターに接続する（起動を待つため、timeout 秒まで再試行する）"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return Client(address, authkey=authkey.encode())
+        except (ConnectionRefusedError, OSError):
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+
+def run_worker(address, authkey, input_dir=None, model_file=MODEL_FILE, db_path=DB_FILE, log=print):
+    """
+    コーディネーターから割り当てられたファイルを検出・識別し、1ファイルずつ結果を返す。
+    input_dir: 入力フォルダのこのマシンでのパス（省略時はコーディネーターと同じパス。共有フォルダを想定）
+    戻り値: 終了コード（0: 成功）
+    """
+    clf, le, model_quality = load_model_bundle(model_file)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    conn = connect(address, authkey)
+    conn.send({"type": "hello", "worker": worker, "model_version": model_version(model_file)})
+    config = conn.recv()
+    if config["type"] == "reject":
+        log(f"🚨 {worker}: 接続を拒否されました: {config['reason']}")
+        conn.close()
+        return 1
+
+    test_dir = input_dir or config["test_dir"]
+    quality = inference_settings(config["tier"], model_quality)
+    db = FaceDatabase(db_path)
+    profiler = StageProfiler("sort_worker")
+    profiler.start()
+    try:
+        while True:
+            conn.send({"type": "request"})
+            reply = conn.recv()
+            if reply["type"] == "done":
+                break
+            if reply["type"] == "wait":
+                time.sleep(reply["seconds"])
+                continue
+            files = reply["files"]
+            while files:
+                filename = files[0]
+                profiler.count("images")
+                try:
+                    # sort_faces_gui.py と同じ image_pipeline の処理を使う
+                    faces = classify_image(db, os.path.join(test_dir, filename), clf, le, config["threshold"],
+                                           config["detector"], quality, config["model_version"], profiler)
+                    result = {"filename": filename, "faces": faces, "error": False}
+                    profiler.count("faces", len(faces))
+                except Exception as e:
+                    log(f"⚠️ {worker}: ファイル {filename} の処理中にエラーが発生しました: {e}")
+                    result = {"filename": filename, "failed": True}
+                conn.send({"type": "result", "shard_id": reply["shard_id"], "result": result})
+                files = conn.recv()["files"]
+    except (EOFError, OSError):
+        log(f"⚠️ {worker}: コーディネーターとの接続が切れました。")
+    finally:
+        db.flush()
+        db.close()
+        conn.close()
+        profiler.stop()
+    log(f"--- {worker} ---\n{profiler.summary_text()}")
+    return 0
+
+# --- 5. コマンドライン ---
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return (host or DEFAULT_HOST, int(port))
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # ホスト名は他のマシンから届くものとして扱う
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PICA 分散振り分け（コーディネーター / ワーカー）")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    coord = sub.add_parser("coordinator", help="ファイルをワーカーに分散し、結果を出力フォルダにまとめる")
+    coord.add_argument("input_dir", help="振り分け対象の画像フォルダ")
+    coord.add_argument("output_dir", help="振り分け先のフォルダ")
+    coord.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="確信度しきい値")
+    coord.add_argument("--multi-label", action="store_true", help="グループ写真は写っている全員のフォルダに配置する")
+    coord.add_argument("--output-mode", default=OUTPUT_MODE_COPY, choices=OUTPUT_MODES, help="配置方法")
+    coord.add_argument("--listen", default=f"{DEFAULT_HOST}:{DEFAULT_PORT}",
+                       help="待ち受けるアドレス（他のマシンから接続する場合は 0.0.0.0:ポート。--authkey か "
+                            f"環境変数 {AUTHKEY_ENV} で接続キーを指定する）")
+    coord.add_argument("--local-workers", type=int, default=0, help="このマシンで起動するワーカー数")
+    coord.add_argument("--tier", default=QUALITY_TIER, choices=list(QUALITY_TIERS), help="品質ティア")
+    coord.add_argument("--detector", default=DETECTION_POLICY, choices=POLICIES, help="検出ポリシー")
+    coord.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="1回の割り当てのファイル数")
+    coord.add_argument("--lease", type=float, default=LEASE_SEC, help="割り当てを取り消すまでの秒数")
+    coord.add_argument("--authkey", default=os.environ.get(AUTHKEY_ENV),
+                       help=f"接続時の共有キー（省略時は環境変数 {AUTHKEY_ENV}、それもなければ無作為に生成して表示）")
+    coord.add_argument("--model", default=MODEL_FILE, help="モデルファイル")
+
+    work = sub.add_parser("worker", help="コーディネーターに接続して検出・識別を行う")
+    work.add_argument("--connect", default=f"{DEFAULT_HOST}:{DEFAULT_PORT}", help="コーディネーターのアドレス")
+    work.add_argument("--input-dir", help="入力フォルダのこのマシンでのパス（省略時はコーディネーターと同じ）")
+    work.add_argument("--authkey", default=os.environ.get(AUTHKEY_ENV),
+                      help=f"接続時の共有キー（省略時は環境変数 {AUTHKEY_ENV}。引数は ps で見えるため環境変数を推奨）")
+    work.add_argument("--model", default=MODEL_FILE, help="モデルファイル（コーディネーターと同じ内容が必要）")
+    work.add_argument("--db", default=DB_FILE, help="検出結果のDB")
+    args = parser.parse_args(argv)
+
+    if args.mode == "worker":
+        if not args.authkey:
+            print(f"🚨 エラー: 接続キーがありません。コーディネーターが表示したキーを環境変数 {AUTHKEY_ENV} に設定してください。")
+            return 1
+        return run_worker(parse_address(args.connect), args.authkey, args.input_dir, args.model, args.db)
+    host, port = parse_address(args.listen)
+    return run_coordinator(args.input_dir, args.output_dir, args.threshold, args.multi_label, args.output_mode,
+                           host, port, args.authkey, max(0, args.local_workers), args.tier, args.detector,
+                           args.model, max(1, args.shard_size), args.lease)
+
+if __name__ == "__main__":
+    sys.exit(main())
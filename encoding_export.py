@@ -0,0 +1,302 @@
+# encoding_export.py
+
+import os
+import sys
+import json
+import argparse
+from contextlib import contextmanager
+import numpy as np
+from face_database import FaceDatabase, DB_FILE
+from training_memory import ENCODING_DIM, DISTANCE_CHUNK_ROWS
+
+try:
+    import fcntl  # Mac/Linux のファイルロック
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows のファイルロック
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.path.join(PROJECT_ROOT, "encoding_store")
+ENCODINGS_FILE_NAME = "encodings.npy"  # (N, 128) float32
+METADATA_FILE_NAME = "metadata.npy"    # N 行の構造化配列（encodings.npy と同じ行順）
+IMAGES_FILE_NAME = "images.jsonl"      # image_id → パス・内容ハッシュ（1行1画像）
+LABELS_FILE_NAME = "labels.json"       # identity / source の番号 → 名前
+LOCK_FILE_NAME = ".lock"
+HEADER_BYTES = 256   # .npy ヘッダーの固定長（行数が増えてもヘッダーを上書きするだけで済むように余白を確保する）
+SYNC_BATCH = 10000   # DBから1回に読み込む顔の数
+
+METADATA_DTYPE = np.dtype([
+    ("face_id", "<i8"),      # DBの顔ID（faces.id）
+    ("image_id", "<i8"),     # DBの画像ID（images.id。images.jsonl で パスに変換）
+    ("top", "<i4"), ("right", "<i4"), ("bottom", "<i4"), ("left", "<i4"),
+    ("identity", "<i4"),     # labels.json の identities の番号（-1: 識別結果なし）
+    ("confidence", "<f4"),   # NaN: 確信度なし
+    ("source", "<i2"),       # labels.json の sources の番号（-1: 不明）
+])
+ENCODING_DTYPE = np.dtype("<f4")
+
+# --- 2. 追記できる .npy ファイル ---
+
+def _write_header(f, dtype, rows, tail_shape=()):
+    """固定長（HEADER_BYTES）の .npy バージョン1.0 ヘッダーを先頭に書き込む"""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+        np.lib.format.dtype_to_descr(dtype), (rows,) + tuple(tail_shape))
+    size = HEADER_BYTES - 10  # マジック(6) + バージョン(2) + ヘッダー長(2)
+    if len(header) + 1 > size:
+        raise ValueError("npy ヘッダーが HEADER_BYTES に収まりません")
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + size.to_bytes(2, 'little') + (header.ljust(size - 1) + "\n").encode('latin1'))
+
+def _read_rows(path):
+    """ヘッダーに書かれた行数（確定済みの行数）を読む"""
+    with open(path, 'rb') as f:
+        np.lib.format.read_magic(f)
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+    return shape[0]
+
+def _append_rows(path, array, committed_rows, tail_shape=()):
+    """
+    確定済みの行の直後にデータを書き込む（ヘッダーはまだ更新しない）。
+    前回の追記が途中で中断していた場合、ヘッダーの行数より後ろのデータは上書きされる。
+    """
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_BYTES + committed_rows * array.dtype.itemsize * int(np.prod(tail_shape, dtype=np.int64)))
+        f.write(np.ascontiguousarray(array).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+def _commit_rows(path, dtype, rows, tail_shape=()):
+    with open(path, 'r+b') as f:
+        _write_header(f, dtype, rows, tail_shape)
+        f.flush()
+        os.fsync(f.fileno())
+
+# --- 3. エンコーディングの保存先 ---
+
+class EncodingStore:
+    """
+    処理した全ての顔のエンコーディングを、追記専用のファイルに保存する。
+    - encodings.npy : (N, 128) float32 の行列。np.load(path, mmap_mode='r') で、他のプロセスからコピーせずに読める
+    - metadata.npy  : N 行の構造化配列（METADATA_DTYPE）。行の順番は encodings.npy と同じ
+    - images.jsonl  : image_id → パス・内容ハッシュ
+    - labels.json   : identity / source の番号 → 名前
+    追記は既存部分を書き換えず、末尾にデータを書き込んでから最後にヘッダーの行数を更新する。
+    途中で中断しても、ヘッダーの行数までのデータは常に有効（読み込み側は常に確定済みの行だけを見る）。
+    """
+
+    def __init__(self, directory=EXPORT_DIR):
+        self.directory = directory
+        self.encodings_path = os.path.join(directory, ENCODINGS_FILE_NAME)
+        self.metadata_path = os.path.join(directory, METADATA_FILE_NAME)
+        self.images_path = os.path.join(directory, IMAGES_FILE_NAME)
+        self.labels_path = os.path.join(directory, LABELS_FILE_NAME)
+        self.lock_path = os.path.join(directory, LOCK_FILE_NAME)
+
+    @contextmanager
+    def locked(self):
+        """書き込みの排他（同時に起動した複数のツールからの追記を1つずつ行う）"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _ensure_files(self):
+        for path, dtype, tail in ((self.encodings_path, ENCODING_DTYPE, (ENCODING_DIM,)),
+                                  (self.metadata_path, METADATA_DTYPE, ())):
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    _write_header(f, dtype, 0, tail)
+
+    def count(self):
+        """確定済みの行数"""
+        if not os.path.exists(self.metadata_path) or not os.path.exists(self.encodings_path):
+            return 0
+        return min(_read_rows(self.encodings_path), _read_rows(self.metadata_path))
+
+    def load_labels(self):
+        if not os.path.exists(self.labels_path):
+            return {"identities": [], "sources": []}
+        with open(self.labels_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_labels(self, labels):
+        tmp_path = self.labels_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(labels, f, ensure_ascii=False)
+        os.replace(tmp_path, self.labels_path)
+
+    def exported_image_ids(self):
+        ids = set()
+        if os.path.exists(self.images_path):
+            with open(self.images_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        ids.add(json.loads(line)["image_id"])
+        return ids
+
+    def last_face_id(self):
+        """最後に追記した顔のDBの顔ID（まだ何もなければ 0）"""
+        rows = self.count()
+        if rows == 0:
+            return 0
+        return int(np.load(self.metadata_path, mmap_mode='r')[rows - 1]["face_id"])
+
+    def append(self, faces, encodings, known_images=None):
+        """
+        顔の一覧（FaceDatabase.faces_after の形式）とエンコーディング行列を末尾に追記する（locked() の中で呼ぶ）。
+        known_images: 追記済みの image_id の集合（images.jsonl に同じ画像を重複して書かないため。更新される）
+        """
+        self._ensure_files()
+        labels = self.load_labels()
+        identity_index = {name: i for i, name in enumerate(labels["identities"])}
+        source_index = {name: i for i, name in enumerate(labels["sources"])}
+        metadata = np.zeros(len(faces), dtype=METADATA_DTYPE)
+        new_images = []
+        known_images = self.exported_image_ids() if known_images is None else known_images
+        for i, face in enumerate(faces):
+            identity = face["identity"]
+            if identity is not None and identity not in identity_index:
+                identity_index[identity] = len(labels["identities"])
+                labels["identities"].append(identity)
+            source = face["source"]
+            if source is not None and source not in source_index:
+                source_index[source] = len(labels["sources"])
+                labels["sources"].append(source)
+            metadata[i] = (face["face_id"], face["image_id"], *face["box"],
+                           identity_index[identity] if identity is not None else -1,
+                           np.nan if face["confidence"] is None else face["confidence"],
+                           source_index[source] if source is not None else -1)
+            if face["image_id"] not in known_images:
+                known_images.add(face["image_id"])
+                new_images.append({"image_id": face["image_id"], "path": face["path"],
+                                   "content_hash": face["content_hash"]})
+
+        # 名前の表と画像の表を先に書く（行が確定する前に中断しても、余分な名前・画像が残るだけで害はない）
+        self._save_labels(labels)
+        if new_images:
+            with open(self.images_path, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(image, ensure_ascii=False) + "\n" for image in new_images))
+        rows = self.count()
+        _append_rows(self.encodings_path, np.asarray(encodings, dtype=ENCODING_DTYPE), rows, (ENCODING_DIM,))
+        _append_rows(self.metadata_path, metadata, rows)
+        # ヘッダーの行数を更新して確定する（メタデータを後に更新し、count() は少ない方を採用する）
+        _commit_rows(self.encodings_path, ENCODING_DTYPE, rows + len(faces), (ENCODING_DIM,))
+        _commit_rows(self.metadata_path, METADATA_DTYPE, rows + len(faces))
+        return rows + len(faces)
+
+# --- 4. DBからの差分エクスポート ---
+
+def sync_from_db(db, store=None, batch=SYNC_BATCH):
+    """
+    DBに記録された顔のうち、まだ追記していないもの（顔IDが最後に追記した顔より大きいもの）を追記する。
+    追記後にDBで識別結果が更新された顔は、追記した時点の値のまま（追記専用のため）。
+    戻り値: 追記した顔の数
+    """
+    store = store or EncodingStore()
+    added = 0
+    with store.locked():
+        last_face_id = store.last_face_id()
+        known_images = store.exported_image_ids()
+        while True:
+            faces, encodings = db.faces_after(last_face_id, batch)
+            if not faces:
+                break
+            store.append(faces, encodings, known_images)
+            last_face_id = faces[-1]["face_id"]
+            added += len(faces)
+    return added
+
+# --- 5. 読み込み（他のプロセスから） ---
+
+def open_store(directory=EXPORT_DIR):
+    """
+    エクスポートをメモリマップで開く（データはコピーしない）。
+    戻り値: {"encodings": (N, 128) の memmap, "metadata": N 行の memmap, "identities": [...], "sources": [...],
+             "images": {image_id: {"path", "content_hash"}}}
+    """
+    store = EncodingStore(directory)
+    rows = store.count()
+    encodings = np.load(store.encodings_path, mmap_mode='r')[:rows] if rows else np.zeros((0, ENCODING_DIM), ENCODING_DTYPE)
+    metadata = np.load(store.metadata_path, mmap_mode='r')[:rows] if rows else np.zeros(0, METADATA_DTYPE)
+    labels = store.load_labels()
+    images = {}
+    if os.path.exists(store.images_path):
+        with open(store.images_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    image = json.loads(line)
+                    images[image.pop("image_id")] = image
+    return {"encodings": encodings, "metadata": metadata, "identities": labels["identities"],
+            "sources": labels["sources"], "images": images}
+
+def similar_faces(exported, encoding, top_k=10):
+    """
+    エンコーディングが近い顔を探す（DISTANCE_CHUNK_ROWS 行ずつ計算し、全体を一度にメモリに載せない）。
+    戻り値: [(行番号, 距離), ...]（距離の小さい順）
+    """
+    query = np.asarray(encoding, dtype=np.float32)
+    matrix = exported["encodings"]
+    best_rows = np.zeros(0, dtype=np.int64)
+    best_distances = np.zeros(0, dtype=np.float32)
+    for start in range(0, len(matrix), DISTANCE_CHUNK_ROWS):
+        distances = np.linalg.norm(matrix[start:start + DISTANCE_CHUNK_ROWS] - query, axis=1)
+        best_rows = np.concatenate([best_rows, np.arange(start, start + len(distances))])
+        best_distances = np.concatenate([best_distances, distances])
+        if len(best_rows) > top_k:
+            keep = np.argpartition(best_distances, top_k)[:top_k]
+            best_rows, best_distances = best_rows[keep], best_distances[keep]
+    order = np.argsort(best_distances)
+    return [(int(best_rows[i]), float(best_distances[i])) for i in order]
+
+# --- 6. コマンドライン ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="顔エンコーディングのエクスポート（追記専用・メモリマップで読み込み可能）")
+    parser.add_argument("command", choices=("sync", "info", "similar"),
+                        help="sync: DBの新しい顔を追記 / info: 件数の表示 / similar: 近い顔の検索")
+    parser.add_argument("face_id", nargs="?", type=int, help="similar: 基準にする顔のDBの顔ID")
+    parser.add_argument("--dir", default=EXPORT_DIR, help="エクスポート先のフォルダ")
+    parser.add_argument("--db", default=DB_FILE, help="検出結果のDB")
+    parser.add_argument("--top", type=int, default=10, help="similar: 表示する件数")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        db = FaceDatabase(args.db)
+        try:
+            added = sync_from_db(db, EncodingStore(args.dir))
+        finally:
+            db.close()
+        print(f"{added} 件の顔を追記しました（合計 {EncodingStore(args.dir).count()} 件）: {args.dir}")
+        return 0
+
+    exported = open_store(args.dir)
+    if args.command == "info":
+        print(f"顔: {len(exported['metadata'])} 件 | 画像: {len(exported['images'])} 枚 | "
+              f"人物: {len(exported['identities'])} 人 | {args.dir}")
+        return 0
+
+    rows = np.flatnonzero(exported["metadata"]["face_id"] == args.face_id)
+    if args.face_id is None or len(rows) == 0:
+        print("🚨 エラー: 指定した顔IDがエクスポートにありません（先に sync を実行してください）。")
+        return 1
+    for row, distance in similar_faces(exported, exported["encodings"][rows[0]], args.top):
+        meta = exported["metadata"][row]
+        identity = exported["identities"][meta["identity"]] if meta["identity"] >= 0 else "-"
+        path = exported["images"].get(int(meta["image_id"]), {}).get("path", "?")
+        print(f"{distance:.4f}  {identity:<20} {path}  box={tuple(int(meta[k]) for k in ('top', 'right', 'bottom', 'left'))}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
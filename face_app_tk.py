@@ -6,41 +6,62 @@ from PIL import Image, ImageTk
 import os
 import pickle
 import numpy as np
-import face_recognition
 from io import BytesIO
 from collections import defaultdict
 import datetime
 import math # スクロールバーのための数学関数
+import queue
+import threading
+from result_cache import ResultCache, model_version
+from folder_watch import FolderWatcher
+from face_assignment import assign_identities, UNKNOWN_INDEX
+from face_database import FaceDatabase
+from image_pipeline import identify_image
+from stage_profiler import StageProfiler, show_summary_window, timed
+from face_detection import POLICY_ADAPTIVE
+from quality_tiers import load_model_bundle, inference_settings, settings_key, TIER_BALANCED
+from progress_bus import ProgressBus, BusDrainer
+from image_dedup import find_duplicates, scale_locations, summary_text as dedup_summary
 
 # --- 1. 定数設定 ---
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__)) 
 MODEL_FILE = os.path.join(PROJECT_ROOT, "face_classifier_model.pkl")
 CONFIDENCE_THRESHOLD = 0.78
 MAP_FILE = os.path.join(PROJECT_ROOT, "name_id_map.pkl") 
+LIVE_REFRESH_MS = 200 # ライブ識別時に結果を描画する間隔（ミリ秒）
+DETECTION_POLICY = POLICY_ADAPTIVE # まずHOG、顔がない/質が低い場合だけCNN（face_detection.py）
+QUALITY_TIER = TIER_BALANCED # ランドマークモデルは学習時の設定に合わせる（quality_tiers.py）
 
 # --- 2. モデルのロード ---
 def load_model():
-    """モデル、エンコーダー、IDマップを読み込む"""
+    """モデル、エンコーダー、学習時の品質設定、IDマップを読み込む"""
     try:
-        with open(MODEL_FILE, 'rb') as f:
-            (clf, le) = pickle.load(f)
+        clf, le, model_quality = load_model_bundle(MODEL_FILE)
         
         id_name_map = None
         if os.path.exists(MAP_FILE):
              with open(MAP_FILE, 'rb') as f:
                 id_name_map = pickle.load(f)
                 
-        return clf, le, id_name_map
+        return clf, le, model_quality, id_name_map
         
     except FileNotFoundError:
         messagebox.showerror("エラー", f"モデルファイルが見つかりません: {MODEL_FILE}\n先に学習を実行してください。")
-        return None, None, None
+        return None, None, None, None
     except Exception as e:
         messagebox.showerror("エラー", f"モデルロード中に予期せぬエラーが発生しました: {e}")
-        return None, None, None
+        return None, None, None, None
 
 # アプリ起動時にモデルをロード
-clf, le, id_name_map = load_model()
+clf, le, model_quality, id_name_map = load_model()
+QUALITY = inference_settings(QUALITY_TIER, model_quality) # 検出・エンコーディングの設定
+
+# 識別結果・サムネイルのキャッシュ（キーは画像の内容ハッシュ + モデルバージョン + 品質設定 + 検出ポリシー）
+MODEL_VERSION = model_version(MODEL_FILE)
+result_cache = ResultCache(f"{MODEL_VERSION}{settings_key(QUALITY)}_{DETECTION_POLICY}") if clf is not None else None
+
+# 検出結果・識別結果の保存先
+face_db = FaceDatabase() if clf is not None else None
 
 # --- 3. メインアプリの定義 ---
 
@@ -73,13 +94,59 @@ class FaceIdentificationApp:
         )
         self.select_button.pack(pady=5)
 
+        # フォルダ監視（ライブ識別）ボタン
+        self.live_button = tk.Button(
+            master,
+            text="👁 フォルダ監視を開始 (ライブ識別)",
+            command=self.toggle_live_mode,
+            font=('Helvetica', 12),
+            bg='lightgoldenrod',
+            padx=10,
+            pady=5
+        )
+        self.live_button.pack(pady=5)
+
+        # 処理統計ボタン
+        tk.Button(master, text="📊 処理統計", command=lambda: show_summary_window(self.master, self.profiler),
+                  font=('Helvetica', 10)).pack(pady=2)
+
+        # 動画ファイル/カメラでの識別ボタン
+        video_frame = tk.Frame(master)
+        video_frame.pack(pady=5)
+        tk.Button(video_frame, text="🎥 動画ファイルで識別", command=self.select_video,
+                  font=('Helvetica', 12), bg='thistle', padx=10, pady=5).pack(side='left', padx=5)
+        tk.Button(video_frame, text="📷 カメラで識別", command=lambda: self.start_video(0),
+                  font=('Helvetica', 12), bg='thistle', padx=10, pady=5).pack(side='left', padx=5)
+
         # ステータスラベル
         self.status_label = tk.Label(master, text=f"準備完了 | 学習人数: {len(le.classes_)}人", pady=10)
         self.status_label.pack()
+
+        # 作業スレッドからの進捗・描画依頼（GUIスレッドがタイマーでまとめて反映）
+        self.bus = ProgressBus()
+        self.drainer = BusDrainer(master, self.bus, status_label=self.status_label)
         
         # PIL.ImageをTkinter.PhotoImageに変換したものを保持するための辞書
         self.tk_images = {} 
 
+        # 直前の処理の統計（ステージ別の所要時間）
+        self.profiler = None
+        self.dedup_text = "" # 直近の処理の重複ファイルの要約
+
+        # 結果表示の配置位置
+        self.grid_row = 0
+        self.grid_col = 0
+
+        # ライブ識別用: フォルダ監視と、ワーカースレッドからGUIスレッドへの受け渡しキュー
+        self.watcher = None
+        self.live_results = queue.Queue()
+
+        # 動画識別用
+        self.video_window = None
+        self.video_capture = None
+        self.video_identifier = None
+        self.video_after_id = None # 次のフレーム処理の予約（停止時に取り消す）
+
 
     def create_result_area(self, master):
         """結果表示用のキャンバスとフレームをセットアップする"""
@@ -123,6 +190,150 @@ class FaceIdentificationApp:
         # 識別処理を開始
         self.process_files(list(file_paths))
 
+    # --- 4.1. フォルダ監視（ライブ識別） ---
+    def toggle_live_mode(self):
+        """フォルダ監視の開始/停止を切り替える"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.profiler.stop()
+            self.live_button.config(text="👁 フォルダ監視を開始 (ライブ識別)")
+            self.select_button.config(state=tk.NORMAL)
+            self.status_label.config(text="フォルダ監視を停止しました。")
+            return
+
+        watch_dir = filedialog.askdirectory(title="監視するフォルダ (画像の取り込み先) を選択してください")
+        if not watch_dir:
+            return
+
+        # 既存の結果をクリア
+        self.tk_images.clear()
+        for widget in self.results_frame.winfo_children():
+            widget.destroy()
+        self.grid_row = 0
+        self.grid_col = 0
+
+        self.profiler = StageProfiler("identify_live")
+        self.profiler.start()
+        self.watcher = FolderWatcher(watch_dir, self.analyze_live_image)
+        self.watcher.start()
+        self.live_button.config(text="⏹ フォルダ監視を停止")
+        self.select_button.config(state=tk.DISABLED)
+        self.status_label.config(text=f"監視中 ({self.watcher.mode}): {watch_dir}")
+        self.master.after(LIVE_REFRESH_MS, self.drain_live_results)
+
+    def analyze_live_image(self, file_path):
+        """ワーカースレッドで実行: 解析のみ行い、描画はGUIスレッドに任せる"""
+        try:
+            analysis = self.get_analysis(file_path)
+            face_db.flush()
+            self.live_results.put((file_path, analysis, None))
+        except Exception as e:
+            self.live_results.put((file_path, None, e))
+            raise
+
+    def drain_live_results(self):
+        """GUIスレッドで定期実行: 解析済みの結果を描画し、計測値を表示する"""
+        while True:
+            try:
+                file_path, analysis, error = self.live_results.get_nowait()
+            except queue.Empty:
+                break
+            if error is None:
+                with self.profiler.stage("gui"):
+                    self.render_analysis(file_path, analysis)
+            else:
+                self.display_result_item(file_path, f"エラー: {error}", 0, self.grid_row, self.grid_col)
+                self.advance_grid()
+
+        if self.watcher is not None:
+            self.status_label.config(text=f"監視中 ({self.watcher.mode}) | {self.watcher.metrics.summary()}")
+            self.master.after(LIVE_REFRESH_MS, self.drain_live_results)
+
+    # --- 4.2. 動画ファイル/カメラでの識別 ---
+    def select_video(self):
+        """動画ファイルを選択して識別を開始する"""
+        video_path = filedialog.askopenfilename(
+            filetypes=[("Video files", "*.mp4 *.mov *.avi *.mkv"), ("All files", "*.*")],
+            title="識別する動画ファイルを選択してください"
+        )
+        if video_path:
+            self.start_video(video_path)
+
+    def start_video(self, source):
+        """動画（またはカメラ）の再生ウィンドウを開き、フレーム処理を開始する"""
+        # OpenCV は動画の識別でだけ使うため、ここで読み込む（未インストールでも画像の識別は使える）
+        try:
+            from video_stream import VideoFaceIdentifier, open_source
+        except ImportError as e:
+            messagebox.showerror("エラー", f"動画の識別には OpenCV (opencv-python) が必要です。\n{e}")
+            return
+        self.stop_video()
+
+        self.video_capture = open_source(source)
+        if not self.video_capture.isOpened():
+            messagebox.showerror("エラー", f"動画を開けませんでした: {source}")
+            self.video_capture = None
+            return
+
+        classify = lambda encodings: [self.identify_probabilities(p) for p in clf.predict_proba(encodings)]
+        self.video_identifier = VideoFaceIdentifier(classify, quality=QUALITY)
+        self.video_start_time = datetime.datetime.now()
+
+        self.video_window = tk.Toplevel(self.master)
+        self.video_window.title(f"🎥 動画識別: {source}")
+        self.video_window.protocol("WM_DELETE_WINDOW", self.stop_video)
+        self.video_label = tk.Label(self.video_window)
+        self.video_label.pack()
+        self.video_status = tk.Label(self.video_window, text="", fg='blue')
+        self.video_status.pack(pady=5)
+
+        self.video_after_id = self.master.after(1, self.update_video_frame)
+
+    def update_video_frame(self):
+        """1フレーム読み込んで識別・描画し、次のフレームを予約する"""
+        self.video_after_id = None
+        if self.video_capture is None:
+            return
+
+        ok, frame = self.video_capture.read()
+        if not ok:
+            self.video_identifier.flush()
+            self.video_status.config(text=self.video_status.cget("text") + " | 再生終了")
+            self.video_capture.release()
+            self.video_capture = None
+            return
+
+        self.video_identifier.process_frame(frame)
+        self.video_identifier.draw(frame)
+
+        # OpenCV(BGR) → PIL(RGB) → Tkinter
+        tk_img = ImageTk.PhotoImage(Image.fromarray(frame[:, :, ::-1]))
+        self.tk_images["video_frame"] = tk_img
+        self.video_label.config(image=tk_img)
+
+        stats = self.video_identifier.stats()
+        elapsed = (datetime.datetime.now() - self.video_start_time).total_seconds()
+        fps = stats["frames"] / elapsed if elapsed > 0 else 0.0
+        self.video_status.config(
+            text=f"{fps:.1f} fps | フレーム {stats['frames']} | 検出 {stats['detections']} 回 | 顔 {len(self.video_identifier.tracks)}"
+        )
+        self.video_after_id = self.master.after(1, self.update_video_frame)
+
+    def stop_video(self):
+        """動画識別を終了してウィンドウを閉じる"""
+        if self.video_after_id is not None:
+            # 予約済みのフレーム処理を取り消す（すぐに再開した場合に古い予約が新しい動画を読まないように）
+            self.master.after_cancel(self.video_after_id)
+            self.video_after_id = None
+        if self.video_capture is not None:
+            self.video_capture.release()
+            self.video_capture = None
+        if self.video_window is not None:
+            self.video_window.destroy()
+            self.video_window = None
+        self.tk_images.pop("video_frame", None)
+
     # --- 5. 識別処理の統合 (Fletロジックを移植) ---
     
     def identify_face(self, face_encoding):
@@ -132,6 +343,13 @@ class FaceIdentificationApp:
         """
         # SVMモデルによる識別
         probabilities = clf.predict_proba([face_encoding])[0]
+        return self.identify_probabilities(probabilities)
+
+    def identify_probabilities(self, probabilities):
+        """
+        SVMの確率ベクトルから識別結果を決定する（キャッシュ済みの確率を再利用するため分離）
+        戻り値: (予測名, 信頼度)
+        """
         max_prob_index = np.argmax(probabilities)
         max_prob = probabilities[max_prob_index]
         
@@ -222,127 +440,151 @@ class FaceIdentificationApp:
                 
     #     return final_predictions
 
-    def apply_best_match_logic(self, raw_predictions):
+    def apply_best_match_logic(self, probabilities):
         """
-        同じ画像内で検出された顔について、各人物名の予測のうち、
-        最も信頼度の高い1つの顔のみを採用し、他をUnknownに強制変更するロジック。
+        同じ画像内で検出された全ての顔について、「顔 × 人物」の確率行列から
+        1人物につき最大1つの顔を最適に割り当て、割り当てられなかった顔をUnknownにする。
+        画像ごとに、全ての顔の識別が終わった後で1回だけ呼び出す。
+        戻り値: [(名前, 信頼度%), ...]（顔の順番どおり）
         """
-        best_match_index_per_name = {} # {name: (highest_confidence, index)}
-        
-        # 1. 各人物名について、最も信頼度の高い顔のインデックスを記録
-        for idx, (name, confidence) in enumerate(raw_predictions):
-            
-            # しきい値を超えている、かつUnknownでない場合のみ処理
-            # confidenceはパーセンテージ(0-100)として扱います
-            if confidence >= CONFIDENCE_THRESHOLD * 100 and name != "Unknown":
-                
-                # 記録されている最高信頼度よりも高い場合、または未記録の場合に更新
-                # 同率の場合、先に記録されたもの(idxが若いもの)が優先される
-                if name not in best_match_index_per_name or confidence > best_match_index_per_name[name][0]:
-                    best_match_index_per_name[name] = (confidence, idx) # (信頼度, インデックス) を記録
+        assigned, confidences = assign_identities(probabilities, CONFIDENCE_THRESHOLD)
 
-        final_predictions = [] 
-        
-        # 2. 最終判定: 記録された最高信頼度のインデックスのみを採用
-        adopted_indices = set() # 採用されたインデックスを保持するセット
-        
-        # 採用インデックスをセットに格納
-        for confidence, idx in best_match_index_per_name.values():
-            adopted_indices.add(idx)
-            
-        # 最終的な予測リストを構築
-        for idx, (name, confidence) in enumerate(raw_predictions):
-            
-            # 採用インデックスに現在のインデックスがあるかチェック
-            if idx in adopted_indices:
-                # 採用された顔: そのまま採用
-                final_predictions.append((name, confidence))
+        final_predictions = []
+        for class_index, confidence in zip(assigned, confidences):
+            if class_index == UNKNOWN_INDEX:
+                final_predictions.append(("Unknown", confidence * 100))
             else:
-                # 排除された顔: Unknownに強制変更 (Unknownにしきい値未満も含む)
-                final_predictions.append(("Unknown", confidence))
+                predicted_id = le.classes_[class_index]
+                predicted_name = id_name_map.get(predicted_id, predicted_id) if id_name_map else predicted_id
+                final_predictions.append((predicted_name, confidence * 100))
                 
         return final_predictions
 
     def process_files(self, file_paths):
         """
-        選択されたファイルを処理し、顔識別を実行して結果を描画する
+        選択されたファイルを処理し、顔識別を実行して結果を描画する。
+        解析は作業スレッドで行い、描画はGUIスレッドがタイマーでまとめて行う。
         """
         self.status_label.config(text=f"{len(file_paths)} 個のファイルを処理中...")
-        self.master.update()
+        self.select_button.config(state=tk.DISABLED)
+        self.live_button.config(state=tk.DISABLED)
         
-        col = 0
-        row = 0
-        max_cols = 3 # 一行に表示する最大枚数
-
-        for file_path in file_paths:
-            try:
-                # 1. 画像の読み込みと顔検出
-                image = face_recognition.load_image_file(file_path)
-                #face_locations = face_recognition.face_locations(image, model="hog")
-                face_locations = face_recognition.face_locations(image, model="cnn")
-                face_encodings = face_recognition.face_encodings(image, face_locations)
-
-                if not face_encodings:
-                    self.display_result_item(file_path, "顔未検出", 0, row, col)
-                    col += 1
-                    if col >= max_cols:
-                        col = 0
-                        row += 1
-                    continue
-
-                #識別結果と切り抜き画像を格納するリストを用意
-                raw_predictions = [] # [(name, confidence), ...]
-                cropped_faces_data = [] # 切り抜き画像などのデータ格納
-                
-                # 2. 識別処理と結果表示
-                for face_encoding, (top, right, bottom, left) in zip(face_encodings, face_locations):
-                    
-                    # 識別
-                    predicted_name, confidence = self.identify_face(face_encoding)
-                    
-                    # 3. 顔の切り抜き（PILを使用）
-                    # face_recognitionの座標は(top, right, bottom, left)
-                    pil_image = Image.fromarray(image)
-                    
-                    # 顔の領域にパディングを追加 (顔の輪郭を捉えるため)
-                    padding = 50
-                    cropped_face = pil_image.crop((
-                        max(0, left - padding), 
-                        max(0, top - padding), 
-                        min(pil_image.width, right + padding), 
-                        min(pil_image.height, bottom + padding)
-                    ))
-
-                    # 収集: 結果をリストに格納 (描画はまだ行わない)
-                    raw_predictions.append((predicted_name, confidence))
-                    cropped_faces_data.append(cropped_face)
-
-                    #あと処理ロジック（同一人物誤認をUnknownに修正）
-                    final_predictions = self.apply_best_match_logic(raw_predictions)
-
-                    for i, cropped_face in enumerate(cropped_faces_data):
-                        final_name, final_confidence = final_predictions[i]
-
-                    # 結果をGUIに描画
-                    self.display_result_item(file_path, final_name, final_confidence, row, col, cropped_face)
-                    
-                    col += 1
-                    if col >= max_cols:
-                        col = 0
-                        row += 1
-
-            except Exception as e:
-                self.status_label.config(text=f"エラー: {file_path} の処理中にエラーが発生しました: {e}")
-                col += 1
-                if col >= max_cols:
-                    col = 0
-                    row += 1
-
-        self.status_label.config(text=f"処理完了！")
+        self.grid_row = 0
+        self.grid_col = 0
+        self.profiler = StageProfiler("identify")
+        self.profiler.start()
+        threading.Thread(target=self.analyze_files, args=(file_paths,)).start()
+
+    def analyze_files(self, file_paths):
+        """作業スレッドで実行: 解析のみ行い、描画は self.bus 経由でGUIスレッドに任せる"""
+        total_files = len(file_paths)
+        try:
+            # 検出の前に重複ファイルを見つけ、正本の解析結果を使い回す
+            with self.profiler.stage("dedup"):
+                dedup = find_duplicates(file_paths, face_db.content_hash_for)
+            self.profiler.count("dedup_exact", dedup["exact"])
+            self.profiler.count("dedup_perceptual", dedup["perceptual"])
+            self.dedup_text = dedup_summary(dedup, total_files)
+            shared = {} # 重複を持つ正本の解析結果 {正本のパス: analysis}
+
+            for index, file_path in enumerate(file_paths):
+                try:
+                    # 1. キャッシュの確認（同じ画像・同じモデルなら検出をスキップ。重複ファイルは正本の結果を使う）
+                    analysis = self.get_deduplicated_analysis(file_path, dedup, shared)
+
+                    # 2. 識別処理と結果表示（GUIスレッド）
+                    self.bus.call(self.render_timed, file_path, analysis)
+
+                except Exception as e:
+                    self.bus.call(self.status_label.config, text=f"エラー: {file_path} の処理中にエラーが発生しました: {e}")
+                    self.bus.call(self.advance_grid)
+                self.bus.progress(index + 1, text=f"処理中: {index + 1}/{total_files} ファイル")
+
+            # DBへの書き込みをまとめて確定
+            with self.profiler.stage("db"):
+                face_db.flush()
+        finally:
+            self.bus.call(self.finish_processing)
+
+    def render_timed(self, file_path, analysis):
+        with self.profiler.stage("gui"):
+            self.render_analysis(file_path, analysis)
+
+    def finish_processing(self):
+        """全ファイルの描画が終わった後にGUIスレッドで実行する"""
+        self.profiler.stop()
+        self.status_label.config(text=f"処理完了！ ({self.profiler.summary()['images_per_sec']:.2f} 枚/秒)\n"
+                                      f"{self.dedup_text}")
+        self.select_button.config(state=tk.NORMAL)
+        self.live_button.config(state=tk.NORMAL)
         # 処理完了後、スクロールバーを再調整
         self.results_frame.update_idletasks()
         self.canvas.config(scrollregion=self.canvas.bbox("all"))
 
+    def advance_grid(self):
+        """結果表示の配置位置を1つ進める"""
+        max_cols = 3 # 一行に表示する最大枚数
+        self.grid_col += 1
+        if self.grid_col >= max_cols:
+            self.grid_col = 0
+            self.grid_row += 1
+
+    def get_deduplicated_analysis(self, file_path, dedup, shared):
+        """重複ファイルは正本の解析結果を使い回す（矩形は解像度に合わせて変換）"""
+        canonical = dedup["canonical"].get(file_path, file_path)
+        if canonical in shared:
+            analysis = shared[canonical]
+        else:
+            analysis = self.get_analysis(canonical)
+            if canonical in dedup["has_duplicates"]:
+                shared[canonical] = analysis
+        if canonical == file_path:
+            return analysis
+        self.profiler.count("detect_skipped")
+        self.profiler.count("images")
+        self.profiler.count("faces", len(analysis["face_locations"]))
+        locations = scale_locations(analysis["face_locations"], dedup["sizes"][canonical], dedup["sizes"][file_path])
+        return dict(analysis, face_locations=locations)
+
+    def get_analysis(self, file_path):
+        """キャッシュがあればそれを使い、なければ解析してキャッシュに保存する"""
+        profiler = self.profiler
+        with timed(profiler, "cache"):
+            cache_key = result_cache.key_for(file_path)
+            analysis = result_cache.get(cache_key)
+        if analysis is None:
+            analysis = self.analyze_image(file_path, cache_key)
+        elif profiler is not None:
+            profiler.count("cache_hits")
+        if profiler is not None:
+            profiler.count("images")
+            profiler.count("faces", len(analysis["face_locations"]))
+        return analysis
+
+    def render_analysis(self, file_path, analysis):
+        """1ファイル分の解析結果を識別し、GUIに描画する"""
+        face_locations = analysis["face_locations"]
+        if not face_locations:
+            self.display_result_item(file_path, "顔未検出", 0, self.grid_row, self.grid_col)
+            self.advance_grid()
+            return
+
+        # 全ての顔の確率がそろった状態で、画像単位の割り当て（同一人物の重複をUnknownに修正）を1回だけ行う
+        final_predictions = self.apply_best_match_logic(analysis["probabilities"])
+
+        # 全ての顔の結果をGUIに描画
+        for (final_name, final_confidence), cropped_face in zip(final_predictions, analysis["thumbnails"]):
+            self.display_result_item(file_path, final_name, final_confidence, self.grid_row, self.grid_col, cropped_face)
+            self.advance_grid()
+
+    def analyze_image(self, file_path, cache_key):
+        """
+        顔検出・エンコーディング・識別確率の計算とサムネイル作成を行い、キャッシュに保存する
+        """
+        # ベンチマークと同じ image_pipeline の処理を使う
+        return identify_image(face_db, result_cache, file_path, cache_key, clf, le, CONFIDENCE_THRESHOLD,
+                              DETECTION_POLICY, QUALITY, MODEL_VERSION, profiler=self.profiler)
+
     def display_result_item(self, file_path, name, confidence, row, col, cropped_face=None):
         """
         単一の識別結果をresults_frameに表示する
@@ -352,9 +594,12 @@ class FaceIdentificationApp:
 
         # 1. 画像表示 (顔のサムネイル)
         if cropped_face:
-            # 画像をリサイズ
+            # 画像をリサイズ (キャッシュ済みのサムネイルは既に表示サイズなのでそのまま使う)
             display_size = (150, 150)
-            resized_image = cropped_face.resize(display_size, Image.Resampling.LANCZOS)
+            if cropped_face.size == display_size:
+                resized_image = cropped_face
+            else:
+                resized_image = cropped_face.resize(display_size, Image.Resampling.LANCZOS)
             
             # Tkinterで表示可能な形式に変換
             tk_img = ImageTk.PhotoImage(resized_image)
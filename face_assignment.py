@@ -0,0 +1,60 @@
+# face_assignment.py
+
+import numpy as np
+
+# scipy があればハンガリアン法（最適割り当て）、なければ貪欲法を使う
+try:
+    from scipy.optimize import linear_sum_assignment
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+UNKNOWN_INDEX = -1  # 人物が割り当てられなかった顔
+
+def assign_identities(probabilities, threshold, optimal=SCIPY_AVAILABLE):
+    """
+    1枚の画像内の「顔 × 人物」の確率行列から、1人物につき最大1つの顔を割り当てる。
+    しきい値未満の組み合わせは割り当てない。
+
+    probabilities: (顔の数, 人物数) の確率行列（clf.predict_proba の出力）
+    threshold: 確信度しきい値 (0〜1)
+    戻り値: (assigned, confidences)
+        assigned: 各顔の人物インデックス（割り当てなしは UNKNOWN_INDEX）
+        confidences: 割り当てた人物の確率（Unknownの顔は参考値として最大確率を返す）
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    num_faces = probabilities.shape[0]
+    assigned = np.full(num_faces, UNKNOWN_INDEX, dtype=np.int64)
+    if num_faces == 0:
+        return assigned, np.zeros(0)
+
+    confidences = probabilities.max(axis=1)
+    allowed = probabilities >= threshold
+    if not allowed.any():
+        return assigned, confidences
+
+    if optimal:
+        # 確率の合計が最大になる割り当て（しきい値未満は0として扱い、後で除外する）
+        scores = np.where(allowed, probabilities, 0.0)
+        rows, cols = linear_sum_assignment(scores, maximize=True)
+        keep = allowed[rows, cols]
+        assigned[rows[keep]] = cols[keep]
+    else:
+        # 貪欲法: 確率の高い組み合わせから順に、顔・人物とも未使用なら採用
+        face_idx, class_idx = np.nonzero(allowed)
+        order = np.argsort(-probabilities[face_idx, class_idx], kind='stable')
+        used_classes = set()
+        remaining = num_faces
+        for f, c in zip(face_idx[order], class_idx[order]):
+            if assigned[f] != UNKNOWN_INDEX or c in used_classes:
+                continue
+            assigned[f] = c
+            used_classes.add(c)
+            remaining -= 1
+            if remaining == 0:
+                break
+
+    # 割り当てた顔は、その人物の確率にする（最適割り当てでは最大確率の人物以外になることがある）
+    assigned_rows = np.flatnonzero(assigned != UNKNOWN_INDEX)
+    confidences[assigned_rows] = probabilities[assigned_rows, assigned[assigned_rows]]
+    return assigned, confidences
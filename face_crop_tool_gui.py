@@ -2,13 +2,19 @@
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import face_recognition
-from PIL import Image
 import os
 import shutil
+import threading # GUIをフリーズさせないために、処理を別スレッドで実行
+from face_database import FaceDatabase
+from image_pipeline import crop_image
+from stage_profiler import StageProfiler, show_summary_window
+from progress_bus import ProgressBus, BusDrainer
+from face_detection import POLICY_ADAPTIVE
+from quality_tiers import tier_settings, TIER_BALANCED
 
 # --- 設定 ---
-PADDING = 40  # 切り取る顔の周囲に加える余白（ピクセル）
+DETECTION_POLICY = POLICY_ADAPTIVE  # まずHOG、顔がない/質が低い場合だけCNN（face_detection.py）
+QUALITY_TIER = TIER_BALANCED  # 検出・エンコーディングの設定（quality_tiers.py）
 
 class FaceCropToolApp:
     def __init__(self, master):
@@ -46,8 +52,9 @@ class FaceCropToolApp:
         tk.Entry(output_frame, textvariable=self.output_dir_var, width=40).pack(side='left', fill='x', expand=True)
 
         # --- 処理実行ボタン ---
-        tk.Button(main_frame, text="🔴 顔切り取り処理を実行", command=self.start_processing, 
-                  font=('Helvetica', 12, 'bold'), bg='#FFCCCC', padx=20, pady=10).pack(pady=20)
+        self.run_button = tk.Button(main_frame, text="🔴 顔切り取り処理を実行", command=self.start_processing, 
+                                    font=('Helvetica', 12, 'bold'), bg='#FFCCCC', padx=20, pady=10)
+        self.run_button.pack(pady=20)
         
         # --- ステータスと進捗 ---
         tk.Label(main_frame, text="--- ステータス ---", font=('Helvetica', 10, 'italic')).pack(pady=(5, 0))
@@ -57,10 +64,19 @@ class FaceCropToolApp:
         
         self.progress_bar = ttk.Progressbar(main_frame, orient="horizontal", length=400, mode="determinate")
         self.progress_bar.pack(pady=10)
+
+        # 処理統計ボタン
+        tk.Button(main_frame, text="📊 処理統計", command=lambda: show_summary_window(self.master, self.profiler)).pack()
+        self.profiler = None
         
         # 処理中にエラーメッセージや警告を保持するリスト（コンソールとGUIで確認用）
         self.process_logs = []
 
+        # 作業スレッドからの進捗（GUIスレッドがタイマーでまとめて反映）
+        self.bus = ProgressBus()
+        self.drainer = BusDrainer(master, self.bus, progress_bar=self.progress_bar, status_label=self.status_label,
+                                  get_profiler=lambda: self.profiler)
+
     # --- コマンド ---
 
     def select_input_dir(self):
@@ -86,16 +102,9 @@ class FaceCropToolApp:
         if not output_dir:
             messagebox.showerror("エラー", "出力フォルダを選択してください。")
             return
-        
-        # 処理実行
-        self.process_directory(input_dir, output_dir)
-        
-    def process_directory(self, input_dir, output_dir):
-        """顔切り取りのメインロジックを実行"""
-        
+
         self.process_logs = []
         self.status_label.config(text="処理開始中...")
-        self.master.update()
 
         # 出力フォルダの準備と既存データ削除の確認
         if os.path.exists(output_dir):
@@ -114,58 +123,64 @@ class FaceCropToolApp:
             messagebox.showinfo("情報", "入力フォルダ内に画像ファイルが見つかりませんでした。")
             self.status_label.config(text="処理完了（画像なし）。")
             return
+        
+        # 処理実行（別スレッド）
+        self.run_button.config(state=tk.DISABLED)
+        threading.Thread(target=self.process_directory, args=(input_dir, output_dir, all_files)).start()
+        
+    def process_directory(self, input_dir, output_dir, all_files):
+        """顔切り取りのメインロジックを実行（作業スレッド。GUIの更新は self.bus 経由で行う）"""
+        total_files = len(all_files)
 
         # --- メイン処理 ---
         total_faces = 0
+        face_db = FaceDatabase() # 検出結果の保存先
+        profiler = StageProfiler("crop") # ステージ別の所要時間
+        profiler.start()
+        self.profiler = profiler
         
         for index, filename in enumerate(all_files):
             input_path = os.path.join(input_dir, filename)
             
-            # 進捗バーの更新
+            # 進捗バーの更新（最新の値だけがタイマーで反映される）
             progress_val = int(((index + 1) / total_files) * 100)
-            self.progress_bar['value'] = progress_val
-            self.status_label.config(text=f"処理中: {index + 1}/{total_files} 枚 ({progress_val}%)")
-            self.master.update()
+            self.bus.progress(progress_val, text=f"処理中: {index + 1}/{total_files} 枚 ({progress_val}%)")
             
+            profiler.count("images")
             try:
-                # 1. 画像の読み込みと顔検出
-                image = face_recognition.load_image_file(input_path)
-                face_locations = face_recognition.face_locations(image, model="cnn")
-                
-                if not face_locations:
+                # 検出 → DBに記録 → 顔ごとに切り抜いて保存（ベンチマークと同じ image_pipeline の処理）
+                saved = crop_image(face_db, input_path, output_dir, DETECTION_POLICY, tier_settings(QUALITY_TIER),
+                                   profiler=profiler)
+                if not saved:
                     self.process_logs.append(f"[⚠️ 警告] {filename}: 顔が検出されませんでした。スキップ。")
                     continue
-                
-                # 2. 各顔を切り取り、保存
-                for i, (top, right, bottom, left) in enumerate(face_locations):
-                    pil_image = Image.fromarray(image)
-                    
-                    # 座標にパディングを適用
-                    cropped_face = pil_image.crop((
-                        max(0, left - PADDING), 
-                        max(0, top - PADDING), 
-                        min(pil_image.width, right + PADDING), 
-                        min(pil_image.height, bottom + PADDING)
-                    ))
-                    
-                    # ファイル名の生成
-                    base_name, ext = os.path.splitext(filename)
-                    output_filename = f"{base_name}_face_{i+1}{ext}"
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    cropped_face.save(output_path)
-                    total_faces += 1
+                total_faces += saved
                 
             except Exception as e:
                 self.process_logs.append(f"[❌ エラー] {filename} の処理中にエラーが発生: {e}")
 
 
-        # --- 処理結果表示 ---
+        # DBへの書き込みをまとめて確定
+        with profiler.stage("db"):
+            face_db.close()
+        profile_path = profiler.stop()
+        print("\n--- 処理統計 ---")
+        print(profiler.summary_text())
+        if profile_path:
+            print(f"cProfileの結果: {profile_path}")
+
+        # 結果の表示はGUIスレッドで行う
+        self.bus.call(self.show_result, total_files, total_faces)
+
+    def show_result(self, total_files, total_faces):
+        """処理結果を表示する（GUIスレッド）"""
+        self.drainer.flush()
         self.progress_bar['value'] = 100
         
         result_message = f"✅ 処理が完了しました！\n"
         result_message += f"処理ファイル数: {total_files} 枚\n"
-        result_message += f"保存された顔画像数: {total_faces} 枚"
+        result_message += f"保存された顔画像数: {total_faces} 枚\n"
+        result_message += f"処理速度: {self.profiler.summary()['images_per_sec']:.2f} 枚/秒"
         
         self.status_label.config(text=result_message)
         
@@ -178,6 +193,7 @@ class FaceCropToolApp:
         
         # 実行完了後、進捗バーをリセット
         self.progress_bar['value'] = 0
+        self.run_button.config(state=tk.NORMAL)
 
 
 if __name__ == "__main__":
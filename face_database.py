@@ -0,0 +1,361 @@
+# face_database.py
+
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+import face_recognition
+from result_cache import file_content_hash
+from stage_profiler import timed
+from face_detection import detect_faces, downscale_image, recorded_detector, REUSABLE_DETECTORS
+from quality_tiers import tier_settings, settings_key
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(PROJECT_ROOT, "pica_faces.db")
+DEFAULT_DETECTOR = "cnn"  # 検出ポリシー（face_detection.POLICIES のいずれか）
+WRITE_BATCH_SIZE = 200  # この件数が溜まったら1トランザクションでまとめて書き込む
+SQL_IN_CHUNK = 900      # IN (...) に1回で渡すIDの数（SQLiteの変数の上限 999 未満）
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    detector TEXT NOT NULL,
+    path TEXT NOT NULL,
+    analyzed_at REAL NOT NULL,
+    UNIQUE (content_hash, detector)
+);
+CREATE TABLE IF NOT EXISTS image_paths (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS faces (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    face_index INTEGER NOT NULL,
+    top INTEGER NOT NULL,
+    right INTEGER NOT NULL,
+    bottom INTEGER NOT NULL,
+    left INTEGER NOT NULL,
+    encoding BLOB NOT NULL,
+    identity TEXT,
+    confidence REAL,
+    model_version TEXT,
+    source TEXT,
+    UNIQUE (image_id, face_index)
+);
+CREATE INDEX IF NOT EXISTS idx_faces_image ON faces (image_id);
+CREATE INDEX IF NOT EXISTS idx_faces_identity ON faces (identity);
+CREATE INDEX IF NOT EXISTS idx_images_path ON images (path);
+"""
+
+# --- 2. エンコーディングの変換 ---
+
+def encoding_to_blob(encoding):
+    return np.asarray(encoding, dtype=np.float64).tobytes()
+
+def blob_to_encoding(blob):
+    return np.frombuffer(blob, dtype=np.float64)
+
+# --- 3. データベース本体 ---
+
+class FaceDatabase:
+    """
+    全ツールの検出結果（画像、顔の矩形、エンコーディング、識別結果）を保存するSQLiteデータベース。
+    WALモードで開くため、ツールを同時に起動しても読み込みがブロックされない。
+    書き込みはバッファに溜め、WRITE_BATCH_SIZE 件ごと（または flush() 時）に1トランザクションで行う。
+    画像ごとの問い合わせ（content_hash_for / lookup）は、書き込み待ちの内容もメモリ上で参照するため、
+    バッファを書き込まずに答えられる。
+    """
+
+    def __init__(self, db_path=DB_FILE):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._pending = []  # 書き込み待ちのレコード
+        self._pending_index = {}  # {(content_hash, detector): 書き込み待ちの最新のレコード}
+        self._pending_paths = {}  # {パス: (サイズ, 更新時刻, 内容ハッシュ)}（書き込み待ちの image_paths）
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self.conn.close()
+
+    # --- 3.1. 読み込み ---
+
+    def content_hash_for(self, image_path):
+        """
+        画像の内容ハッシュを返す。サイズと更新時刻が前回と同じなら、ファイルを読まずにDBの値を使う。
+        """
+        stat = os.stat(image_path)
+        path = os.path.abspath(image_path)
+        with self._lock:
+            row = self._pending_paths.get(path) or self.conn.execute(
+                "SELECT size, mtime, content_hash FROM image_paths WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        content_hash = file_content_hash(image_path)
+        with self._lock:
+            self._pending_paths[path] = (stat.st_size, stat.st_mtime, content_hash) # 解析結果と同じトランザクションで書く
+            self._flush_if_full_locked()
+        return content_hash
+
+    def lookup(self, content_hash, detector=DEFAULT_DETECTOR):
+        """
+        解析済みの画像であれば、顔の情報を返す（なければ None）。
+        戻り値: {"image_id", "face_ids", "face_locations", "encodings"}
+                書き込み待ちの画像は image_id が None、face_ids が空
+        """
+        with self._lock:
+            pending = self._pending_index.get((content_hash, detector))
+            if pending is not None:
+                return {
+                    "image_id": None,
+                    "face_ids": [],
+                    "face_locations": [tuple(box) for box in pending[3]],
+                    "encodings": [blob_to_encoding(blob) for blob in pending[4]],
+                }
+            row = self.conn.execute(
+                "SELECT id FROM images WHERE content_hash = ? AND detector = ?", (content_hash, detector)
+            ).fetchone()
+            if row is None:
+                return None
+            faces = self.conn.execute(
+                "SELECT id, top, right, bottom, left, encoding FROM faces WHERE image_id = ? ORDER BY face_index",
+                (row[0],)
+            ).fetchall()
+        return {
+            "image_id": row[0],
+            "face_ids": [face[0] for face in faces],
+            "face_locations": [tuple(face[1:5]) for face in faces],
+            "encodings": [blob_to_encoding(face[5]) for face in faces],
+        }
+
+    def query_faces(self, identity=None, source=None, min_confidence=None, max_confidence=None):
+        """
+        条件に合う顔の一覧を返す。
+        戻り値: [{"face_id", "path", "box", "identity", "confidence", "model_version", "source"}, ...]
+        """
+        sql = ("SELECT faces.id, images.path, top, right, bottom, left, identity, confidence, model_version, source "
+               "FROM faces JOIN images ON faces.image_id = images.id WHERE 1 = 1")
+        params = []
+        if identity is not None:
+            sql += " AND identity = ?"
+            params.append(identity)
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        if min_confidence is not None:
+            sql += " AND confidence >= ?"
+            params.append(min_confidence)
+        if max_confidence is not None:
+            sql += " AND confidence < ?"
+            params.append(max_confidence)
+
+        with self._lock:
+            self._flush_locked()
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            {"face_id": r[0], "path": r[1], "box": tuple(r[2:6]), "identity": r[6],
+             "confidence": r[7], "model_version": r[8], "source": r[9]}
+            for r in rows
+        ]
+
+    def load_encodings(self, face_ids):
+        """顔IDのリストに対応するエンコーディング行列 (N, 128) を返す（SQL_IN_CHUNK 件ずつまとめて読む）"""
+        result = np.zeros((len(face_ids), 128), dtype=np.float64)
+        rows_by_id = {}
+        for i, face_id in enumerate(face_ids):
+            rows_by_id.setdefault(face_id, []).append(i)
+        ids = list(rows_by_id)
+        with self._lock: # 顔IDは書き込み済みの顔にしかないので、バッファを書き込む必要はない
+            for start in range(0, len(ids), SQL_IN_CHUNK):
+                chunk = ids[start:start + SQL_IN_CHUNK]
+                cursor = self.conn.execute(
+                    f"SELECT id, encoding FROM faces WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                for face_id, blob in cursor:
+                    result[rows_by_id[face_id]] = blob_to_encoding(blob)
+        return result
+
+    def load_identity_encodings(self, identity, dtype=np.float32):
+        """
+        指定した識別結果の顔をすべて読み込む。エンコーディングは件数分を先に確保した行列に直接書き込む。
+        戻り値: (顔情報のリスト [{"face_id", "path", "box"}], エンコーディング行列 (N, 128))
+        """
+        with self._lock:
+            self._flush_locked()
+            count = self.conn.execute("SELECT COUNT(*) FROM faces WHERE identity = ?", (identity,)).fetchone()[0]
+            matrix = np.zeros((count, 128), dtype=dtype)
+            faces = []
+            cursor = self.conn.execute(
+                "SELECT faces.id, images.path, top, right, bottom, left, encoding "
+                "FROM faces JOIN images ON faces.image_id = images.id WHERE identity = ? ORDER BY faces.id",
+                (identity,)
+            )
+            for i, row in enumerate(cursor):
+                if i >= count:
+                    break
+                faces.append({"face_id": row[0], "path": row[1], "box": tuple(row[2:6])})
+                matrix[i] = blob_to_encoding(row[6])
+        return faces, matrix[:len(faces)]
+
+    def faces_after(self, last_face_id, limit, dtype=np.float32):
+        """
+        顔IDが last_face_id より大きい顔を、ID順に最大 limit 件読み込む（エクスポートの差分読み込み用）。
+        戻り値: (顔情報のリスト [{"face_id", "image_id", "path", "content_hash", "box", "identity", "confidence",
+                 "source"}], エンコーディング行列 (N, 128))
+        """
+        with self._lock:
+            self._flush_locked()
+            rows = self.conn.execute(
+                "SELECT faces.id, faces.image_id, images.path, images.content_hash, top, right, bottom, left, "
+                "identity, confidence, source, encoding FROM faces JOIN images ON faces.image_id = images.id "
+                "WHERE faces.id > ? ORDER BY faces.id LIMIT ?",
+                (last_face_id, limit)
+            ).fetchall()
+        matrix = np.zeros((len(rows), 128), dtype=dtype)
+        faces = []
+        for i, row in enumerate(rows):
+            faces.append({"face_id": row[0], "image_id": row[1], "path": row[2], "content_hash": row[3],
+                          "box": tuple(row[4:8]), "identity": row[8], "confidence": row[9], "source": row[10]})
+            matrix[i] = blob_to_encoding(row[11])
+        return faces, matrix
+
+    # --- 3.2. 書き込み（バッファ経由） ---
+
+    def record(self, image_path, content_hash, face_locations, encodings, identities=None, confidences=None,
+               model_version=None, source=None, detector=DEFAULT_DETECTOR):
+        """
+        1画像分の解析結果を書き込みバッファに追加する。
+        既に同じ画像が登録されている場合は、識別結果（identity / confidence / model_version）を更新する。
+        """
+        num_faces = len(face_locations)
+        identities = identities if identities is not None else [None] * num_faces
+        confidences = confidences if confidences is not None else [None] * num_faces
+        with self._lock:
+            entry = (
+                os.path.abspath(image_path), content_hash, detector, list(face_locations),
+                [encoding_to_blob(e) for e in encodings], list(identities),
+                [None if c is None else float(c) for c in confidences], model_version, source
+            )
+            self._pending.append(entry)
+            self._pending_index[(content_hash, detector)] = entry
+            self._flush_if_full_locked()
+
+    def flush(self):
+        """書き込みバッファの内容を1トランザクションで書き込む"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_if_full_locked(self):
+        if len(self._pending) + len(self._pending_paths) >= WRITE_BATCH_SIZE:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending and not self._pending_paths:
+            return
+        pending, self._pending = self._pending, []
+        paths, self._pending_paths = self._pending_paths, {}
+        self._pending_index = {}
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO image_paths (path, size, mtime, content_hash) VALUES (?, ?, ?, ?)",
+                [(path, *values) for path, values in paths.items()]
+            )
+            for (path, content_hash, detector, locations, blobs, identities, confidences,
+                 model_version, source) in pending:
+                self.conn.execute(
+                    "INSERT INTO images (content_hash, detector, path, analyzed_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (content_hash, detector) DO UPDATE SET path = excluded.path",
+                    (content_hash, detector, path, now)
+                )
+                image_id = self.conn.execute(
+                    "SELECT id FROM images WHERE content_hash = ? AND detector = ?", (content_hash, detector)
+                ).fetchone()[0]
+                self.conn.executemany(
+                    "INSERT INTO faces (image_id, face_index, top, right, bottom, left, encoding, identity, "
+                    "confidence, model_version, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (image_id, face_index) DO UPDATE SET identity = excluded.identity, "
+                    "confidence = excluded.confidence, model_version = excluded.model_version, "
+                    "source = excluded.source",
+                    [
+                        (image_id, i, *[int(v) for v in box], blob, identity, confidence, model_version, source)
+                        for i, (box, blob, identity, confidence) in enumerate(zip(locations, blobs, identities, confidences))
+                    ]
+                )
+
+# --- 4. 検出のヘルパー（DBにあれば再利用） ---
+
+def detect_and_encode(db, image_path, detector=DEFAULT_DETECTOR, profiler=None, quality=None):
+    """
+    画像の顔検出とエンコーディング抽出を行う。DBに解析済みの結果があれば、CNN推論を行わずに再利用する。
+    detector は検出ポリシー（"cnn" / "hog" / "adaptive"）。DBの結果は同じポリシーか、
+    より精度の高い検出元（face_detection.REUSABLE_DETECTORS）のものを再利用する。
+    quality は品質ティアの設定（quality_tiers.tier_settings）。省略時は balanced。
+    設定が既定値と異なる場合は、DBの検出元に設定の識別子を付けて別の結果として保存する。
+    profiler を渡すと、db / decode / detect / encode の各ステージの所要時間と、使った検出器の回数を記録する。
+    戻り値: {"content_hash", "face_locations", "encodings", "image", "from_db", "detector"}
+            image は新たに読み込んだ場合のみ numpy 配列、DBから再利用した場合は None
+            detector はDBに記録するときの検出元（実際に使った検出器。record の detector にそのまま渡す）
+    """
+    quality = quality or tier_settings()
+    key = settings_key(quality)
+    content_hash = None
+    if db is not None:
+        with timed(profiler, "db"):
+            content_hash = db.content_hash_for(image_path)
+            for candidate in REUSABLE_DETECTORS.get(detector, (detector,)):
+                candidate += key
+                cached = db.lookup(content_hash, candidate)
+                if cached is not None:
+                    break
+        if cached is not None:
+            if profiler is not None:
+                profiler.count("db_hits")
+            return {
+                "content_hash": content_hash,
+                "face_locations": cached["face_locations"],
+                "encodings": cached["encodings"],
+                "image": None,
+                "from_db": True,
+                "detector": candidate,
+            }
+
+    with timed(profiler, "decode"):
+        image = face_recognition.load_image_file(image_path)
+        work_image, scale = downscale_image(image, quality["max_side"])
+    face_locations, used = detect_faces(work_image, detector, upsample=quality["upsample"], profiler=profiler)
+    with timed(profiler, "encode"):
+        encodings = face_recognition.face_encodings(
+            work_image, face_locations, num_jitters=quality["num_jitters"], model=quality["landmark_model"]
+        ) if face_locations else []
+    if scale != 1.0:
+        # 縮小した画像での矩形を元画像の座標に戻す
+        height, width = image.shape[:2]
+        face_locations = [
+            (max(0, int(top / scale)), min(width, int(right / scale)),
+             min(height, int(bottom / scale)), max(0, int(left / scale)))
+            for (top, right, bottom, left) in face_locations
+        ]
+    return {
+        "content_hash": content_hash,
+        "face_locations": face_locations,
+        "encodings": encodings,
+        "image": image,
+        "from_db": False,
+        "detector": recorded_detector(detector, used) + key,
+    }
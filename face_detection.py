@@ -0,0 +1,121 @@
+# face_detection.py
+
+import numpy as np
+import face_recognition
+from PIL import Image
+from stage_profiler import timed
+
+# --- 1. 定数設定 ---
+# 検出ポリシー（ツールごとに選択する）
+POLICY_CNN = "cnn"            # 常にCNN（高精度・低速。GPUがない環境では非常に遅い）
+POLICY_HOG = "hog"            # 常にHOG（高速。横顔・暗い写真・小さな顔に弱い）
+POLICY_ADAPTIVE = "adaptive"  # まずHOG、顔がない/検出結果の質が低い場合だけCNNで検出し直す
+POLICIES = (POLICY_CNN, POLICY_HOG, POLICY_ADAPTIVE)
+
+# DBに記録する検出元は実際に使った検出器。adaptive の品質判定を通ったHOGの結果は、
+# 判定なしのHOG（顔がなくてもCNNに切り替えない）と区別する
+DETECTOR_ADAPTIVE_HOG = "adaptive:hog"
+
+# DBの検出結果を再利用するときに受け付ける検出元（左から優先。CNNの結果はどのポリシーでも再利用できる）
+# POLICY_ADAPTIVE は、検出元を実際の検出器で記録する前に保存された結果
+REUSABLE_DETECTORS = {
+    POLICY_CNN: (POLICY_CNN,),
+    POLICY_ADAPTIVE: (DETECTOR_ADAPTIVE_HOG, POLICY_CNN, POLICY_ADAPTIVE),
+    POLICY_HOG: (POLICY_HOG, DETECTOR_ADAPTIVE_HOG, POLICY_ADAPTIVE, POLICY_CNN),
+}
+
+HOG_MAX_SIDE = 1600      # adaptive のHOGは長辺をこのサイズまで縮小して実行する（0なら縮小しない）
+HOG_MIN_FACE_SIZE = 40   # これより小さい顔（元画像のピクセル）はHOGの結果として信用しない
+HOG_MIN_SCORE = 0.3      # HOGの検出スコアの下限（スコアを取得できる場合のみ使用）
+HOG_ASPECT_RANGE = (0.6, 1.6)  # 顔の矩形の縦横比（幅/高さ）として妥当な範囲
+
+# --- 2. HOGの検出と品質判定 ---
+
+def downscale_image(image, max_side):
+    """長辺が max_side を超える場合に縮小する。戻り値: (画像, 縮小率)"""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return np.asarray(Image.fromarray(image).resize(size, Image.Resampling.BILINEAR)), scale
+
+def _hog_with_scores(image, upsample):
+    """
+    HOGで検出し、(矩形のリスト, スコアのリスト または None) を返す。
+    dlibの検出器からスコアを取得できない場合は、矩形だけを返す。
+    """
+    detector = getattr(getattr(face_recognition, "api", None), "face_detector", None)
+    if detector is not None and hasattr(detector, "run"):
+        try:
+            rects, scores, _ = detector.run(image, upsample, 0.0)
+            height, width = image.shape[:2]
+            boxes = [(max(r.top(), 0), min(r.right(), width), min(r.bottom(), height), max(r.left(), 0))
+                     for r in rects]
+            return boxes, list(scores)
+        except Exception:
+            pass
+    return face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model="hog"), None
+
+def low_quality_reason(face_locations, scores=None, min_face_size=HOG_MIN_FACE_SIZE):
+    """
+    HOGの検出結果の質を判定する。信用できない場合はその理由、問題なければ None を返す。
+    （小さすぎる顔、縦横比のおかしい矩形、スコアの低い検出が1つでもあればCNNで検出し直す）
+    """
+    for i, (top, right, bottom, left) in enumerate(face_locations):
+        width, height = right - left, bottom - top
+        if min(width, height) < min_face_size:
+            return "small"
+        if height <= 0 or not HOG_ASPECT_RANGE[0] <= width / height <= HOG_ASPECT_RANGE[1]:
+            return "aspect"
+        if scores is not None and scores[i] < HOG_MIN_SCORE:
+            return "score"
+    return None
+
+# --- 3. ポリシーに従った検出 ---
+
+def detect_faces(image, policy=POLICY_CNN, upsample=1, profiler=None, hog_max_side=HOG_MAX_SIDE):
+    """
+    検出ポリシーに従って顔を検出する。
+    profiler を渡すと、使った検出器とCNNへの切り替え理由をカウンターに記録する
+    （detector_hog / detector_cnn / fallback_no_face / fallback_small など）。
+    戻り値: (face_locations, 実際に使った検出器 "hog" / "cnn")
+    """
+    if policy == POLICY_CNN or policy not in POLICIES:
+        with timed(profiler, "detect"):
+            face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model="cnn")
+        _count(profiler, "detector_cnn")
+        return face_locations, POLICY_CNN
+
+    if policy == POLICY_HOG:
+        with timed(profiler, "detect"):
+            face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model="hog")
+        _count(profiler, "detector_hog")
+        return face_locations, POLICY_HOG
+
+    # adaptive: 縮小した画像でHOG → 結果を元の座標に戻して品質を判定
+    with timed(profiler, "detect_hog"):
+        small, scale = downscale_image(image, hog_max_side)
+        boxes, scores = _hog_with_scores(small, upsample)
+        face_locations = [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+    reason = "no_face" if not face_locations else low_quality_reason(face_locations, scores)
+    if reason is None:
+        _count(profiler, "detector_hog")
+        return face_locations, POLICY_HOG
+
+    _count(profiler, f"fallback_{reason}")
+    with timed(profiler, "detect_cnn"):
+        face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model="cnn")
+    _count(profiler, "detector_cnn")
+    return face_locations, POLICY_CNN
+
+def recorded_detector(policy, used):
+    """DBに記録する検出元を返す（detect_faces が実際に使った検出器。adaptive で採用したHOGは区別する）"""
+    if policy == POLICY_ADAPTIVE and used == POLICY_HOG:
+        return DETECTOR_ADAPTIVE_HOG
+    return used
+
+def _count(profiler, name):
+    if profiler is not None:
+        profiler.count(name)
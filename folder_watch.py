@@ -0,0 +1,218 @@
+# folder_watch.py
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+
+# watchdog (inotify等) が使える場合はイベント駆動、なければポーリングで監視する
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+# --- 1. 定数設定 ---
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SETTLE_SECONDS = 1.0   # サイズと更新時刻がこの秒数変化しなければ「書き込み完了」とみなす
+POLL_INTERVAL = 0.5    # 安定判定（およびポーリング監視）の間隔（秒）
+LATENCY_WINDOW = 500   # 遅延の統計に使う直近の件数
+
+# --- 2. 計測値 ---
+
+class LiveMetrics:
+    """ライブ処理の遅延とキュー長を記録する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # 検知〜処理完了までの秒数
+        self.processed = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def record(self, latency, ok=True):
+        with self._lock:
+            self.latencies.append(latency)
+            self.processed += 1
+            if not ok:
+                self.errors += 1
+
+    def set_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def percentile(self, p):
+        """遅延のパーセンタイル値（秒）。データがない場合は0"""
+        with self._lock:
+            values = sorted(self.latencies)
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+        return values[index]
+
+    def summary(self):
+        """ステータス表示用の1行サマリー"""
+        return (f"処理済み: {self.processed} (エラー {self.errors}) | "
+                f"キュー: {self.queue_depth} (最大 {self.max_queue_depth}) | "
+                f"遅延 p50: {self.percentile(50):.2f}s / p95: {self.percentile(95):.2f}s")
+
+# --- 3. フォルダ監視本体 ---
+
+class FolderWatcher:
+    """
+    指定フォルダに追加された画像を検知し、書き込み完了を待ってから on_image(path) を呼び出す。
+    on_image は専用のワーカースレッドで1件ずつ実行される（GUIの更新は呼び出し側で行うこと）。
+    """
+
+    def __init__(self, watch_dir, on_image, settle_seconds=SETTLE_SECONDS,
+                 poll_interval=POLL_INTERVAL, process_existing=False):
+        self.watch_dir = watch_dir
+        self.on_image = on_image
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.process_existing = process_existing
+        self.metrics = LiveMetrics()
+
+        self._queue = queue.Queue()
+        self._pending = {}   # {path: (size, mtime, 最初に検知した時刻, 最後に変化した時刻)}
+        self._seen = {}      # {path: (size, mtime)} 処理済み（または投入済み）のファイル
+        self._pending_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._observer = None
+
+    @property
+    def mode(self):
+        return "inotify/watchdog" if self._observer is not None else "polling"
+
+    def start(self):
+        """監視とワーカーを開始する"""
+        if not self.process_existing:
+            # 起動時に既にあるファイルは処理済み扱いにする
+            for path, stat in self._scan():
+                self._seen[path] = (stat.st_size, stat.st_mtime)
+        else:
+            now = time.time()
+            for path, stat in self._scan():
+                self._pending[path] = (stat.st_size, stat.st_mtime, now, now)
+
+        if WATCHDOG_AVAILABLE:
+            handler = _WatchdogHandler(self)
+            self._observer = Observer()
+            self._observer.schedule(handler, self.watch_dir, recursive=False)
+            self._observer.start()
+
+        for target in (self._settle_loop, self._worker_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """監視を停止する（処理中の1件は完了まで実行される）"""
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _scan(self):
+        """監視フォルダ内の画像ファイルと stat を列挙する"""
+        try:
+            entries = list(os.scandir(self.watch_dir))
+        except FileNotFoundError:
+            return []
+        result = []
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                try:
+                    result.append((entry.path, entry.stat()))
+                except FileNotFoundError:
+                    continue
+        return result
+
+    def notify(self, path):
+        """変更のあったファイルを安定待ちリストに登録する（watchdogのイベントから呼ばれる）"""
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        now = time.time()
+        with self._pending_lock:
+            if path in self._pending:
+                size, mtime, first_seen, _ = self._pending[path]
+                self._pending[path] = (size, mtime, first_seen, now)
+            else:
+                self._pending[path] = (-1, -1, now, now)
+
+    def _settle_loop(self):
+        """書き込み途中のファイルを除外するため、サイズと更新時刻が安定したものだけをキューに投入する"""
+        while not self._stop_event.wait(self.poll_interval):
+            if self._observer is None:
+                # ポーリングモード: ディレクトリを走査して新規・変更ファイルを検知
+                for path, stat in self._scan():
+                    if self._seen.get(path) != (stat.st_size, stat.st_mtime) and path not in self._pending:
+                        self.notify(path)
+
+            now = time.time()
+            ready = []
+            with self._pending_lock:
+                for path, (size, mtime, first_seen, last_change) in list(self._pending.items()):
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        del self._pending[path]
+                        continue
+
+                    if (stat.st_size, stat.st_mtime) != (size, mtime):
+                        self._pending[path] = (stat.st_size, stat.st_mtime, first_seen, now)
+                    elif stat.st_size > 0 and now - last_change >= self.settle_seconds:
+                        del self._pending[path]
+                        if self._seen.get(path) != (stat.st_size, stat.st_mtime):
+                            self._seen[path] = (stat.st_size, stat.st_mtime)
+                            ready.append((path, first_seen))
+
+            for item in ready:
+                self._queue.put(item)
+            self.metrics.set_queue_depth(self._queue.qsize())
+
+    def _worker_loop(self):
+        """キューから1件ずつ取り出して on_image を実行する"""
+        while True:
+            item = self._queue.get()
+            if item is None or self._stop_event.is_set():
+                break
+            path, first_seen = item
+            ok = True
+            try:
+                self.on_image(path)
+            except Exception:
+                ok = False
+            self.metrics.record(time.time() - first_seen, ok)
+            self.metrics.set_queue_depth(self._queue.qsize())
+
+
+if WATCHDOG_AVAILABLE:
+    class _WatchdogHandler(FileSystemEventHandler):
+        """watchdogのイベントを FolderWatcher.notify に転送する"""
+
+        def __init__(self, watcher):
+            super().__init__()
+            self.watcher = watcher
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.dest_path)
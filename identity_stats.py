@@ -0,0 +1,127 @@
+# identity_stats.py
+
+import csv
+import numpy as np
+from training_memory import DISTANCE_CHUNK_ROWS
+
+# --- 1. 定数設定 ---
+OUTLIER_MAD_K = 3.5             # 自分の人物の中心からの距離が「中央値 + k × MAD」を超えたら外れ値
+MIN_SAMPLES_FOR_PRUNING = 5     # サンプル数がこれ未満の人物は外れ値を判定しない（中心が安定しないため）
+MAX_PRUNE_FRACTION = 0.2        # 1人物から除外するのは最大でこの割合まで（外れ値らしさの強い順）
+MAD_SCALE = 1.4826              # MADを正規分布の標準偏差に換算する係数
+
+OUTLIER_AUTO = "auto"      # 外れ値を自動で除外する
+OUTLIER_REVIEW = "review"  # 一覧を出力し、確認してから除外する（GUIなしの場合は除外しない）
+OUTLIER_OFF = "off"        # 分析のみ行い、除外しない
+OUTLIER_MODES = (OUTLIER_AUTO, OUTLIER_REVIEW, OUTLIER_OFF)
+
+# --- 2. 人物ごとの統計 ---
+
+def identity_statistics(matrix, labels, num_classes):
+    """
+    人物ごとの中心・広がりと、各サンプルの「自分の人物の中心までの距離」「最も近い他の人物の中心までの距離」を求める。
+    matrix: (サンプル数, 128) のエンコーディング、labels: 人物のインデックス (0〜num_classes-1)
+    戻り値: {"centroids", "counts", "spread"(中心までの平均距離), "median", "mad",
+             "own_distance", "other_distance", "nearest_other"}
+    """
+    labels = np.asarray(labels)
+    counts = np.bincount(labels, minlength=num_classes)
+    centroids = np.zeros((num_classes, matrix.shape[1]), dtype=np.float64)
+    for start in range(0, len(labels), DISTANCE_CHUNK_ROWS):
+        chunk = np.asarray(matrix[start:start + DISTANCE_CHUNK_ROWS], dtype=np.float64)
+        np.add.at(centroids, labels[start:start + len(chunk)], chunk)
+    centroids /= np.maximum(counts, 1)[:, None]
+
+    # 全中心までの距離を DISTANCE_CHUNK_ROWS 行ずつ計算する（サンプル数 × 人物数 の行列を一度に作らない）
+    own_distance = np.empty(len(labels))
+    other_distance = np.full(len(labels), np.inf)
+    nearest_other = np.full(len(labels), -1, dtype=np.int64)
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(labels), DISTANCE_CHUNK_ROWS):
+        chunk = np.asarray(matrix[start:start + DISTANCE_CHUNK_ROWS], dtype=np.float64)
+        chunk_labels = labels[start:start + len(chunk)]
+        sq = (chunk ** 2).sum(axis=1)[:, None] - 2.0 * chunk @ centroids.T + centroid_sq[None, :]
+        distances = np.sqrt(np.maximum(sq, 0.0))
+        rows = np.arange(len(chunk))
+        own_distance[start:start + len(chunk)] = distances[rows, chunk_labels]
+        distances[rows, chunk_labels] = np.inf
+        if num_classes > 1:
+            nearest = distances.argmin(axis=1)
+            nearest_other[start:start + len(chunk)] = nearest
+            other_distance[start:start + len(chunk)] = distances[rows, nearest]
+
+    spread = np.bincount(labels, weights=own_distance, minlength=num_classes) / np.maximum(counts, 1)
+    median = np.zeros(num_classes)
+    mad = np.zeros(num_classes)
+    order = np.argsort(labels, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    for label in np.flatnonzero(counts):
+        values = own_distance[order[bounds[label]:bounds[label + 1]]]
+        median[label] = np.median(values)
+        mad[label] = np.median(np.abs(values - median[label]))
+    return {"centroids": centroids, "counts": counts, "spread": spread, "median": median, "mad": mad,
+            "own_distance": own_distance, "other_distance": other_distance, "nearest_other": nearest_other}
+
+def choose_faces(stats, labels, alternates):
+    """
+    複数の顔が写っていた学習画像について、その人物の中心に最も近い顔を選び直す。
+    alternates: {行番号: (顔数, 128) の全顔のエンコーディング}
+    戻り値: {行番号: 選んだ顔の番号（画像内の顔の順番）}（先頭の顔のままの行は含まない）
+    """
+    replaced = {}
+    for row, candidates in alternates.items():
+        centroid = stats["centroids"][labels[row]]
+        best = int(np.linalg.norm(np.asarray(candidates, dtype=np.float64) - centroid, axis=1).argmin())
+        if best != 0:
+            replaced[row] = best
+    return replaced
+
+# --- 3. 外れ値の判定 ---
+
+def find_outliers(stats, labels, k=OUTLIER_MAD_K, min_samples=MIN_SAMPLES_FOR_PRUNING,
+                  max_fraction=MAX_PRUNE_FRACTION):
+    """
+    外れ値（ラベル間違いの可能性が高いサンプル）の行番号を返す（昇順）。
+    - 自分の人物の中心から、その人物の典型的な広がり（中央値 + k × MAD）より遠い
+    - または、自分の人物より他の人物の中心の方が近い
+    """
+    labels = np.asarray(labels)
+    own, other = stats["own_distance"], stats["other_distance"]
+    limit = stats["median"][labels] + k * MAD_SCALE * stats["mad"][labels]
+    flagged = (own > limit) | (other < own)
+    flagged &= stats["counts"][labels] >= min_samples
+    score = own / np.maximum(other, 1e-9) # 大きいほど他の人物に近い
+
+    outliers = []
+    for label in np.unique(labels[flagged]):
+        rows = np.flatnonzero(flagged & (labels == label))
+        allowed = int(stats["counts"][label] * max_fraction)
+        outliers.append(rows[np.argsort(-score[rows])][:allowed])
+    return np.sort(np.concatenate(outliers)) if outliers else np.zeros(0, dtype=np.int64)
+
+# --- 4. レポート ---
+
+def summary_lines(stats, classes, outliers, labels):
+    """人物ごとの統計の表（ログ表示用）"""
+    pruned = np.bincount(np.asarray(labels)[outliers], minlength=len(classes)) if len(outliers) else \
+        np.zeros(len(classes), dtype=np.int64)
+    lines = [f"{'人物':<20}{'枚数':>6}{'広がり':>8}{'他人との最短':>12}{'外れ値':>8}"]
+    for label, name in enumerate(classes):
+        rows = np.asarray(labels) == label
+        nearest = stats["other_distance"][rows].min() if rows.any() else float("nan")
+        lines.append(f"{str(name):<20}{stats['counts'][label]:>6}{stats['spread'][label]:>8.3f}"
+                     f"{nearest:>12.3f}{pruned[label]:>8}")
+    return lines
+
+def write_outlier_report(path, stats, classes, labels, outliers, paths):
+    """外れ値の一覧をCSVに書き出す（確認用。画像パス・人物・距離・最も近い他の人物）"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "identity", "own_distance", "identity_median", "nearest_other",
+                         "other_distance"])
+        for row in outliers:
+            label = labels[row]
+            other = stats["nearest_other"][row]
+            writer.writerow([paths[row], classes[label], round(float(stats["own_distance"][row]), 4),
+                             round(float(stats["median"][label]), 4), classes[other] if other >= 0 else "",
+                             round(float(stats["other_distance"][row]), 4)])
@@ -0,0 +1,127 @@
+# image_dedup.py
+
+import numpy as np
+from PIL import Image
+from result_cache import file_content_hash
+
+# --- 1. 定数設定 ---
+PERCEPTUAL_DEDUP = True    # 再エンコードされた重複（画質・形式の違い、縮小）も検出する
+DHASH_SIZE = 8             # dHash のサイズ（8 → 64ビット）
+DHASH_MAX_DISTANCE = 3     # ハミング距離がこれ以下なら同じ画像とみなす（連写など別の写真を誤って重複にしないよう厳しめ）
+DHASH_BANDS = 4            # 64ビットを16ビットずつに分けて候補を探す（距離3以下なら少なくとも1つの区間が一致する）
+ASPECT_TOLERANCE = 0.01    # 縦横比の差がこれより大きい場合は重複とみなさない（トリミング違いを除外）
+
+# --- 2. ハッシュ ---
+
+def dhash(image_path, size=DHASH_SIZE):
+    """
+    差分ハッシュ（dHash）と画像サイズを返す。戻り値: (ハッシュの整数, (幅, 高さ))
+    JPEGは縮小デコード（draft）するため、全体をデコードするより大幅に速い。
+    """
+    with Image.open(image_path) as image:
+        original_size = image.size
+        image.draft('L', ((size + 1) * 4, size * 4))
+        pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join('1' if b else '0' for b in bits), 2), original_size
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+# --- 3. 重複の検出 ---
+
+def find_duplicates(paths, hash_func=file_content_hash, perceptual=PERCEPTUAL_DEDUP,
+                    max_distance=DHASH_MAX_DISTANCE):
+    """
+    画像の重複を検出し、各重複ファイルを代表のファイル（正本）に対応付ける。
+    - 完全一致: 内容ハッシュが同じ（hash_func。FaceDatabase.content_hash_for を渡すと、DBに記録済みのハッシュを再利用する）
+    - 再エンコード: dHash のハミング距離が max_distance 以下で、縦横比が同じ
+    正本は、グループ内で最も解像度の高いファイル（同じなら先に並んでいるファイル）。
+    戻り値: {"canonical": {重複ファイル: 正本}, "sizes": {ファイル: (幅, 高さ)},
+             "has_duplicates": 重複を持つ正本の集合, "exact": 完全一致の数, "perceptual": 再エンコードの数}
+    """
+    # 1. 完全一致（内容ハッシュ）: 同じ内容のファイルを最初のファイル（代表）にまとめる
+    exact_rep = {}
+    first_by_hash = {}
+    for path in paths:
+        try:
+            key = hash_func(path)
+        except OSError:
+            continue
+        exact_rep[path] = first_by_hash.setdefault(key, path)
+    representatives = list(first_by_hash.values())
+
+    # 2. 再エンコード（dHash）: 代表同士を比較する。区間ごとのバケットで候補を絞り、全組み合わせの比較を避ける
+    sizes = {}
+    hashes = {}
+    for path in representatives:
+        try:
+            if perceptual:
+                hashes[path], sizes[path] = dhash(path)
+            else:
+                with Image.open(path) as image:
+                    sizes[path] = image.size
+        except Exception:
+            continue  # 読み込めない画像は重複判定の対象外
+    parent = {path: path for path in representatives}
+    band_bits = DHASH_SIZE * DHASH_SIZE // DHASH_BANDS
+    buckets = {}
+    for path, value in hashes.items():
+        for band in range(DHASH_BANDS):
+            buckets.setdefault((band, (value >> (band * band_bits)) & ((1 << band_bits) - 1)), []).append(path)
+    for members in buckets.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if hamming(hashes[a], hashes[b]) <= max_distance and _same_aspect(sizes[a], sizes[b]):
+                    parent[_find(parent, b)] = _find(parent, a)
+
+    # 3. グループごとに正本を決める（最も解像度の高いファイル。同じなら先に並んでいるファイル）
+    order = {path: i for i, path in enumerate(paths)}
+    file_sizes = {path: sizes.get(rep) for path, rep in exact_rep.items()}
+    groups = {}
+    for path, rep in exact_rep.items():
+        groups.setdefault(_find(parent, rep), []).append(path)
+    canonical = {}
+    exact = perceptual_count = 0
+    for members in groups.values():
+        if len(members) == 1:
+            continue
+        best = max(members, key=lambda p: (_pixels(file_sizes[p]), -order[p]))
+        for path in members:
+            if path == best:
+                continue
+            canonical[path] = best
+            if exact_rep[path] == exact_rep[best]:
+                exact += 1
+            else:
+                perceptual_count += 1
+    return {"canonical": canonical, "sizes": file_sizes, "has_duplicates": set(canonical.values()),
+            "exact": exact, "perceptual": perceptual_count}
+
+def _find(parent, path):
+    while parent[path] != path:
+        parent[path] = parent[parent[path]]
+        path = parent[path]
+    return path
+
+def _pixels(size):
+    return size[0] * size[1] if size else 0
+
+def _same_aspect(size_a, size_b):
+    return abs(size_a[0] / size_a[1] - size_b[0] / size_b[1]) <= ASPECT_TOLERANCE * (size_a[0] / size_a[1])
+
+# --- 4. 結果の再利用 ---
+
+def scale_locations(face_locations, from_size, to_size):
+    """正本の顔の矩形を、重複ファイルの解像度に合わせる"""
+    if not from_size or not to_size or from_size == to_size:
+        return [tuple(box) for box in face_locations]
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    return [(int(round(top * sy)), int(round(right * sx)), int(round(bottom * sy)), int(round(left * sx)))
+            for top, right, bottom, left in face_locations]
+
+def summary_text(dedup, total):
+    """ログ表示用の要約"""
+    skipped = dedup["exact"] + dedup["perceptual"]
+    return (f"重複: {skipped} / {total} 枚（完全一致 {dedup['exact']} 枚, 再エンコード {dedup['perceptual']} 枚）"
+            f" → 検出を {skipped} 回省略")
@@ -0,0 +1,148 @@
+# image_pipeline.py
+
+import os
+import numpy as np
+import face_recognition
+from PIL import Image
+from face_database import detect_and_encode
+from face_assignment import assign_identities, UNKNOWN_INDEX
+from result_cache import make_thumbnail
+from stage_profiler import timed
+
+# 各ツールの「1枚分の処理」（GUIから切り離し、ベンチマークと分散振り分けのワーカーからも同じ処理を呼ぶ）
+
+# --- 1. 定数設定 ---
+CROP_PADDING = 40       # 切り抜きツールで顔の周囲に加える余白（ピクセル）
+THUMBNAIL_PADDING = 50  # 識別アプリのサムネイルの余白（顔の輪郭を捉えるため）
+
+# --- 2. 共通 ---
+
+def crop_faces(image, face_locations, padding):
+    """顔の矩形に余白を加えて切り抜く（face_recognition の座標は (top, right, bottom, left)）"""
+    pil_image = Image.fromarray(image)
+    return [
+        pil_image.crop((max(0, left - padding), max(0, top - padding),
+                        min(pil_image.width, right + padding), min(pil_image.height, bottom + padding)))
+        for (top, right, bottom, left) in face_locations
+    ]
+
+def load_image(analysis, image_path, profiler=None):
+    """解析結果の画像を返す（DBから再利用した場合は画像だけ読み込む）"""
+    image = analysis["image"]
+    if image is None:
+        with timed(profiler, "decode"):
+            image = face_recognition.load_image_file(image_path)
+    return image
+
+# --- 3. 各ツールの1枚分の処理 ---
+
+def crop_image(db, image_path, output_dir, detector, quality, profiler=None, padding=CROP_PADDING):
+    """
+    切り抜きツール（face_crop_tool_gui.py）: 検出 → DBに記録 → 顔ごとに切り抜いて保存する。
+    戻り値: 保存した顔の数（0 なら顔が検出されなかった）
+    """
+    analysis = detect_and_encode(db, image_path, detector, profiler=profiler, quality=quality)
+    face_locations = analysis["face_locations"]
+    if profiler is not None:
+        profiler.count("faces", len(face_locations))
+    if not analysis["from_db"]:
+        with timed(profiler, "db"):
+            db.record(image_path, analysis["content_hash"], face_locations, analysis["encodings"],
+                      source="crop", detector=analysis["detector"])
+    if not face_locations:
+        return 0
+
+    image = load_image(analysis, image_path, profiler)
+    with timed(profiler, "crop"):
+        crops = crop_faces(image, face_locations, padding)
+    base_name, ext = os.path.splitext(os.path.basename(image_path))
+    with timed(profiler, "io"):
+        for i, cropped_face in enumerate(crops):
+            cropped_face.save(os.path.join(output_dir, f"{base_name}_face_{i + 1}{ext}"))
+    return len(crops)
+
+def encode_training_image(db, image_path, name, detector, quality, profiler=None):
+    """
+    学習ツール（train_model_2.py）: 検出・エンコーディング → ひとまず先頭の顔に人物名を付けてDBに記録する。
+    戻り値: 画像内の全顔のエンコーディング（顔がなければ空）
+    """
+    analysis = detect_and_encode(db, image_path, detector, profiler=profiler, quality=quality)
+    face_locations = analysis["face_locations"]
+    if profiler is not None:
+        profiler.count("faces", len(face_locations))
+    identities = [name] + [None] * (len(face_locations) - 1) if face_locations else []
+    confidences = [1.0] + [None] * (len(face_locations) - 1) if face_locations else []
+    with timed(profiler, "db"):
+        db.record(image_path, analysis["content_hash"], face_locations, analysis["encodings"],
+                  identities, confidences, model_version="train", source="train", detector=analysis["detector"])
+    return analysis["encodings"]
+
+def classify_image(db, image_path, clf, le, conf_threshold, detector, quality, version, profiler=None):
+    """
+    振り分けツール（sort_faces_gui.py / distributed_sort.py）: 1枚の画像の全顔を識別し、DBに記録する。
+    戻り値: [{"box": (top, right, bottom, left), "identity": 人物名 or "Unknown", "confidence": 0〜1,
+              "probabilities": 全人物の確率ベクトル}, ...]（顔が検出されなかった場合は空リスト）
+    """
+    # 1. 顔検出とエンコーディング抽出（解析済みの画像はDBから再利用し、CNN推論を省略）
+    analysis = detect_and_encode(db, image_path, detector, profiler=profiler, quality=quality)
+    face_locations = analysis["face_locations"]
+    encodings = analysis["encodings"]
+    if len(face_locations) == 0:
+        if not analysis["from_db"]:
+            db.record(image_path, analysis["content_hash"], [], [], model_version=version, source="sort",
+                      detector=analysis["detector"])
+        return []
+
+    with timed(profiler, "classify"):
+        # 検出されたすべての顔をまとめて識別する
+        probabilities = clf.predict_proba(np.array(encodings))
+        # 2. 画像単位の割り当て: 1人物につき最大1つの顔、しきい値未満は割り当てない
+        assigned, confidences = assign_identities(probabilities, conf_threshold)
+
+    # 3. 顔ごとの結果をまとめる（振り分け先の決定は decide_folders で行う）
+    faces = []
+    for box, class_index, confidence, face_probabilities in zip(face_locations, assigned, confidences, probabilities):
+        identity = "Unknown" if class_index == UNKNOWN_INDEX else le.classes_[class_index]
+        faces.append({"box": tuple(int(v) for v in box), "identity": identity, "confidence": float(confidence),
+                      "probabilities": face_probabilities})
+
+    # 4. 識別結果をDBに記録（バッファに溜めてまとめて書き込む）
+    with timed(profiler, "db"):
+        db.record(image_path, analysis["content_hash"], face_locations, encodings,
+                  [face["identity"] for face in faces], [face["confidence"] for face in faces],
+                  model_version=version, source="sort", detector=analysis["detector"])
+    return faces
+
+def identify_image(db, cache, image_path, cache_key, clf, le, conf_threshold, detector, quality, version,
+                   profiler=None):
+    """
+    識別アプリ（face_app_tk.py）: 顔検出・エンコーディング・識別確率の計算とサムネイル作成を行い、キャッシュに保存する。
+    戻り値: キャッシュのエントリ（ResultCache.get と同じ形式）
+    """
+    # 顔検出（解析済みの画像はDBから再利用し、CNN推論を省略）
+    detection = detect_and_encode(db, image_path, detector, profiler=profiler, quality=quality)
+    face_locations = detection["face_locations"]
+    face_encodings = detection["encodings"]
+
+    with timed(profiler, "classify"):
+        if face_encodings:
+            probabilities = clf.predict_proba(np.array(face_encodings))
+        else:
+            probabilities = np.empty((0, len(le.classes_)))
+        assigned, confidences = assign_identities(probabilities, conf_threshold)
+
+    # 識別結果をDBに記録
+    identities = ["Unknown" if c == UNKNOWN_INDEX else le.classes_[c] for c in assigned]
+    with timed(profiler, "db"):
+        db.record(image_path, detection["content_hash"], face_locations, face_encodings,
+                  identities, confidences, model_version=version, source="identify", detector=detection["detector"])
+
+    # 顔の切り抜きとサムネイル化
+    thumbnails = []
+    if face_locations:
+        image = load_image(detection, image_path, profiler)
+        with timed(profiler, "crop"):
+            thumbnails = [make_thumbnail(face) for face in crop_faces(image, face_locations, THUMBNAIL_PADDING)]
+
+    with timed(profiler, "cache"):
+        return cache.put(cache_key, face_locations, np.array(face_encodings), probabilities, thumbnails)
@@ -0,0 +1,131 @@
+# job_checkpoint.py
+
+import os
+import time
+import pickle
+
+# --- 1. 定数設定 ---
+CHECKPOINT_INTERVAL_SEC = 60     # 前回の保存からこの秒数が経ったら保存する
+CHECKPOINT_INTERVAL_ITEMS = 500  # または、この件数を処理するごとに保存する
+CHECKPOINT_FORMAT = 2             # 2: 追記専用のジャーナル（1件ごとの結果を追記する）
+
+# --- 2. アトミックな書き込み ---
+
+def atomic_write_pickle(path, obj):
+    """
+    一時ファイルに書き込み、ディスクへの書き込みを確定してから置き換える。
+    書き込み中に強制終了しても、元のファイルか新しいファイルのどちらかが必ず残る。
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# --- 3. チェックポイント本体 ---
+
+class JobCheckpoint:
+    """
+    長時間の処理（学習・振り分け）の途中経過をジャーナル（追記専用のファイル）に保存し、中断後に再開できるようにする。
+    ファイルの先頭には signature（入力フォルダ・設定・モデルバージョンなど「同じジョブか」を判定する値）を書き、
+    以降に1件ごとの結果（add で渡した値）を追記する。保存のたびに書き込むのは前回の保存以降の結果だけなので、
+    処理済みの件数が増えても1回の保存のコストは変わらない。
+    signature が一致しないチェックポイントは再開に使わない。
+    """
+
+    def __init__(self, path, signature, interval_sec=CHECKPOINT_INTERVAL_SEC,
+                 interval_items=CHECKPOINT_INTERVAL_ITEMS):
+        self.path = path
+        self.signature = signature
+        self.interval_sec = interval_sec
+        self.interval_items = interval_items
+        self._last_save = time.time()
+        self._buffer = []      # まだ追記していない結果
+        self._valid_bytes = 0  # 最後まで読めた位置（書きかけの末尾を切り詰めるため）
+
+    def load(self):
+        """
+        同じジョブのチェックポイントがあれば、保存された結果のリストを返す（なければ None）。
+        末尾が書きかけ（追記中の強制終了）の場合は、その手前までの結果を返す。
+        """
+        if not os.path.exists(self.path):
+            return None
+        entries = []
+        try:
+            with open(self.path, 'rb') as f:
+                header = pickle.load(f)
+                if header.get("format") != CHECKPOINT_FORMAT or header.get("signature") != self.signature:
+                    return None
+                self._valid_bytes = f.tell()
+                while True:
+                    try:
+                        entries.append(pickle.load(f))
+                    except EOFError:
+                        break
+                    except Exception:
+                        break  # 書きかけの末尾
+                    self._valid_bytes = f.tell()
+        except Exception:
+            return None  # 壊れたファイルは無視して最初から
+        return entries
+
+    def exists(self):
+        return self.load() is not None
+
+    def start(self, resume=False):
+        """
+        処理の開始時に呼ぶ。resume=True で同じジョブのチェックポイントがあれば、その結果のリストを返し、
+        続きを追記できるようにする。それ以外は新しいジャーナルを作り、空のリストを返す。
+        """
+        entries = self.load() if resume else None
+        if entries is not None:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._valid_bytes) # 書きかけの末尾を捨ててから続きを追記する
+        else:
+            entries = []
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            atomic_write_pickle(self.path, {
+                "format": CHECKPOINT_FORMAT,
+                "signature": self.signature,
+                "started_at": time.time(),
+            })
+        self._buffer = []
+        self._last_save = time.time()
+        return entries
+
+    def add(self, entry):
+        """1件分の結果を追加する（次の保存でジャーナルに追記される）"""
+        self._buffer.append(entry)
+
+    def save(self):
+        """追加済みの結果をすぐに追記し、ディスクへの書き込みを確定する"""
+        if self._buffer:
+            with open(self.path, 'ab') as f:
+                for entry in self._buffer:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer = []
+        self._last_save = time.time()
+
+    def maybe_save(self, before_save=None):
+        """
+        追加した件数か前回の保存からの時間が保存間隔に達していれば、追記する。
+        before_save: 追記の直前に呼ぶ関数（DBの書き込みバッファをチェックポイントと揃えるなど）
+        戻り値: 保存した場合は True
+        """
+        if (len(self._buffer) >= self.interval_items
+                or time.time() - self._last_save >= self.interval_sec):
+            if before_save is not None:
+                before_save()
+            self.save()
+            return True
+        return False
+
+    def clear(self):
+        """ジョブが最後まで完了したらチェックポイントを削除する"""
+        self._buffer = []
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,250 @@
+# job_scheduler.py
+
+import os
+import re
+import time
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+# --- 1. 定数設定 ---
+CPU_SLOTS = os.cpu_count() or 1  # 同時に割り当てるCPUコア数の上限（ジョブの CPU 予算の合計）
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_LABELS = {PRIORITY_HIGH: "高", PRIORITY_NORMAL: "中", PRIORITY_LOW: "低"}
+
+STATUS_QUEUED = "待機中"
+STATUS_RUNNING = "実行中"
+STATUS_DONE = "完了"
+STATUS_FAILED = "失敗"
+STATUS_CANCELLED = "キャンセル"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+OUTPUT_LINES = 200  # ジョブごとに残す出力の行数
+PROGRESS_PATTERN = re.compile(r"(\d+)\s*/\s*(\d+)")  # 出力中の「処理数 / 全体数」を進捗として読み取る
+# 子プロセスの数値計算ライブラリのスレッド数を CPU 予算に合わせる
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+STREAM_LIMIT = 1024 * 1024  # 出力の1行の上限（これを超える行は読み捨てる）
+
+# --- 2. ジョブ ---
+
+class Job:
+    """1つの子プロセスの実行。パイプラインの途中のジョブは after（前のジョブ）の完了を待つ"""
+
+    def __init__(self, job_id, name, command, cpus=1, priority=PRIORITY_NORMAL, after=None, pipeline=None):
+        self.job_id = job_id
+        self.name = name
+        self.command = list(command)
+        self.cpus = cpus
+        self.priority = priority
+        self.after = after
+        self.pipeline = pipeline
+        self.status = STATUS_QUEUED
+        self.returncode = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cores = []               # 割り当てたCPUコア
+        self.output = deque(maxlen=OUTPUT_LINES)
+        self.done = 0                 # 出力から読み取った進捗
+        self.total = 0
+        self.process = None
+        self.cancel_requested = False
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def throughput(self):
+        """進捗の数から計算した処理速度（件/秒）"""
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """表示用の値（ロック内で作り、GUIスレッドに渡す）"""
+        return {
+            "job_id": self.job_id, "name": self.name, "status": self.status, "priority": self.priority,
+            "cpus": self.cpus, "cores": list(self.cores), "pipeline": self.pipeline,
+            "elapsed": self.elapsed(), "done": self.done, "total": self.total, "throughput": self.throughput(),
+            "last_line": self.output[-1] if self.output else "", "returncode": self.returncode,
+        }
+
+# --- 3. スケジューラー ---
+
+class JobScheduler:
+    """
+    asyncio のイベントループ（専用スレッド）でジョブを実行する。
+    - 優先度の高い順（同じなら投入順）に、CPU 予算の合計が cpu_slots を超えない範囲で起動する。
+      先頭のジョブが起動できない間は、後ろのジョブも起動しない（大きなジョブが後回しにされ続けないように）
+    - 起動したジョブには空いているコアを割り当て、Linuxではそのコアに固定する（CNNのツール同士で同じコアを奪い合わない）
+    - CPU 予算 0 のジョブ（GUIのツールなど、操作を待っている間はCPUを使わないもの）は予算の外で、すぐに起動する
+    - パイプラインは前のジョブが成功したら次を起動し、失敗・キャンセルされたら残りをキャンセルする
+    submit / submit_pipeline / cancel / snapshot はどのスレッドからでも呼べる。
+    """
+
+    def __init__(self, cpu_slots=CPU_SLOTS, cwd=None):
+        self.cpu_slots = max(1, cpu_slots)
+        self.cwd = cwd
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.jobs = {}  # {ジョブID: Job}（投入順）
+        self.free_cores = list(range(self.cpu_slots))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """実行中のジョブをすべてキャンセルし、イベントループを止める"""
+        for job in self.snapshot():
+            if job["status"] not in FINISHED_STATUSES:
+                self.cancel(job["job_id"])
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    # --- 3.1. 公開API（どのスレッドからでも呼べる） ---
+
+    def submit(self, name, command, cpus=1, priority=PRIORITY_NORMAL, after=None, pipeline=None):
+        """ジョブを投入する。戻り値: ジョブID"""
+        with self._lock:
+            job = Job(next(self._ids), name, command, min(max(0, cpus), self.cpu_slots), priority, after, pipeline)
+            self.jobs[job.job_id] = job
+        self.loop.call_soon_threadsafe(self._schedule)
+        return job.job_id
+
+    def submit_pipeline(self, name, steps, priority=PRIORITY_NORMAL):
+        """
+        前のジョブが成功したら次を実行するパイプラインを投入する。
+        steps: [(ステップ名, コマンド, CPU 予算), ...]
+        戻り値: ジョブIDのリスト
+        """
+        job_ids = []
+        for step_name, command, cpus in steps:
+            job_ids.append(self.submit(f"{name}: {step_name}", command, cpus, priority,
+                                       after=job_ids[-1] if job_ids else None, pipeline=name))
+        return job_ids
+
+    def cancel(self, job_id):
+        """待機中のジョブは取り消し、実行中のジョブは子プロセスを終了する"""
+        self.loop.call_soon_threadsafe(self._cancel, job_id)
+
+    def snapshot(self):
+        """全ジョブの表示用の値のリスト"""
+        with self._lock:
+            return [job.snapshot() for job in self.jobs.values()]
+
+    def output(self, job_id):
+        """ジョブの出力（最後の OUTPUT_LINES 行）"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return list(job.output) if job else []
+
+    # --- 3.2. イベントループ内の処理 ---
+
+    def _schedule(self):
+        with self._lock:
+            queued = sorted((job for job in self.jobs.values() if job.status == STATUS_QUEUED),
+                            key=lambda job: (job.priority, job.job_id))
+            blocked = False  # コアが足りずに待っているジョブがあるか（後ろの予算内のジョブは追い越さない）
+            for job in queued:
+                if job.after is not None:
+                    previous = self.jobs[job.after]
+                    if previous.status in (STATUS_FAILED, STATUS_CANCELLED):
+                        job.status = STATUS_CANCELLED
+                        job.output.append(f"前のジョブ ({previous.name}) が{previous.status}のため実行しません。")
+                        continue
+                    if previous.status != STATUS_DONE:
+                        continue  # 前のジョブを待つ（CPUの順番待ちではないので後ろのジョブは止めない）
+                if job.cpus == 0:
+                    pass  # 予算の外（コアを割り当てず、コア待ちのジョブがあっても順番を待たない）
+                elif blocked or len(self.free_cores) < job.cpus:
+                    blocked = True
+                    continue
+                job.cores, self.free_cores = self.free_cores[:job.cpus], self.free_cores[job.cpus:]
+                job.status = STATUS_RUNNING
+                job.started_at = time.time()
+                self.loop.create_task(self._run(job))
+
+    async def _run(self, job):
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        if job.cores:
+            env.update({name: str(job.cpus) for name in THREAD_ENV_VARS})
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *job.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                env=env, cwd=self.cwd, limit=STREAM_LIMIT
+            )
+            job.process = process
+            if job.cores and hasattr(os, "sched_setaffinity"):
+                try:
+                    os.sched_setaffinity(process.pid, job.cores) # 子プロセスが作るスレッド・プロセスにも引き継がれる
+                except OSError:
+                    pass
+            if job.cancel_requested:
+                process.terminate()
+            await self._read_output(job, process)
+            returncode = await process.wait()
+            status = STATUS_DONE if returncode == 0 else STATUS_CANCELLED if job.cancel_requested else STATUS_FAILED
+        except Exception as e:
+            returncode, status = None, STATUS_FAILED
+            self._on_output(job, f"{'起動' if process is None else '実行'}エラー: {e}")
+            if process is not None:
+                # 子プロセスが終わるまでコアを解放しない
+                if process.returncode is None:
+                    process.terminate()
+                returncode = await process.wait()
+        with self._lock:
+            job.returncode = returncode
+            job.status = status
+            job.finished_at = time.time()
+            job.process = None
+            self.free_cores = sorted(self.free_cores + job.cores)
+        self._schedule()
+
+    async def _read_output(self, job, process):
+        """子プロセスの出力を1行ずつ読む（STREAM_LIMIT を超える行は読み捨て、後ろの行は読み続ける）"""
+        skipping = False  # 上限を超えた行の残りを読み捨て中か
+        while True:
+            try:
+                raw = await process.stdout.readline()
+            except ValueError:
+                # readline は上限を超えた分をバッファから捨ててから例外を投げる
+                if not skipping:
+                    self._on_output(job, f"（{STREAM_LIMIT // 1024}KB を超える行を省略しました）")
+                skipping = True
+                continue
+            if not raw:
+                return
+            if skipping:
+                skipping = not raw.endswith(b"\n") # 行の残りの末尾まで捨てる
+                continue
+            self._on_output(job, raw.decode('utf-8', errors='replace').rstrip())
+
+    def _on_output(self, job, line):
+        if not line:
+            return
+        with self._lock:
+            job.output.append(line)
+            for done, total in PROGRESS_PATTERN.findall(line)[-1:]:
+                done, total = int(done), int(total)
+                if 0 < total and done <= total:
+                    job.done, job.total = done, total
+
+    def _cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return
+            job.cancel_requested = True
+            if job.status == STATUS_QUEUED:
+                job.status = STATUS_CANCELLED
+                job.finished_at = time.time()
+            elif job.process is not None:
+                job.process.terminate()
+        self._schedule()  # 後続のパイプラインのジョブもキャンセルする
@@ -1,10 +1,12 @@
 # main_hub.py
 
 import tkinter as tk
-from tkinter import messagebox
-import subprocess
+from tkinter import messagebox, scrolledtext, ttk
 import sys
 import os
+import time
+from job_scheduler import (JobScheduler, CPU_SLOTS, PRIORITY_LABELS, PRIORITY_NORMAL, STATUS_RUNNING,
+                           FINISHED_STATUSES)
 
 # --- 1. 実行するモジュール名の設定 ---
 # これらのファイルは main_hub.py と同じディレクトリにある必要があります
@@ -12,12 +14,20 @@ MODULE_CROP = "face_crop_tool_gui.py"
 MODULE_TRAIN = "train_model_2.py"
 MODULE_SORT = "sort_faces_gui.py"
 MODULE_APP = "face_app_tk.py"
+MODULE_DISTRIBUTED_SORT = "distributed_sort.py"
+
+DASHBOARD_INTERVAL_MS = 500 # ジョブ一覧の更新間隔
+DEFAULT_CPUS = max(1, CPU_SLOTS // 2) # パイプラインの CPU 予算の初期値（コア数）
+INTERACTIVE_CPUS = 0 # GUIのツールは CPU 予算の外で起動する（画面を開いたまま待機していても他のジョブを止めない）
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 class MainHubApp:
     def __init__(self, master):
         self.master = master
         master.title("🤖 顔識別システム - メインハブ")
-        master.geometry("500x380")
+        master.geometry("820x860")
+        self.scheduler = JobScheduler(cwd=PROJECT_ROOT).start() # 起動したツールをジョブとして管理する
+        self.shown_output = (None, 0) # 出力欄に表示中の (ジョブID, 行数)
 
         # 案内ラベル
         tk.Label(
@@ -57,9 +67,53 @@ class MainHubApp:
             'lightgoldenrod'
         ).pack(pady=5)
         
+        # 2.5. 次に投入するジョブの優先度と CPU 予算
+        options_frame = tk.Frame(master)
+        options_frame.pack(pady=5)
+        tk.Label(options_frame, text="優先度:").pack(side='left')
+        self.priority_var = tk.StringVar(value=PRIORITY_LABELS[PRIORITY_NORMAL])
+        ttk.Combobox(options_frame, textvariable=self.priority_var, values=list(PRIORITY_LABELS.values()),
+                     state='readonly', width=4).pack(side='left')
+        tk.Label(options_frame, text=f"  パイプラインのCPU予算 (コア数, 全{CPU_SLOTS}):").pack(side='left')
+        self.cpus_var = tk.IntVar(value=DEFAULT_CPUS)
+        tk.Spinbox(options_frame, from_=1, to=CPU_SLOTS, textvariable=self.cpus_var, width=4).pack(side='left')
+
+        # 2.6. パイプライン（切り抜き → 学習 → 振り分け を順番に実行）
+        pipeline_frame = tk.LabelFrame(master, text="パイプライン: 切り抜き → 学習 → 振り分け", padx=10, pady=5)
+        pipeline_frame.pack(fill='x', padx=10, pady=5)
+        self.sort_input_var = tk.StringVar(value=os.path.join(PROJECT_ROOT, "test_data"))
+        self.sort_output_var = tk.StringVar(value=os.path.join(PROJECT_ROOT, "sorted_output"))
+        for label, var in (("振り分け 入力:", self.sort_input_var), ("振り分け 出力:", self.sort_output_var)):
+            row = tk.Frame(pipeline_frame)
+            row.pack(fill='x')
+            tk.Label(row, text=label, width=14, anchor='w').pack(side='left')
+            tk.Entry(row, textvariable=var).pack(side='left', fill='x', expand=True)
+        tk.Label(pipeline_frame, fg='gray',
+                 text="切り抜きツールの画面を閉じると、学習（GUIなし）→ 振り分け（GUIなし）が順に実行されます").pack(anchor='w')
+        tk.Button(pipeline_frame, text="🔗 パイプラインを投入", command=self.submit_pipeline).pack(pady=3)
+
         # 起動確認用のステータスラベル
         self.status_label = tk.Label(master, text="", fg='blue')
-        self.status_label.pack(pady=10)
+        self.status_label.pack(pady=5)
+
+        # --- 2.7. ジョブ一覧（実行状況・処理速度・キャンセル） ---
+        jobs_frame = tk.LabelFrame(master, text="ジョブ", padx=5, pady=5)
+        jobs_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        columns = ("id", "name", "status", "priority", "cpus", "elapsed", "progress", "rate")
+        headings = ("ID", "ジョブ", "状態", "優先度", "CPU", "経過", "進捗", "件/秒")
+        widths = (40, 280, 80, 50, 60, 70, 100, 70)
+        self.job_tree = ttk.Treeview(jobs_frame, columns=columns, show='headings', height=7)
+        for column, heading, width in zip(columns, headings, widths):
+            self.job_tree.heading(column, text=heading)
+            self.job_tree.column(column, width=width, anchor='w' if column == "name" else 'center')
+        self.job_tree.pack(fill='x')
+        self.job_tree.bind("<<TreeviewSelect>>", lambda event: self.refresh_dashboard(reschedule=False))
+        tk.Button(jobs_frame, text="⏹ 選択したジョブをキャンセル", command=self.cancel_selected_job).pack(pady=3)
+        self.output_text = scrolledtext.ScrolledText(jobs_frame, height=8, wrap=tk.WORD)
+        self.output_text.pack(fill='both', expand=True)
+
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.refresh_dashboard()
 
     def create_button(self, text, module_name, color):
         """共通のボタンウィジェットを作成するヘルパー関数"""
@@ -76,31 +130,98 @@ class MainHubApp:
 
     # --- 3. モジュール実行ロジック ---
     def run_module(self, module_name):
-        """指定されたPythonスクリプトを別プロセスで起動する"""
+        """指定されたPythonスクリプトをジョブとして投入する（GUIのツールなので CPU 予算の外ですぐに起動）"""
         
         # 相対パスでのファイル存在チェック
         if not os.path.exists(module_name):
             messagebox.showerror("エラー", f"ファイル '{module_name}' が見つかりません。\nファイル名を確認してください。")
             return
             
-        self.log(f"'{module_name}' を起動中です...")
-        
+        # sys.executableは現在実行中のPythonインタープリタのパス
+        # main_hub.py とサブモジュールが同じディレクトリにあることが前提
+        job_id = self.scheduler.submit(module_name, [sys.executable, module_name], INTERACTIVE_CPUS, self.get_priority())
+        self.log(f"'{module_name}' をジョブ #{job_id} として投入しました。")
+
+    def submit_pipeline(self):
+        """切り抜き → 学習 → 振り分け を1つのパイプラインとして投入する"""
+        for module_name in (MODULE_CROP, MODULE_TRAIN, MODULE_DISTRIBUTED_SORT):
+            if not os.path.exists(module_name):
+                messagebox.showerror("エラー", f"ファイル '{module_name}' が見つかりません。")
+                return
+        cpus = self.get_cpus()
+        steps = [
+            ("切り抜き", [sys.executable, MODULE_CROP], INTERACTIVE_CPUS), # 画面の操作を待つ間は予算を使わない
+            ("学習", [sys.executable, MODULE_TRAIN, "--headless"], cpus),
+            # 振り分けは CPU 予算のコア数だけワーカーを起動する（ワーカーもコアの割り当てを引き継ぐ）
+            ("振り分け", [sys.executable, MODULE_DISTRIBUTED_SORT, "coordinator", self.sort_input_var.get(),
+                       self.sort_output_var.get(), "--local-workers", str(cpus), "--listen", "127.0.0.1:0"], cpus),
+        ]
+        job_ids = self.scheduler.submit_pipeline("パイプライン", steps, self.get_priority())
+        self.log(f"パイプラインをジョブ #{job_ids[0]}〜#{job_ids[-1]} として投入しました。")
+
+    def get_cpus(self):
         try:
-            # sys.executableは現在実行中のPythonインタープリタのパス
-            # subprocess.Popen で別プロセスとして起動
-            # main_hub.py とサブモジュールが同じディレクトリにあることが前提
-            subprocess.Popen([sys.executable, module_name])
-            
-            self.log(f"'{module_name}' が起動しました。")
-            
-        except Exception as e:
-            messagebox.showerror("実行エラー", f"'{module_name}' の起動中にエラーが発生しました: {e}")
-            self.log("起動エラーが発生しました。")
-            
+            return min(max(1, int(self.cpus_var.get())), CPU_SLOTS)
+        except (tk.TclError, ValueError):
+            return DEFAULT_CPUS
+
+    def get_priority(self):
+        for priority, label in PRIORITY_LABELS.items():
+            if label == self.priority_var.get():
+                return priority
+        return PRIORITY_NORMAL
+
+    # --- 4. ジョブ一覧の表示 ---
+    def refresh_dashboard(self, reschedule=True):
+        """ジョブの状態を一覧に反映する（タイマーで定期的に実行）"""
+        for job in self.scheduler.snapshot():
+            progress = f"{job['done']}/{job['total']}" if job["total"] else "-"
+            if job["cpus"] == 0:
+                cpus = "-" # CPU 予算の外（GUIのツール）
+            else:
+                cpus = f"{job['cpus']}" + (f" ({','.join(map(str, job['cores']))})" if job["status"] == STATUS_RUNNING else "")
+            values = (job["job_id"], job["name"], job["status"], PRIORITY_LABELS[job["priority"]], cpus,
+                      time.strftime("%H:%M:%S", time.gmtime(job["elapsed"])), progress,
+                      f"{job['throughput']:.2f}" if job["total"] else "-")
+            iid = str(job["job_id"])
+            if self.job_tree.exists(iid):
+                self.job_tree.item(iid, values=values)
+            else:
+                self.job_tree.insert("", tk.END, iid=iid, values=values)
+
+        # 選択中のジョブの出力（変化があった場合だけ書き換える）
+        selection = self.job_tree.selection()
+        if selection:
+            job_id = int(selection[0])
+            lines = self.scheduler.output(job_id)
+            if self.shown_output != (job_id, len(lines), lines[-1:]):
+                self.shown_output = (job_id, len(lines), lines[-1:])
+                self.output_text.delete('1.0', tk.END)
+                self.output_text.insert(tk.END, "\n".join(lines))
+                self.output_text.see(tk.END)
+        if reschedule:
+            self.master.after(DASHBOARD_INTERVAL_MS, self.refresh_dashboard)
+
+    def cancel_selected_job(self):
+        selection = self.job_tree.selection()
+        if not selection:
+            messagebox.showinfo("情報", "キャンセルするジョブを一覧から選択してください。")
+            return
+        self.scheduler.cancel(int(selection[0]))
+        self.log(f"ジョブ #{selection[0]} をキャンセルしました。")
+
+    def on_close(self):
+        """実行中・待機中のジョブがあれば確認してから終了する"""
+        active = [job for job in self.scheduler.snapshot() if job["status"] not in FINISHED_STATUSES]
+        if active and not messagebox.askyesno(
+                "確認", f"実行中・待機中のジョブが {len(active)} 件あります。\nキャンセルして終了しますか？"):
+            return
+        self.scheduler.stop()
+        self.master.destroy()
+
     def log(self, message):
         """ステータスラベルを更新する"""
         self.status_label.config(text=message)
-        self.master.update()
 
 if __name__ == "__main__":
     # Windows/Macで起動時にPythonの黒いコンソールを出さないようにするための処理 (Macの.shで起動する場合不要)
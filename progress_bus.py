@@ -0,0 +1,155 @@
+# progress_bus.py
+
+import time
+import threading
+import traceback
+import tkinter as tk
+from collections import deque
+
+# --- 1. 定数設定 ---
+DRAIN_INTERVAL_MS = 100  # GUIへの反映間隔（10Hz）
+MAX_LOG_LINES = 2000     # ログ表示に残す最大行数（古い行から削除）
+
+# --- 2. 作業スレッド側: ログ・進捗の受け渡し ---
+
+class ProgressBus:
+    """
+    作業スレッドが出すログ・進捗・GUI操作を溜めておき、GUIスレッドがタイマーでまとめて取り出す。
+    Tkのウィジェットは作業スレッドから触らず、すべて drain() を呼ぶGUIスレッドで反映する。
+    - ログ: 溜まった行をまとめて1回で表示する。表示しきれない分は古い行から捨てる（spill_path があればファイルに全行を保存）
+    - 進捗・ラベル: 最新の値だけを保持する（途中の値は描画しない）
+    """
+
+    def __init__(self, max_lines=MAX_LOG_LINES, spill_path=None):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=max_lines)  # 未表示のログ（リングバッファ）
+        self._progress = None                  # (値, 最大値, テキスト) の最新値
+        self._labels = {}                      # {ラベル名: テキスト} の最新値
+        self._calls = []                       # GUIスレッドで実行する関数
+        self._spill_file = None
+        self.dropped = 0                       # 表示されずに捨てられた行数
+        self.set_spill(spill_path)
+
+    def set_spill(self, path):
+        """ログの全行を書き出すファイルを設定する（None で停止）"""
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+            self._spill_file = open(path, 'a', encoding='utf-8') if path else None
+
+    def close(self):
+        self.set_spill(None)
+
+    def log(self, message):
+        """ログを1件追加する（どのスレッドからでも呼べる）"""
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self.dropped += 1
+            self._lines.append(message)
+            if self._spill_file is not None:
+                self._spill_file.write(message + "\n")
+
+    def progress(self, value, maximum=None, text=None):
+        """進捗を更新する（最新の値だけが反映される）"""
+        with self._lock:
+            self._progress = (value, maximum, text)
+
+    def set_label(self, name, text):
+        """名前付きラベルのテキストを更新する（BusDrainer の labels で対応するウィジェットに反映）"""
+        with self._lock:
+            self._labels[name] = text
+
+    def call(self, func, *args, **kwargs):
+        """GUIスレッドで実行する処理を登録する（ボタンの有効化、メッセージボックスなど）"""
+        with self._lock:
+            self._calls.append((func, args, kwargs))
+
+    def drain(self):
+        """
+        溜まったログ・最新の進捗とラベル・登録された処理を取り出す（GUIスレッドから呼ぶ）。
+        戻り値: (ログ行のリスト, 進捗 または None, {ラベル名: テキスト}, [(関数, args, kwargs), ...])
+        """
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            progress, self._progress = self._progress, None
+            labels, self._labels = self._labels, {}
+            calls, self._calls = self._calls, []
+            if self._spill_file is not None and lines:
+                self._spill_file.flush()
+        return lines, progress, labels, calls
+
+# --- 3. GUIスレッド側: タイマーでの反映 ---
+
+class BusDrainer:
+    """
+    ProgressBus の内容を DRAIN_INTERVAL_MS ごとにウィジェットへ反映する。
+    text_widget / progress_bar / status_label / labels は使うものだけ渡せばよい。
+    labels: {ラベル名: ウィジェット}（ProgressBus.set_label の反映先）
+    ログ表示は max_lines 行を超えたら古い行から削除する。
+    get_profiler: 計測中の StageProfiler（または None）を返す関数。渡すと、反映した内容があった
+    タイマー処理の所要時間を "gui" ステージに記録する。
+    """
+
+    def __init__(self, master, bus, text_widget=None, progress_bar=None, status_label=None, labels=None,
+                 interval_ms=DRAIN_INTERVAL_MS, max_lines=MAX_LOG_LINES, get_profiler=None):
+        self.master = master
+        self.bus = bus
+        self.text_widget = text_widget
+        self.progress_bar = progress_bar
+        self.status_label = status_label
+        self.labels = labels or {}
+        self.interval_ms = interval_ms
+        self.max_lines = max_lines
+        self.get_profiler = get_profiler
+        self.master.after(self.interval_ms, self._tick)
+
+    def _tick(self):
+        start = time.perf_counter()
+        try:
+            if self.flush():
+                self._record_gui_time(time.perf_counter() - start)
+        finally:
+            self.master.after(self.interval_ms, self._tick)
+
+    def _record_gui_time(self, seconds):
+        """計測中（start 後、stop 前）のプロファイラがあれば "gui" ステージに加える"""
+        profiler = self.get_profiler() if self.get_profiler is not None else None
+        if profiler is not None and profiler.start_time is not None and profiler.end_time is None:
+            profiler.add("gui", seconds)
+
+    def flush(self):
+        """溜まっている内容をすぐに反映する。戻り値: 反映した内容があったか"""
+        lines, progress, labels, calls = self.bus.drain()
+        if lines and self.text_widget is not None:
+            self._append_lines(lines)
+        if progress is not None:
+            value, maximum, text = progress
+            if self.progress_bar is not None:
+                if maximum is not None:
+                    self.progress_bar.config(maximum=maximum)
+                self.progress_bar.config(value=value)
+            if text is not None and self.status_label is not None:
+                self.status_label.config(text=text)
+        for name, text in labels.items():
+            if name in self.labels:
+                self.labels[name].config(text=text)
+        for func, args, kwargs in calls:
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                # 1つの処理が失敗しても、後ろの処理（終了時のボタンの有効化など）は実行する
+                message = f"⚠️ GUIの更新中にエラーが発生しました ({getattr(func, '__name__', func)}):\n{traceback.format_exc()}"
+                print(message)
+                if self.text_widget is not None:
+                    self._append_lines([message])
+        return bool(lines or progress is not None or labels or calls)
+
+    def _append_lines(self, lines):
+        """まとめて1回で挿入し、上限を超えた分を先頭から削除する"""
+        widget = self.text_widget
+        widget.insert(tk.END, "\n".join(lines) + "\n")
+        line_count = int(widget.index('end-1c').split('.')[0])
+        if line_count > self.max_lines:
+            widget.delete('1.0', f"{line_count - self.max_lines + 1}.0")
+        widget.see(tk.END)
@@ -0,0 +1,75 @@
+# quality_tiers.py
+
+import os
+import pickle
+
+# --- 1. 品質ティアの定義 ---
+# 検出（アップサンプル回数・縮小サイズ）とエンコーディング（ジッター回数・ランドマークモデル）の設定をまとめたもの。
+#   num_jitters    : エンコーディング時に顔をずらして平均する回数（回数に比例して遅くなる）
+#   landmark_model : "small"（5点、高速）/ "large"（68点、位置合わせが正確）
+#   upsample       : 検出時のアップサンプル回数（小さな顔を見つけやすくなるが、面積に比例して遅くなる）
+#                    fast は 0（HOGで見つかる顔は縮小後におよそ80ピクセル以上。1回ごとに検出の面積が4倍になる）
+#   max_side       : 検出・エンコーディング前に長辺をこのサイズまで縮小する（0なら縮小しない）
+TIER_FAST = "fast"
+TIER_BALANCED = "balanced"  # face_recognition の既定値と同じ（ティア導入前のモデル・DBの結果と互換）
+TIER_ACCURATE = "accurate"
+
+QUALITY_TIERS = {
+    TIER_FAST:     {"num_jitters": 1,  "landmark_model": "small", "upsample": 0, "max_side": 1600},
+    TIER_BALANCED: {"num_jitters": 1,  "landmark_model": "small", "upsample": 1, "max_side": 0},
+    TIER_ACCURATE: {"num_jitters": 10, "landmark_model": "large", "upsample": 2, "max_side": 2400},
+}
+DEFAULT_TIER = TIER_BALANCED
+
+def tier_settings(tier=DEFAULT_TIER):
+    """ティア名から設定の辞書を作る（"tier" キーにティア名を含む）"""
+    if tier not in QUALITY_TIERS:
+        raise ValueError(f"不明な品質ティアです: {tier} (選択肢: {', '.join(QUALITY_TIERS)})")
+    return dict(QUALITY_TIERS[tier], tier=tier)
+
+def inference_settings(tier, model_quality):
+    """
+    識別（推論）用の設定を作る。
+    ランドマークモデルは顔の位置合わせを変え、エンコーディングの分布がずれるため、
+    推論側のティアにかかわらず学習時（モデルに記録された値）に合わせる。
+    """
+    settings = tier_settings(tier)
+    if model_quality:
+        settings["landmark_model"] = model_quality.get("landmark_model", settings["landmark_model"])
+    return settings
+
+def settings_key(settings):
+    """
+    DB・キャッシュのキーに付ける設定の識別子。既定値（balanced）なら空文字を返し、
+    ティア導入前に保存された検出結果をそのまま再利用できるようにする。
+    """
+    if settings is None:
+        return ""
+    default = QUALITY_TIERS[DEFAULT_TIER]
+    if all(settings[k] == default[k] for k in default):
+        return ""
+    return (f"+{settings['landmark_model']},j{settings['num_jitters']},"
+            f"u{settings['upsample']},r{settings['max_side']}")
+
+# --- 2. モデルファイル（学習時のティアを記録） ---
+
+def save_model_bundle(model_file, clf, le, quality):
+    """分類器・ラベルエンコーダーと、学習に使った品質設定を保存する"""
+    bundle = {"clf": clf, "le": le, "quality": dict(quality)}
+    tmp_path = model_file + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(bundle, f)
+    os.replace(tmp_path, model_file)
+
+def load_model_bundle(model_file):
+    """
+    モデルファイルを読み込む。ティア導入前の (clf, le) 形式のファイルも読み込める
+    （その場合の品質設定は、当時の既定値と同じ balanced とする）。
+    戻り値: (clf, le, quality)
+    """
+    with open(model_file, 'rb') as f:
+        bundle = pickle.load(f)
+    if isinstance(bundle, tuple):
+        clf, le = bundle
+        return clf, le, tier_settings(DEFAULT_TIER)
+    return bundle["clf"], bundle["le"], bundle.get("quality") or tier_settings(DEFAULT_TIER)
@@ -0,0 +1,165 @@
+# result_cache.py
+
+import os
+import pickle
+import hashlib
+import threading
+from io import BytesIO
+from PIL import Image
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(PROJECT_ROOT, ".pica_cache")
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # キャッシュ全体の上限サイズ（512MB）
+THUMBNAIL_SIZE = (150, 150)  # 識別アプリの表示サイズと合わせる
+HASH_CHUNK_SIZE = 1024 * 1024  # ハッシュ計算時の読み込み単位（1MB）
+
+# --- 2. ハッシュ関連のヘルパー ---
+
+def file_content_hash(file_path):
+    """ファイル内容のSHA-256ハッシュ（16進文字列）を返す"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def model_version(model_file):
+    """
+    モデルファイルの内容からバージョン文字列を作る。
+    モデルを再学習するとバージョンが変わり、古いキャッシュは自動的に使われなくなる。
+    """
+    if not os.path.exists(model_file):
+        return "nomodel"
+    return file_content_hash(model_file)[:16]
+
+def make_thumbnail(pil_image, size=THUMBNAIL_SIZE):
+    """表示用のサムネイルを作成する（表示時の再リサイズを不要にするため）"""
+    return pil_image.resize(size, Image.Resampling.LANCZOS)
+
+# --- 3. キャッシュ本体 ---
+
+class ResultCache:
+    """
+    識別結果とサムネイルをディスクに保存するLRUキャッシュ。
+    キーは「ファイル内容のハッシュ + モデルバージョン」。
+    1エントリ = 1ファイル（pickle）で、最終アクセス時刻（mtime）をLRUの順序に使う。
+    """
+
+    def __init__(self, version, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.version = version
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}  # {entry_path: (last_access, size)}
+        self._total_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """既存のキャッシュファイルを走査して、サイズとアクセス順を把握する"""
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                self._entries[entry.path] = (stat.st_mtime, stat.st_size)
+                self._total_bytes += stat.st_size
+
+    def key_for(self, file_path):
+        """画像ファイルのキャッシュキーを計算する"""
+        return f"{file_content_hash(file_path)}_{self.version}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def get(self, key):
+        """
+        キャッシュから結果を取り出す。見つからない場合は None。
+        戻り値: {"face_locations", "encodings", "probabilities", "thumbnails"(PIL.Imageのリスト)}
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 壊れたエントリは削除して、通常の処理にフォールバック
+            self._remove(entry_path)
+            return None
+
+        # LRU: アクセス時刻を更新
+        try:
+            os.utime(entry_path)
+            stat = os.stat(entry_path)
+            with self._lock:
+                self._entries[entry_path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            pass
+
+        entry["thumbnails"] = [Image.open(BytesIO(data)) for data in entry["thumbnails"]]
+        return entry
+
+    def put(self, key, face_locations, encodings, probabilities, thumbnails):
+        """
+        識別結果を保存する。サムネイルはJPEGバイト列として格納する。
+        戻り値: get() と同じ形式の辞書
+        """
+        thumbnail_bytes = []
+        for thumbnail in thumbnails:
+            buffer = BytesIO()
+            thumbnail.convert("RGB").save(buffer, format="JPEG", quality=90)
+            thumbnail_bytes.append(buffer.getvalue())
+
+        entry = {
+            "face_locations": list(face_locations),
+            "encodings": encodings,
+            "probabilities": probabilities,
+            "thumbnails": thumbnail_bytes,
+        }
+
+        # 一時ファイルに書いてから置き換える（書き込み途中のファイルを読まないため）
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+        stat = os.stat(entry_path)
+        with self._lock:
+            old = self._entries.get(entry_path)
+            if old:
+                self._total_bytes -= old[1]
+            self._entries[entry_path] = (stat.st_mtime, stat.st_size)
+            self._total_bytes += stat.st_size
+        self._evict()
+
+        entry["thumbnails"] = list(thumbnails)
+        return entry
+
+    def _remove(self, entry_path):
+        with self._lock:
+            old = self._entries.pop(entry_path, None)
+            if old:
+                self._total_bytes -= old[1]
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """上限サイズを超えた分だけ、最も古くアクセスされたエントリから削除する"""
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            oldest_first = sorted(self._entries.items(), key=lambda item: item[1][0])
+
+        for entry_path, _ in oldest_first:
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove(entry_path)
+
+    def clear(self):
+        """すべてのキャッシュを削除する"""
+        for entry_path in list(self._entries):
+            self._remove(entry_path)
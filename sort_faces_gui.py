@@ -3,34 +3,60 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, ttk
 import os
-import pickle
-import numpy as np
-import face_recognition
-import shutil
 from collections import defaultdict
 import threading # GUIをフリーズさせないために、処理を別スレッドで実行
+import time
+from folder_watch import FolderWatcher
+from face_database import FaceDatabase
+from image_pipeline import classify_image
+from result_cache import model_version
+from unknown_clustering import run_clustering
+from stage_profiler import StageProfiler, show_summary_window
+from progress_bus import ProgressBus, BusDrainer
+from face_detection import POLICY_ADAPTIVE
+from quality_tiers import load_model_bundle, inference_settings, settings_key, TIER_FAST
+from job_checkpoint import JobCheckpoint
+from image_dedup import find_duplicates, scale_locations, summary_text as dedup_summary
+from encoding_export import EncodingStore, sync_from_db
+from sort_index import (decide_folders, make_record, make_result_image, write_sidecar, write_index, append_index,
+                        place_file, save_results, load_results, preview_folder_counts, reapply_threshold,
+                        INDEX_CSV_NAME, INDEX_DIR_NAME, OUTPUT_MODE_COPY, OUTPUT_MODE_HARDLINK, OUTPUT_MODE_SYMLINK)
 
 # --- 1. 定数設定 ---
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__)) 
 MODEL_FILE = os.path.join(PROJECT_ROOT, "face_classifier_model.pkl")
+TRAIN_DIR = os.path.join(PROJECT_ROOT, "train_data")
 DEFAULT_THRESHOLD = 0.77
+PREVIEW_DELAY_MS = 150 # しきい値スライダーのプレビュー更新までの待ち時間（ミリ秒）
+DETECTION_POLICY = POLICY_ADAPTIVE # まずHOG、顔がない/質が低い場合だけCNN（face_detection.py）
+QUALITY_TIER = TIER_FAST # 大量の振り分けは速度優先（ランドマークモデルは学習時の設定に合わせる。quality_tiers.py）
+LOG_FILE_NAME = "sort_log.txt" # ログをファイルにも保存する場合のファイル名（出力フォルダ内）
+CHECKPOINT_FILE_NAME = "sort_checkpoint.pkl" # 振り分けの途中経過（出力フォルダの _index 内。中断後の再開用）
+EXPORT_ENCODINGS = True # 振り分け後、新しい顔のエンコーディングを encoding_store に追記する（encoding_export.py）
+
+# 配置方法の表示名（ハードリンク/シンボリックリンクは複数フォルダに配置してもディスク容量を増やさない）
+OUTPUT_MODE_LABELS = {
+    OUTPUT_MODE_COPY: "コピー",
+    OUTPUT_MODE_HARDLINK: "ハードリンク (容量ゼロ)",
+    OUTPUT_MODE_SYMLINK: "シンボリックリンク (容量ゼロ)",
+}
 
 # --- 2. モデルのロード ---
 def load_model():
-    """モデル、エンコーダーを読み込む"""
+    """モデル、エンコーダー、学習時の品質設定を読み込む"""
     try:
-        with open(MODEL_FILE, 'rb') as f:
-            (clf, le) = pickle.load(f)
-        return clf, le
+        return load_model_bundle(MODEL_FILE)
     except FileNotFoundError:
         messagebox.showerror("エラー", f"モデルファイルが見つかりません: {MODEL_FILE}\n先に学習を実行してください。")
-        return None, None
+        return None, None, None
     except Exception as e:
         messagebox.showerror("エラー", f"モデルロード中に予期せぬエラーが発生しました: {e}")
-        return None, None
+        return None, None, None
 
 # アプリ起動時にモデルをロード
-clf, le = load_model()
+clf, le, model_quality = load_model()
+MODEL_VERSION = model_version(MODEL_FILE)
+QUALITY = inference_settings(QUALITY_TIER, model_quality) # 検出・エンコーディングの設定
 
 # --- 3. メインアプリの定義 ---
 
@@ -38,14 +64,22 @@ class FaceSorterApp:
     def __init__(self, master):
         self.master = master
         master.title("📁 顔画像ファイル振り分けツール")
-        master.geometry("650x700")
+        master.geometry("650x890")
 
         if clf is None:
             tk.Label(master, text="🚨 モデルがロードされていません。アプリを終了します。", fg="red").pack(pady=20)
             master.protocol("WM_DELETE_WINDOW", master.quit)
             return
 
+        self.watcher = None # ライブ振り分け用のフォルダ監視
+        self.db = FaceDatabase() # 検出結果・識別結果の保存先
+        self.stored_results = None # しきい値の再適用用に読み込んだ前回の結果
+        self.preview_job = None
+        self.profiler = None # 直前の振り分けの処理統計
+        self.bus = ProgressBus() # 作業スレッドからのログ・進捗（GUIスレッドがタイマーで反映）
         self.setup_ui()
+        self.drainer = BusDrainer(master, self.bus, text_widget=self.result_text, progress_bar=self.progress_bar,
+                                  get_profiler=lambda: self.profiler)
         
     def setup_ui(self):
         """UI要素の配置"""
@@ -74,17 +108,97 @@ class FaceSorterApp:
         self.threshold_var = tk.StringVar(value=str(DEFAULT_THRESHOLD))
         tk.Entry(main_frame, textvariable=self.threshold_var, width=10).pack(fill='x')
 
+        # --- 3.3.1. 振り分けオプション ---
+        options_frame = tk.Frame(main_frame)
+        options_frame.pack(fill='x', pady=(10, 0))
+        self.multi_label_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            options_frame,
+            text="グループ写真は写っている全員のフォルダに配置する",
+            variable=self.multi_label_var
+        ).pack(side='left')
+        tk.Label(options_frame, text="配置方法:").pack(side='left', padx=(15, 0))
+        self.output_mode_var = tk.StringVar(value=OUTPUT_MODE_LABELS[OUTPUT_MODE_COPY])
+        ttk.Combobox(
+            options_frame,
+            textvariable=self.output_mode_var,
+            values=list(OUTPUT_MODE_LABELS.values()),
+            state='readonly',
+            width=22
+        ).pack(side='left')
+        self.spill_log_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            main_frame,
+            text=f"ログをファイルにも保存する (出力フォルダの {LOG_FILE_NAME}、画面には最新の行のみ表示)",
+            variable=self.spill_log_var
+        ).pack(anchor='w')
+
         # --- 3.4. 実行ボタン ---
         self.sort_button = tk.Button(
             main_frame,
-            text="🚀 振り分け実行 (ファイルをコピーします)",
+            text="🚀 振り分け実行",
             command=self.start_sorting_thread,
             font=('Helvetica', 12, 'bold'),
             bg='orange',
             padx=10,
             pady=10
         )
-        self.sort_button.pack(pady=20, fill='x')
+        self.sort_button.pack(pady=(20, 5), fill='x')
+
+        # ライブ振り分け（フォルダ監視）ボタン
+        self.live_button = tk.Button(
+            main_frame,
+            text="👁 ライブ振り分け開始 (入力フォルダを監視)",
+            command=self.toggle_live_sorting,
+            font=('Helvetica', 11),
+            bg='lightgoldenrod',
+            padx=10,
+            pady=5
+        )
+        self.live_button.pack(pady=(0, 5), fill='x')
+
+        # Unknownの顔のクラスタリングボタン
+        self.cluster_button = tk.Button(
+            main_frame,
+            text="🧩 Unknownの顔をクラスタリング (train_data に候補フォルダを作成)",
+            command=self.start_clustering_thread,
+            font=('Helvetica', 11),
+            bg='lightblue',
+            padx=10,
+            pady=5
+        )
+        self.cluster_button.pack(pady=(0, 5), fill='x')
+
+        # 処理統計ボタン
+        tk.Button(
+            main_frame,
+            text="📊 処理統計 (ステージ別の所要時間)",
+            command=lambda: show_summary_window(self.master, self.profiler),
+            font=('Helvetica', 10),
+            padx=10
+        ).pack(pady=(0, 15), fill='x')
+
+        # --- 3.4.1. しきい値の再適用（再検出なし） ---
+        rethreshold_frame = tk.LabelFrame(main_frame, text="しきい値の再適用 (前回の振り分け結果から、再検出なしで振り分け直し)", padx=5, pady=5)
+        rethreshold_frame.pack(fill='x', pady=(0, 10))
+        self.rethreshold_var = tk.DoubleVar(value=DEFAULT_THRESHOLD)
+        tk.Scale(
+            rethreshold_frame,
+            variable=self.rethreshold_var,
+            from_=0.30, to=0.99, resolution=0.01,
+            orient='horizontal',
+            command=lambda value: self.schedule_preview()
+        ).pack(fill='x')
+        self.preview_label = tk.Label(rethreshold_frame, text="スライダーを動かすと、フォルダごとの枚数の変化を表示します。",
+                                      justify='left', anchor='w', wraplength=580)
+        self.preview_label.pack(fill='x')
+        self.rethreshold_button = tk.Button(
+            rethreshold_frame,
+            text="♻️ このしきい値で振り分け直す",
+            command=self.start_rethreshold_thread,
+            bg='lightgreen'
+        )
+        self.rethreshold_button.pack(pady=(5, 0))
 
         #プログレスバーの追加
         self.progress_bar = ttk.Progressbar(
@@ -99,7 +213,8 @@ class FaceSorterApp:
         tk.Label(self.master, text="結果とログ:", anchor="w").pack(fill='x', padx=10)
         self.result_text = scrolledtext.ScrolledText(self.master, wrap=tk.WORD, height=20, padx=5, pady=5)
         self.result_text.pack(fill='both', expand=True, padx=10, pady=10)
-        self.result_text.insert(tk.END, f"準備完了。\n現在のモデル学習人数: {len(le.classes_)}人\n\n")
+        self.result_text.insert(tk.END, f"準備完了。\n現在のモデル学習人数: {len(le.classes_)}人\n"
+                                        f"品質ティア: {QUALITY_TIER} (学習時: {model_quality.get('tier', '-')})\n\n")
 
     def select_directory(self, var):
         """フォルダ選択ダイアログを開き、StringVarを更新する"""
@@ -108,29 +223,60 @@ class FaceSorterApp:
             var.set(directory)
 
     def log(self, message):
-        """ログを結果エリアに追記する"""
-        self.result_text.insert(tk.END, message + "\n")
-        self.result_text.see(tk.END) # 最下行までスクロール
-        self.master.update()
+        """ログを結果エリアに追記する（どのスレッドからでも呼べる。表示はタイマーでまとめて行う）"""
+        self.bus.log(message)
 
     def start_sorting_thread(self):
         """GUIをフリーズさせないために、振り分け処理を別スレッドで開始する"""
         self.sort_button.config(state=tk.DISABLED, text="処理中...")
+        self.drainer.flush()
         self.result_text.delete('1.0', tk.END)
+
+        # 入力値はGUIスレッドで読み取ってから作業スレッドに渡す
+        output_dir = self.output_dir_var.get()
+        spill_path = None
+        if self.spill_log_var.get() and output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            spill_path = os.path.join(output_dir, LOG_FILE_NAME)
+        self.bus.set_spill(spill_path)
         self.log("--- 振り分け処理を開始します ---")
+
+        # 同じ条件で中断したジョブがあれば、再開するか確認する
+        settings = (self.input_dir_var.get(), output_dir, self.threshold_var.get(),
+                    self.multi_label_var.get(), self.get_output_mode())
+        resume = False
+        if output_dir:
+            entries = self.make_checkpoint(*settings).load()
+            if entries is not None:
+                resume = messagebox.askyesno(
+                    "再開",
+                    f"前回中断した振り分けがあります（{len(entries)} 枚処理済み）。\n"
+                    "途中から再開しますか？（いいえ を選ぶと最初からやり直します）"
+                )
         
         # 別スレッドで実行
-        threading.Thread(target=self.run_sorting_process).start()
+        settings += (resume,)
+        threading.Thread(target=self.run_sorting_process, args=settings).start()
+
+    def make_checkpoint(self, test_dir, output_dir, threshold_text, multi_label, output_mode):
+        """入力・出力フォルダ、設定、モデルが同じ場合だけ再開できるチェックポイント"""
+        signature = {
+            "test_dir": os.path.abspath(test_dir), "output_dir": os.path.abspath(output_dir),
+            "threshold": threshold_text, "multi_label": multi_label, "output_mode": output_mode,
+            "model_version": MODEL_VERSION, "quality": settings_key(QUALITY), "detector": DETECTION_POLICY,
+        }
+        return JobCheckpoint(os.path.join(output_dir, INDEX_DIR_NAME, CHECKPOINT_FILE_NAME), signature)
 
-    def run_sorting_process(self):
-        """sort_faces.pyのコアロジックを実装する（全顔チェック対応）"""
+    def run_sorting_process(self, test_dir, output_dir, threshold_text, multi_label, output_mode, resume=False):
+        """
+        sort_faces.pyのコアロジックを実装する（全顔チェック対応）。
+        画像ごとの判定結果はチェックポイント（ジャーナル）に追記し、resume=True なら未処理の画像から再開する。
+        """
         
         try:
-            # 入力値の取得と検証 (変更なし)
-            test_dir = self.input_dir_var.get()
-            output_dir = self.output_dir_var.get()
+            # 入力値の検証
             try:
-                conf_threshold = float(self.threshold_var.get())
+                conf_threshold = float(threshold_text)
             except ValueError:
                 self.log("🚨 エラー: しきい値が不正です。数値を入力してください。")
                 return
@@ -140,10 +286,24 @@ class FaceSorterApp:
                 return
             
             # --- コアロジックの開始 ---
+            profiler = StageProfiler("sort")
+            profiler.start()
+            self.profiler = profiler
             os.makedirs(output_dir, exist_ok=True)
             sorted_results = defaultdict(list)
+            index_records = [] # 画像ごとの顔・矩形・確信度（サイドカー/インデックス用）
+            result_images = [] # 画像ごとの確率ベクトル（しきい値の再適用用）
+            processed = set() # 判定が済んだファイル名
             total_files_processed = 0
-            
+
+            def add_result(entry):
+                """1枚分の判定結果を集計に加える（新しく処理した画像と、チェックポイントから再開した画像の両方）"""
+                for name, confidence in entry["folders"]:
+                    sorted_results[name].append((entry["filename"], confidence))
+                index_records.append(entry["index_record"])
+                result_images.append(entry["result_image"])
+                processed.add(entry["filename"])
+
             file_list = [f for f in os.listdir(test_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
             
             total_files = len(file_list)
@@ -152,73 +312,65 @@ class FaceSorterApp:
                 self.log("🚨 警告: 入力フォルダに画像ファイルが見つかりませんでした。")
                 return
 
-            self.log(f"✅ 設定: しきい値={conf_threshold}, 処理対象ファイル数={len(file_list)}")
+            # 処理対象があることを確認してからチェックポイントを開始する（空のジャーナルを残さない）
+            checkpoint = self.make_checkpoint(test_dir, output_dir, threshold_text, multi_label, output_mode)
+            for entry in checkpoint.start(resume):
+                add_result(entry)
+            if processed:
+                self.log(f"↩️ 前回の続きから再開します（{len(processed)} 枚処理済み）")
+
+            self.log(f"✅ 設定: しきい値={conf_threshold}, 処理対象ファイル数={len(file_list)}, "
+                     f"複数人配置={'ON' if multi_label else 'OFF'}, 配置方法={output_mode}")
+
+            # 検出の前に重複ファイルを見つけ、正本の識別結果を使い回す
+            with profiler.stage("dedup"):
+                dedup = find_duplicates([os.path.join(test_dir, f) for f in file_list], self.db.content_hash_for)
+            profiler.count("dedup_exact", dedup["exact"])
+            profiler.count("dedup_perceptual", dedup["perceptual"])
+            self.log(f"✅ {dedup_summary(dedup, total_files)}")
+            shared_faces = {} # 重複を持つ正本の識別結果 {正本のパス: faces}
             
             for i, filename in enumerate(file_list):
                 
                 current_count = i + 1
+                if filename in processed:
+                    total_files_processed += 1
+                    profiler.count("resumed")
+                    continue # 前回の実行で判定済み
                 
-                # ログ出力（進捗）- 🚨 修正：条件を削除し、常にログを出力 🚨
-                # ファイル名とその時点での進捗を毎回表示します
+                # ログ出力（進捗）- ファイル名とその時点での進捗を毎回記録します
+                # （画面への反映はGUIスレッドがタイマーでまとめて行う）
                 self.log(f"  > 処理中: {current_count} / {total_files} ファイル ({filename})")
-                
-                # プログレスバーの更新 (変更なし)
-                self.progress_bar.config(value=current_count)
-                self.master.update() # GUIを更新
+                self.bus.progress(current_count, total_files)
                 
                 image_path = os.path.join(test_dir, filename)
                 total_files_processed += 1
                 
-                # 初期設定
-                final_predicted_name = "Unknown"
-                best_confidence = 0.0
-
+                profiler.count("images")
                 try:
-                    # 1. 顔検出とエンコーディング抽出
-                    image = face_recognition.load_image_file(image_path)
-                    
-                    #検出方法
-                    #face_locations = face_recognition.face_locations(image, model="hog" , number_of_times_to_upsample=2)
-                    face_locations = face_recognition.face_locations(image, model="cnn") 
-                    
-                    if len(face_locations) > 0:
-                        # 検出されたすべての顔をチェックするループ
-                        encodings = face_recognition.face_encodings(image, face_locations)
-                        
-                        for test_encoding in encodings:
-                            test_encoding = test_encoding.reshape(1, -1)
-                            
-                            # 2. 識別と信頼度計算
-                            probabilities = clf.predict_proba(test_encoding)[0]
-                            max_proba = np.max(probabilities)
-                            max_index = np.argmax(probabilities)
-                            
-                            # 3. しきい値に基づいて人物名を決定
-                            current_predicted_name = "Unknown"
-                            if max_proba >= conf_threshold:
-                                prediction_numeric = np.array([max_index])
-                                current_predicted_name = le.inverse_transform(prediction_numeric)[0]
-
-                            # 4. 振り分け名の決定: Unknownではない、かつ、より高い確信度の場合に採用
-                            if current_predicted_name != "Unknown":
-                                if max_proba > best_confidence:
-                                    best_confidence = max_proba
-                                    final_predicted_name = current_predicted_name
-                            
-                        # 5. ループ終了後の最終判定
-                        if final_predicted_name != "Unknown":
-                            sorted_results[final_predicted_name].append((filename, best_confidence))
-                        else:
-                            # すべての顔がUnknownだった場合
-                            sorted_results["Unknown"].append((filename, best_confidence))
-                        
-                    else:
-                        final_predicted_name = "Unknown (No Face)"
-                        sorted_results[final_predicted_name].append((filename, 0.0))
+                    faces = self.classify_deduplicated(image_path, dedup, shared_faces, conf_threshold, profiler)
+                    folders = decide_folders(faces, multi_label)
+                    profiler.count("faces", len(faces))
+                    error = False
 
                 except Exception as e:
                     self.log(f"⚠️ ファイル {filename} の処理中にエラーが発生しました: {e}")
-                    sorted_results["Unknown (Error)"].append((filename, 0.0))
+                    faces, folders = [], [("Unknown (Error)", 0.0)]
+                    error = True
+
+                entry = {
+                    "filename": filename,
+                    "folders": folders,
+                    "index_record": make_record(filename, image_path, faces, [name for name, _ in folders]),
+                    "result_image": make_result_image(filename, image_path, faces, [name for name, _ in folders],
+                                                      len(le.classes_), error),
+                }
+                add_result(entry)
+
+                # 途中経過の保存（この画像の結果を追加し、一定時間・一定枚数ごとに追記）
+                checkpoint.add(entry)
+                with profiler.stage("checkpoint"):
+                    checkpoint.maybe_save(self.db.flush) # DBの内容もチェックポイントと揃えておく
             
             
             # --- 4. フォルダへの振り分けと結果の表示 (変更なし) ---
@@ -234,20 +386,228 @@ class FaceSorterApp:
                     source_path = os.path.join(test_dir, filename)
                     dest_path = os.path.join(output_folder_path, filename)
                     
-                    # ファイルをコピーして振り分け
-                    shutil.copy(source_path, dest_path) 
+                    # ファイルを配置して振り分け（コピー / ハードリンク / シンボリックリンク）
+                    with profiler.stage("io"):
+                        place_file(source_path, dest_path, output_mode)
+
+            # --- 5. サイドカーとインデックスの書き込み ---
+            with profiler.stage("index"):
+                for record in index_records:
+                    write_sidecar(output_dir, record)
+                write_index(output_dir, index_records)
+                save_results(output_dir, le.classes_, result_images)
+            self.stored_results = None # プレビュー用の読み込み結果を破棄
+            checkpoint.clear() # 最後まで完了したので途中経過は不要
+
+            # --- 6. エンコーディングのエクスポート（前回からの差分のみ追記） ---
+            if EXPORT_ENCODINGS:
+                try:
+                    with profiler.stage("export"):
+                        store = EncodingStore()
+                        added = sync_from_db(self.db, store)
+                    self.log(f"\nエンコーディングのエクスポート: {added} 件を追記（合計 {store.count()} 件）")
+                except OSError as e:
+                    self.log(f"\n⚠️ エンコーディングのエクスポートに失敗しました: {e}")
+
+            profile_path = profiler.stop()
+            self.log("\n--- 処理統計 ---")
+            self.log(profiler.summary_text())
+            if profile_path:
+                self.log(f"cProfileの結果: {profile_path}")
             
             self.log("\n==================================================")
             self.log(f"✅ 処理完了！ {total_files_processed} ファイルを振り分けました。")
-            self.log(f"結果は '{output_dir}' にコピーされています。")
+            self.log(f"結果は '{output_dir}' に配置されています。")
+            self.log(f"顔・矩形・確信度の一覧: {os.path.join(output_dir, INDEX_CSV_NAME)}")
             self.log("==================================================")
             
         except Exception as e:
             self.log(f"\n致命的なエラーが発生しました: {e}")
-            messagebox.showerror("エラー", f"予期せぬエラー: {e}")
+            self.bus.call(messagebox.showerror, "エラー", f"予期せぬエラー: {e}")
             
         finally:
-            self.sort_button.config(state=tk.NORMAL, text="🚀 振り分け実行 (ファイルをコピーします)")
+            self.db.flush()
+            self.bus.call(self.sort_button.config, state=tk.NORMAL, text="🚀 振り分け実行")
+            self.bus.call(self.bus.set_spill, None) # ログファイルを閉じる
+
+    def get_output_mode(self):
+        """コンボボックスの表示名から配置方法を取得する"""
+        for mode, label in OUTPUT_MODE_LABELS.items():
+            if label == self.output_mode_var.get():
+                return mode
+        return OUTPUT_MODE_COPY
+
+    def classify_deduplicated(self, image_path, dedup, shared_faces, conf_threshold, profiler=None):
+        """
+        重複ファイルは正本の識別結果を使い回す（矩形は解像度に合わせて変換）。
+        正本がまだ処理されていなければ先に処理し、結果を shared_faces に残す。
+        """
+        canonical = dedup["canonical"].get(image_path, image_path)
+        if canonical not in shared_faces:
+            faces = self.classify_image(canonical, conf_threshold, profiler)
+            if canonical not in dedup["has_duplicates"]:
+                return faces
+            shared_faces[canonical] = faces
+        faces = shared_faces[canonical]
+        if canonical == image_path:
+            return faces
+        if profiler is not None:
+            profiler.count("detect_skipped")
+        boxes = scale_locations([face["box"] for face in faces], dedup["sizes"][canonical], dedup["sizes"][image_path])
+        return [dict(face, box=box) for face, box in zip(faces, boxes)]
+
+    def classify_image(self, image_path, conf_threshold, profiler=None):
+        """
+        1枚の画像の全顔をチェックし、顔ごとの識別結果を返す
+        戻り値: [{"box": (top, right, bottom, left), "identity": 人物名 or "Unknown", "confidence": 0〜1,
+                  "probabilities": 全人物の確率ベクトル}, ...]
+                （顔が検出されなかった場合は空リスト）
+        """
+        # 分散振り分けのワーカー・ベンチマークと同じ image_pipeline の処理を使う
+        return classify_image(self.db, image_path, clf, le, conf_threshold, DETECTION_POLICY, QUALITY, MODEL_VERSION,
+                              profiler=profiler)
+
+    # --- 3.5.1. しきい値の再適用 ---
+    def load_stored_results(self):
+        """出力フォルダに保存された前回の確率ベクトルを読み込む（読み込み済みならそれを使う）"""
+        output_dir = self.output_dir_var.get()
+        if self.stored_results is None or self.stored_results[0] != output_dir:
+            self.stored_results = (output_dir, load_results(output_dir))
+        return self.stored_results[1]
+
+    def schedule_preview(self):
+        """スライダーの連続移動で計算が溜まらないよう、少し待ってからプレビューを更新する"""
+        if self.preview_job is not None:
+            self.master.after_cancel(self.preview_job)
+        self.preview_job = self.master.after(PREVIEW_DELAY_MS, self.update_preview)
+
+    def update_preview(self):
+        """しきい値を変えた場合のフォルダごとの枚数を、現在の配置と比較して表示する"""
+        self.preview_job = None
+        results = self.load_stored_results()
+        if results is None:
+            self.preview_label.config(text="前回の振り分け結果がありません。先に振り分けを実行してください。")
+            return
+
+        threshold = self.rethreshold_var.get()
+        multi_label = self.multi_label_var.get()
+        current = defaultdict(int)
+        for image in results["images"]:
+            for name in image.get("folders", []):
+                current[name] += 1
+        preview = preview_folder_counts(results, threshold, multi_label)
+
+        lines = []
+        for name in sorted(set(current) | set(preview)):
+            before, after = current.get(name, 0), preview.get(name, 0)
+            diff = f" ({after - before:+d})" if after != before else ""
+            lines.append(f"{name}: {after}{diff}")
+        self.preview_label.config(text=f"しきい値 {threshold:.2f} → " + " / ".join(lines))
+
+    def start_rethreshold_thread(self):
+        """保存済みの確率ベクトルから、別スレッドで振り分けをやり直す"""
+        self.rethreshold_button.config(state=tk.DISABLED)
+        settings = (self.output_dir_var.get(), self.rethreshold_var.get(), self.multi_label_var.get(),
+                    self.get_output_mode())
+        threading.Thread(target=self.run_rethreshold, args=settings).start()
+
+    def run_rethreshold(self, output_dir, threshold, multi_label, output_mode):
+        try:
+            start = time.time()
+            changed = reapply_threshold(output_dir, threshold, multi_label, output_mode)
+            self.stored_results = None
+            self.bus.call(self.threshold_var.set, f"{threshold:.2f}")
+            self.log(f"♻️ しきい値 {threshold:.2f} を再適用しました: {changed} ファイルの配置を変更 ({time.time() - start:.1f}秒)")
+        except Exception as e:
+            self.log(f"🚨 しきい値の再適用に失敗しました: {e}")
+        finally:
+            self.bus.call(self.rethreshold_button.config, state=tk.NORMAL)
+
+    # --- 3.5.2. Unknownの顔のクラスタリング ---
+    def start_clustering_thread(self):
+        """出力フォルダの Unknown にある顔をクラスタリングし、新しい人物の候補フォルダを作る"""
+        unknown_dir = os.path.join(self.output_dir_var.get(), "Unknown")
+        if not os.path.isdir(unknown_dir):
+            self.log(f"🚨 エラー: Unknownフォルダ '{unknown_dir}' が見つかりません。先に振り分けを実行してください。")
+            return
+        self.cluster_button.config(state=tk.DISABLED)
+        threading.Thread(target=self.run_clustering_process, args=(unknown_dir,)).start()
+
+    def run_clustering_process(self, unknown_dir):
+        try:
+            self.log("\n--- Unknownの顔のクラスタリングを開始します ---")
+            created = run_clustering(unknown_dir, TRAIN_DIR, log=self.log)
+            self.log(f"✅ {len(created)} 個の候補フォルダを '{TRAIN_DIR}' に作成しました。")
+        except Exception as e:
+            self.log(f"🚨 クラスタリング中にエラーが発生しました: {e}")
+        finally:
+            self.bus.call(self.cluster_button.config, state=tk.NORMAL)
+
+    # --- 3.6. フォルダ監視（ライブ振り分け） ---
+    def toggle_live_sorting(self):
+        """入力フォルダの監視を開始/停止する。新しい画像は到着次第その場で振り分ける"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.log(f"--- ライブ振り分けを停止しました ({self.watcher.metrics.summary()}) ---")
+            self.watcher = None
+            self.live_button.config(text="👁 ライブ振り分け開始 (入力フォルダを監視)")
+            self.sort_button.config(state=tk.NORMAL)
+            return
+
+        test_dir = self.input_dir_var.get()
+        output_dir = self.output_dir_var.get()
+        try:
+            conf_threshold = float(self.threshold_var.get())
+        except ValueError:
+            self.log("🚨 エラー: しきい値が不正です。数値を入力してください。")
+            return
+        if not os.path.isdir(test_dir):
+            self.log(f"🚨 エラー: 入力フォルダ '{test_dir}' が見つかりません。")
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        multi_label = self.multi_label_var.get()
+        output_mode = self.get_output_mode()
+
+        # しきい値の再適用で使う確率ベクトル（同じモデルで保存された結果があれば続きに追加する）
+        saved = load_results(output_dir)
+        if saved is not None and list(saved["classes"]) == list(le.classes_):
+            result_images = {image["filename"]: image for image in saved["images"]}
+        else:
+            result_images = {}
+
+        def sort_live_image(image_path):
+            filename = os.path.basename(image_path)
+            error = False
+            try:
+                faces = self.classify_image(image_path, conf_threshold)
+                folders = decide_folders(faces, multi_label)
+            except Exception as e:
+                self.log(f"⚠️ ファイル {filename} の処理中にエラーが発生しました: {e}")
+                faces, folders = [], [("Unknown (Error)", 0.0)]
+                error = True
+            for name, _ in folders:
+                output_folder_path = os.path.join(output_dir, name)
+                os.makedirs(output_folder_path, exist_ok=True)
+                place_file(image_path, os.path.join(output_folder_path, filename), output_mode)
+
+            # ライブ振り分けではDBとインデックスに1件ずつ書き込む
+            self.db.flush()
+            record = make_record(filename, image_path, faces, [name for name, _ in folders])
+            write_sidecar(output_dir, record)
+            append_index(output_dir, [record])
+            result_images[filename] = make_result_image(filename, image_path, faces, [name for name, _ in folders],
+                                                        len(le.classes_), error)
+            save_results(output_dir, le.classes_, list(result_images.values()))
+
+            summary = ", ".join(f"'{name}' ({proba:.2f})" for name, proba in folders)
+            self.log(f"  > {filename} → {summary} | {watcher.metrics.summary()}")
+
+        watcher = FolderWatcher(test_dir, sort_live_image)
+        watcher.start()
+        self.watcher = watcher
+        self.sort_button.config(state=tk.DISABLED)
+        self.live_button.config(text="⏹ ライブ振り分け停止")
+        self.log(f"--- ライブ振り分けを開始しました ({self.watcher.mode}): {test_dir} → {output_dir} ---")
             
 
 
@@ -0,0 +1,285 @@
+# sort_index.py
+
+import os
+import sys
+import csv
+import json
+import shutil
+import pickle
+from collections import Counter
+import numpy as np
+from face_assignment import assign_identities, UNKNOWN_INDEX
+
+# --- 1. 定数設定 ---
+INDEX_DIR_NAME = "_index"     # 出力フォルダ内の、画像ごとのJSONサイドカーを置くフォルダ
+INDEX_CSV_NAME = "index.csv"  # 全画像・全顔をまとめた一覧
+RESULTS_FILE_NAME = "sort_results.pkl"  # 顔ごとの確率ベクトル（しきい値の再適用用）
+INDEX_COLUMNS = ["filename", "source_path", "face_index", "top", "right", "bottom", "left",
+                 "identity", "confidence", "folders"]
+
+# 出力モード（振り分け時のファイル配置方法）
+OUTPUT_MODE_COPY = "copy"
+OUTPUT_MODE_HARDLINK = "hardlink"  # 同じディスク上なら容量を消費しない（不可能な場合はコピー）
+OUTPUT_MODE_SYMLINK = "symlink"
+OUTPUT_MODES = (OUTPUT_MODE_COPY, OUTPUT_MODE_HARDLINK, OUTPUT_MODE_SYMLINK)
+
+# --- 2. ファイル配置 ---
+
+def place_file(source_path, dest_path, mode=OUTPUT_MODE_COPY):
+    """
+    振り分け先にファイルを配置する。
+    ハードリンク/シンボリックリンクが作れない場合（別ドライブ、権限など）はコピーにフォールバックする。
+    戻り値: 実際に使われた配置方法
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+
+    if mode == OUTPUT_MODE_HARDLINK:
+        try:
+            os.link(source_path, dest_path)
+            return OUTPUT_MODE_HARDLINK
+        except OSError:
+            pass
+    elif mode == OUTPUT_MODE_SYMLINK:
+        try:
+            os.symlink(os.path.abspath(source_path), dest_path)
+            return OUTPUT_MODE_SYMLINK
+        except OSError:
+            pass
+
+    shutil.copy(source_path, dest_path)
+    return OUTPUT_MODE_COPY
+
+# --- 3. 振り分け先の決定 ---
+
+def decide_folders(faces, multi_label=False):
+    """
+    顔ごとの識別結果から、画像を配置するフォルダを決める。
+    multi_label=False: 最も確信度の高い人物1人のフォルダのみ
+    multi_label=True : しきい値を超えて識別された全員のフォルダ（グループ写真用）
+    戻り値: [(フォルダ名, 確信度), ...]
+    """
+    if not faces:
+        return [("Unknown (No Face)", 0.0)]
+
+    recognized = sorted(
+        ((face["identity"], face["confidence"]) for face in faces if face["identity"] != "Unknown"),
+        key=lambda item: -item[1]
+    )
+    if not recognized:
+        # すべての顔がUnknownだった場合
+        return [("Unknown", 0.0)]
+    if multi_label:
+        return recognized
+    return recognized[:1]
+
+# --- 4. インデックスの書き込み ---
+
+def make_record(filename, source_path, faces, folders):
+    """
+    1画像分のインデックスレコードを作る。
+    faces: [{"box": (top, right, bottom, left), "identity": 名前, "confidence": 0〜1}, ...]
+    folders: この画像が配置されたフォルダ名のリスト
+    """
+    return {
+        "filename": filename,
+        "source_path": os.path.abspath(source_path),
+        "folders": list(folders),
+        "faces": [
+            {"box": [int(v) for v in face["box"]], "identity": face["identity"],
+             "confidence": round(float(face["confidence"]), 4)}
+            for face in faces
+        ],
+    }
+
+def write_sidecar(output_dir, record):
+    """画像ごとのJSONサイドカー (_index/<ファイル名>.json) を書き込む"""
+    index_dir = os.path.join(output_dir, INDEX_DIR_NAME)
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, record["filename"] + ".json"), 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=1)
+
+def _record_rows(record):
+    """レコードをCSVの行（1顔1行、顔がない画像は1行）に展開する"""
+    folders = ";".join(record["folders"])
+    if not record["faces"]:
+        return [[record["filename"], record["source_path"], -1, "", "", "", "", "", 0.0, folders]]
+    return [
+        [record["filename"], record["source_path"], i, *face["box"], face["identity"], face["confidence"], folders]
+        for i, face in enumerate(record["faces"])
+    ]
+
+def write_index(output_dir, records):
+    """振り分け実行ごとに、インデックスCSVを作り直す"""
+    path = os.path.join(output_dir, INDEX_CSV_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(INDEX_COLUMNS)
+        for record in records:
+            writer.writerows(_record_rows(record))
+    os.replace(tmp_path, path)
+
+def append_index(output_dir, records):
+    """インデックスCSVに追記する（ライブ振り分け用）"""
+    path = os.path.join(output_dir, INDEX_CSV_NAME)
+    is_new = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if is_new:
+            writer.writerow(INDEX_COLUMNS)
+        for record in records:
+            writer.writerows(_record_rows(record))
+
+# --- 5. インデックスの検索 ---
+
+def read_index(output_dir):
+    """インデックスCSVを読み込み、行（辞書）のリストを返す"""
+    path = os.path.join(output_dir, INDEX_CSV_NAME)
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+def query_person(output_dir, name, min_confidence=0.0):
+    """
+    指定した人物が写っている画像の一覧を返す（顔検出を再実行せずにインデックスから検索）。
+    戻り値: [(ファイル名, 元画像のパス, 確信度), ...]（確信度の高い順）
+    """
+    best = {}
+    for row in read_index(output_dir):
+        if row["identity"] != name:
+            continue
+        confidence = float(row["confidence"])
+        if confidence < min_confidence:
+            continue
+        key = (row["filename"], row["source_path"])
+        best[key] = max(best.get(key, 0.0), confidence)
+    return sorted(((f, p, c) for (f, p), c in best.items()), key=lambda item: -item[2])
+
+
+# --- 6. しきい値の再適用（再検出なし） ---
+
+def make_result_image(filename, source_path, faces, folders, num_classes, error=False):
+    """save_results に渡す1画像分の結果を作る（faces は識別結果。probabilities を含む）"""
+    return {
+        "filename": filename,
+        "source_path": os.path.abspath(source_path),
+        "boxes": [face["box"] for face in faces],
+        "probabilities": np.array([face["probabilities"] for face in faces]).reshape(len(faces), num_classes),
+        "error": error,
+        "folders": list(folders),
+        "identities": [face["identity"] for face in faces],
+    }
+
+def save_results(output_dir, classes, images):
+    """
+    振り分け実行時の顔ごとの確率ベクトルを保存する。
+    images: [{"filename", "source_path", "boxes", "probabilities"((顔数, 人物数) の配列),
+              "error"(処理エラーならTrue), "folders"(現在配置されているフォルダ),
+              "identities"(顔ごとの現在の識別結果)}, ...]
+    """
+    index_dir = os.path.join(output_dir, INDEX_DIR_NAME)
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, RESULTS_FILE_NAME)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump({"classes": list(classes), "images": images}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+def load_results(output_dir):
+    """保存された確率ベクトルを読み込む（なければ None）"""
+    path = os.path.join(output_dir, INDEX_DIR_NAME, RESULTS_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def faces_for_threshold(image, classes, threshold):
+    """保存された確率から、指定しきい値での顔ごとの識別結果を作る"""
+    assigned, confidences = assign_identities(image["probabilities"], threshold)
+    return [
+        {"box": box, "identity": "Unknown" if c == UNKNOWN_INDEX else classes[c], "confidence": float(conf)}
+        for box, c, conf in zip(image["boxes"], assigned, confidences)
+    ]
+
+def folders_for_threshold(image, classes, threshold, multi_label=False):
+    """保存された確率から、指定しきい値での配置フォルダ名のリストを作る"""
+    if image.get("error"):
+        return ["Unknown (Error)"]
+    faces = faces_for_threshold(image, classes, threshold)
+    return [name for name, _ in decide_folders(faces, multi_label)]
+
+def preview_folder_counts(results, threshold, multi_label=False):
+    """
+    しきい値を変えた場合のフォルダごとの枚数を計算する（スライダーのプレビュー用）。
+    顔が1つの画像（大半）は numpy でまとめて判定し、複数顔の画像だけ個別に割り当てを行う。
+    戻り値: {フォルダ名: 枚数}
+    """
+    classes = results["classes"]
+    counts = Counter()
+    single_probs = []
+    for image in results["images"]:
+        num_faces = len(image["boxes"])
+        if image.get("error") or num_faces != 1:
+            counts.update(folders_for_threshold(image, classes, threshold, multi_label))
+        else:
+            single_probs.append(image["probabilities"][0])
+
+    if single_probs:
+        probs = np.asarray(single_probs)
+        best = probs.argmax(axis=1)
+        accepted = probs[np.arange(len(best)), best] >= threshold
+        if not accepted.all():
+            counts["Unknown"] += int((~accepted).sum())
+        for class_index, count in zip(*np.unique(best[accepted], return_counts=True)):
+            counts[classes[class_index]] += int(count)
+    return dict(counts)
+
+def reapply_threshold(output_dir, threshold, multi_label=False, mode=OUTPUT_MODE_COPY):
+    """
+    保存された確率ベクトルから振り分けをやり直す（顔検出・識別は再実行しない）。
+    配置が変わるファイルだけを移動し、サイドカーとインデックスを更新する。
+    戻り値: 配置が変わったファイル数
+    """
+    results = load_results(output_dir)
+    if results is None:
+        raise FileNotFoundError(f"確率ベクトルが保存されていません: {os.path.join(output_dir, INDEX_DIR_NAME)}")
+
+    classes = results["classes"]
+    changed = 0
+    records = []
+    for image in results["images"]:
+        faces = [] if image.get("error") else faces_for_threshold(image, classes, threshold)
+        new_folders = folders_for_threshold(image, classes, threshold, multi_label)
+        old_folders = image.get("folders", [])
+        if set(new_folders) != set(old_folders):
+            changed += 1
+            for name in set(old_folders) - set(new_folders):
+                old_path = os.path.join(output_dir, name, image["filename"])
+                if os.path.lexists(old_path):
+                    os.remove(old_path)
+            for name in set(new_folders) - set(old_folders):
+                folder_path = os.path.join(output_dir, name)
+                os.makedirs(folder_path, exist_ok=True)
+                place_file(image["source_path"], os.path.join(folder_path, image["filename"]), mode)
+
+        # 配置または顔ごとの識別結果が変わった画像だけサイドカーを書き直す
+        identities = [face["identity"] for face in faces]
+        record = make_record(image["filename"], image["source_path"], faces, new_folders)
+        if set(new_folders) != set(old_folders) or identities != image.get("identities"):
+            write_sidecar(output_dir, record)
+        image["folders"] = new_folders
+        image["identities"] = identities
+        records.append(record)
+
+    write_index(output_dir, records)
+    save_results(output_dir, classes, results["images"])
+    return changed
+
+
+if __name__ == "__main__":
+    # 使い方: python sort_index.py <出力フォルダ> <人物名> [最小確信度]
+    if len(sys.argv) < 3:
+        print("使い方: python sort_index.py <出力フォルダ> <人物名> [最小確信度]")
+        sys.exit(1)
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    for filename, source_path, confidence in query_person(sys.argv[1], sys.argv[2], threshold):
+        print(f"{confidence:.3f}\t{source_path}")
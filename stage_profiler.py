@@ -0,0 +1,215 @@
+# stage_profiler.py
+
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import datetime
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+
+try:
+    import resource  # Mac/Linux のみ
+except ImportError:
+    resource = None
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.path.join(PROJECT_ROOT, "profiles")
+# 環境変数 PICA_CPROFILE=1 で起動すると、実行ごとに cProfile の結果 (.prof) を保存する
+ENABLE_CPROFILE = os.environ.get("PICA_CPROFILE") == "1"
+
+# --- 2. メモリ使用量 ---
+
+def peak_rss_mb():
+    """プロセスの最大常駐メモリ (MB)。取得できない環境では None"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB、Mac は バイト単位
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except Exception:
+        return None
+
+def percentile(sorted_values, p):
+    """ソート済みリストのパーセンタイル値"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# --- 3. 計測本体 ---
+
+class StageProfiler:
+    """
+    処理ステージ（読み込み・検出・エンコード・識別・切り抜き・ファイルI/O・GUI更新など）ごとの
+    所要時間とカウンター（画像数、顔数など）を記録する。
+    """
+
+    def __init__(self, tool_name):
+        self.tool_name = tool_name
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)  # {ステージ名: [秒, ...]}
+        self.counters = defaultdict(int)    # {カウンター名: 値}
+        self.start_time = None
+        self.end_time = None
+        self._cprofile = None
+
+    def start(self):
+        """計測を開始する（ENABLE_CPROFILE の場合は cProfile も開始）"""
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        if ENABLE_CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        """計測を終了する。cProfile の結果があれば保存し、そのパスを返す"""
+        self.end_time = time.perf_counter()
+        if self._cprofile is None:
+            return None
+        self._cprofile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(PROFILE_DIR, f"{self.tool_name}_{stamp}.prof")
+        self._cprofile.dump_stats(path)
+        self._cprofile = None
+        return path
+
+    @contextmanager
+    def stage(self, name):
+        """with profiler.stage("detect"): のように使い、ブロックの所要時間を記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name].append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    @property
+    def wall_seconds(self):
+        if self.start_time is None:
+            return 0.0
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        return end - self.start_time
+
+    def summary(self):
+        """計測結果をまとめた辞書"""
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+            counters = dict(self.counters)
+
+        wall = self.wall_seconds
+        images = counters.get("images", 0)
+        stages = {}
+        for name, values in durations.items():
+            total = sum(values)
+            stages[name] = {
+                "count": len(values),
+                "total_sec": round(total, 4),
+                "share": round(total / wall, 4) if wall > 0 else 0.0,
+                "mean_ms": round(total / len(values) * 1000, 3),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+            }
+        peak = peak_rss_mb()
+        return {
+            "tool": self.tool_name,
+            "wall_sec": round(wall, 3),
+            "images": images,
+            "images_per_sec": round(images / wall, 3) if wall > 0 else 0.0,
+            "faces_per_image": round(counters.get("faces", 0) / images, 3) if images else 0.0,
+            "peak_rss_mb": round(peak, 1) if peak is not None else None,
+            "counters": counters,
+            "stages": stages,
+        }
+
+    def summary_text(self):
+        """GUI・ログ表示用のテキスト"""
+        s = self.summary()
+        lines = [
+            f"ツール: {s['tool']} | 経過時間: {s['wall_sec']:.1f}s",
+            f"画像: {s['images']} 枚 ({s['images_per_sec']:.2f} 枚/秒) | 顔/画像: {s['faces_per_image']:.2f}",
+            f"最大メモリ: {s['peak_rss_mb']} MB" if s['peak_rss_mb'] is not None else "最大メモリ: 取得不可",
+            "",
+            f"{'ステージ':<12}{'回数':>8}{'合計(s)':>10}{'割合':>8}{'p50(ms)':>10}{'p95(ms)':>10}",
+        ]
+        for name, st in sorted(s["stages"].items(), key=lambda item: -item[1]["total_sec"]):
+            lines.append(f"{name:<12}{st['count']:>8}{st['total_sec']:>10.2f}{st['share'] * 100:>7.1f}%"
+                         f"{st['p50_ms']:>10.1f}{st['p95_ms']:>10.1f}")
+        other_counters = {k: v for k, v in s["counters"].items() if k not in ("images", "faces")}
+        if other_counters:
+            lines.append("")
+            lines.append("カウンター: " + ", ".join(f"{k}={v}" for k, v in sorted(other_counters.items())))
+        return "\n".join(lines)
+
+    # --- 3.1. エクスポート ---
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def export_csv(self, path):
+        """ステージごとに1行のCSV（全体の値は stage='_total' の行）"""
+        s = self.summary()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["tool", "stage", "count", "total_sec", "share", "mean_ms", "p50_ms", "p95_ms"])
+            writer.writerow([s["tool"], "_total", s["images"], s["wall_sec"], 1.0, "", "", ""])
+            for name, st in s["stages"].items():
+                writer.writerow([s["tool"], name, st["count"], st["total_sec"], st["share"],
+                                 st["mean_ms"], st["p50_ms"], st["p95_ms"]])
+
+def timed(profiler, name):
+    """profiler が None の場合は何もしないコンテキストを返す（計測を任意にするためのヘルパー）"""
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+# --- 4. GUIの統計パネル ---
+
+def show_summary_window(master, profiler):
+    """計測結果を表示し、JSON/CSVに保存できるウィンドウを開く"""
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+
+    if profiler is None or profiler.start_time is None:
+        messagebox.showinfo("統計", "まだ計測結果がありません。処理を実行してください。")
+        return
+
+    window = tk.Toplevel(master)
+    window.title(f"📊 処理統計 - {profiler.tool_name}")
+    text = tk.Text(window, width=80, height=22, font=('Courier', 10))
+    text.insert(tk.END, profiler.summary_text())
+    text.config(state=tk.DISABLED)
+    text.pack(padx=10, pady=10, fill='both', expand=True)
+
+    def export(kind):
+        path = filedialog.asksaveasfilename(
+            parent=window,
+            defaultextension=f".{kind}",
+            filetypes=[(kind.upper(), f"*.{kind}")],
+            initialfile=f"{profiler.tool_name}_stats.{kind}"
+        )
+        if not path:
+            return
+        if kind == "json":
+            profiler.export_json(path)
+        else:
+            profiler.export_csv(path)
+
+    button_frame = tk.Frame(window)
+    button_frame.pack(pady=(0, 10))
+    tk.Button(button_frame, text="JSONで保存", command=lambda: export("json")).pack(side='left', padx=5)
+    tk.Button(button_frame, text="CSVで保存", command=lambda: export("csv")).pack(side='left', padx=5)
+    tk.Button(button_frame, text="閉じる", command=window.destroy).pack(side='left', padx=5)
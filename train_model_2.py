@@ -1,38 +1,103 @@
 # train_model_2.py
 import platform  # OSを判別するため
 import subprocess # Mac/Linuxでフォルダを開くため
-import face_recognition
 import numpy as np
 import os
-import pickle
+import sys
 from sklearn.svm import SVC
 from sklearn.preprocessing import LabelEncoder
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
 import time # 処理時間計測用
+import threading # GUIをフリーズさせないために、学習を別スレッドで実行
+from face_database import FaceDatabase, detect_and_encode
+from image_pipeline import encode_training_image
+from stage_profiler import StageProfiler, show_summary_window
+from progress_bus import ProgressBus, BusDrainer
+from face_detection import POLICY_CNN
+from quality_tiers import tier_settings, save_model_bundle, TIER_ACCURATE
+from job_checkpoint import JobCheckpoint
+from training_memory import (EncodingMatrix, select_samples, budget_cap, training_matrix, estimate_peak_bytes,
+                             SELECTION_PROTOTYPE, SVM_CACHE_MB)
+from identity_stats import (identity_statistics, choose_faces, find_outliers, summary_lines, write_outlier_report,
+                            OUTLIER_AUTO, OUTLIER_REVIEW, OUTLIER_OFF)
 
 # --- 1. 定数設定 ---
 TRAIN_DIR = "train_data"
 MODEL_FILE = "face_classifier_model.pkl"
 ENCODINGS_FILE = "face_encodings.pkl"
+DETECTION_POLICY = POLICY_CNN # 学習データは精度を優先して常にCNNで検出する（face_detection.py）
+QUALITY_TIER = TIER_ACCURATE # 登録（学習）は精度優先。設定はモデルファイルに記録され、識別時に参照される（quality_tiers.py）
+CHECKPOINT_FILE = "train_checkpoint.pkl" # 特徴量抽出の途中経過（中断後の再開用）
+ENCODING_MATRIX_FILE = "train_encodings.npy" # 大量の学習データの特徴量を溜めるメモリマップ（training_memory.py）
+MAX_PER_IDENTITY = 0 # 人物ごとの学習サンプル数の上限（0なら無制限。メモリの上限を超える場合は自動で設定される）
+SAMPLE_SELECTION = SELECTION_PROTOTYPE # 上限を超えた人物から残すサンプルの選び方（prototype / random）
+OUTLIER_MODE = OUTLIER_REVIEW # 外れ値（ラベル間違いの可能性が高い学習画像）の扱い: auto / review / off（identity_stats.py）
+OUTLIER_REPORT_FILE = "train_outliers.csv" # 外れ値の一覧（確認用）
+COMPARE_BEFORE_PRUNING = True # 外れ値を除外した場合、除外前のモデルも学習してサポートベクター数を比較する（学習時間が増える）
+HEADLESS_REPORT_SEC = 1.0 # GUIなしで実行する場合に進捗を表示する間隔（秒）
+last_run = {"profiler": None, "ok": False} # 直近の学習の計測結果（処理統計ボタン用）と成否
 
 # --- 2. モデル学習ロジック（GUIから呼び出す関数） ---
 
-def run_training_logic(root, status_label, progress_bar, time_label):
-    """メインの学習ロジックを実行し、GUIにステータスと進捗を反映させる"""
+def make_checkpoint():
+    """学習フォルダと検出・品質設定が同じ場合だけ再開できるチェックポイント"""
+    signature = {"train_dir": os.path.abspath(TRAIN_DIR), "detector": DETECTION_POLICY,
+                 "quality": tier_settings(QUALITY_TIER)}
+    return JobCheckpoint(CHECKPOINT_FILE, signature)
+
+def start_training(bus, train_button):
+    """学習ボタンの処理: 中断したジョブがあれば再開するか確認し、学習を別スレッドで開始する"""
+    resume = False
+    entries = make_checkpoint().load()
+    if entries is not None:
+        resume = messagebox.askyesno(
+            "再開",
+            f"前回中断した学習があります（{len(entries)} 枚処理済み）。\n"
+            "途中から再開しますか？（いいえ を選ぶと最初からやり直します）"
+        )
+    train_button.config(state=tk.DISABLED)
+    threading.Thread(target=run_training_logic, args=(bus, train_button, resume)).start()
+
+def run_training_logic(bus, train_button, resume=False):
+    """
+    メインの学習ロジックを実行する（作業スレッド）。
+    ステータスと進捗は bus 経由で渡し、GUIスレッドがタイマーでまとめて反映する。
+    特徴量抽出の結果は1枚ごとにチェックポイント（ジャーナル）に追記し、resume=True なら続きから処理する。
+    """
     
-    status_label.config(text="処理開始: 初期準備中...")
-    status_label.update()
-    root.update()
+    bus.set_label("status", "処理開始: 初期準備中...")
 
-    known_encodings = []
+    known_encodings = None # 特徴量の行列（画像数が分かってから確保する）
     known_names = []
+    known_paths = [] # 各行の画像のパス（外れ値の一覧用）
+    alternates = {} # 複数の顔が写っていた画像の {行番号: 全顔のエンコーディング}
+    processed = set() # 特徴量抽出が済んだ画像のパス
     total_images = 0 # 全体の画像数をカウントするための変数
+    face_db = FaceDatabase() # 検出結果の保存先（再学習時はここから読み戻す）
+    quality = tier_settings(QUALITY_TIER) # 検出・エンコーディングの設定
+    checkpoint = make_checkpoint()
+
+    def add_result(image_path, name, encodings):
+        """1枚分の抽出結果を特徴量の行列に加える（新しく処理した画像と、チェックポイントから再開した画像の両方）"""
+        processed.add(image_path)
+        if len(encodings) > 0:
+            if len(encodings) > 1:
+                # 先頭の顔が本人とは限らないため、全顔を残して後で人物の中心に近い顔を選び直す
+                alternates[len(known_encodings)] = np.array(encodings, dtype=np.float32)
+            known_encodings.append(encodings[0])
+            known_names.append(name)
+            known_paths.append(image_path)
+
+    profiler = StageProfiler("train") # ステージ別の所要時間
+    profiler.start()
+    last_run["profiler"] = profiler
+    last_run["ok"] = False
 
     try:
         if not os.path.exists(TRAIN_DIR):
-            messagebox.showerror("エラー", f"訓練データフォルダ '{TRAIN_DIR}' が見つかりません。")
-            status_label.config(text="待機中...")
+            bus.call(messagebox.showerror, "エラー", f"訓練データフォルダ '{TRAIN_DIR}' が見つかりません。")
+            bus.set_label("status", "待機中...")
             return
         
         # --- ステップ 1: 全体の画像数を事前カウント ---
@@ -45,12 +110,18 @@ def run_training_logic(root, status_label, progress_bar, time_label):
                     total_images += 1
         
         if total_images == 0:
-            messagebox.showinfo("警告", "訓練データフォルダに画像が見つかりません。")
-            status_label.config(text="待機中...")
+            bus.call(messagebox.showinfo, "警告", "訓練データフォルダに画像が見つかりません。")
+            bus.set_label("status", "待機中...")
             return
 
+        # 特徴量は1画像1行なので、画像数分を事前に確保する
+        known_encodings = EncodingMatrix(total_images, ENCODING_MATRIX_FILE)
+        for entry in checkpoint.start(resume):
+            add_result(entry["path"], entry["name"], entry["encodings"])
+
         # 処理状況カウンターを初期化
         processed_count = 0
+        new_count = 0 # 今回の実行で処理した枚数（残り時間の予測用）
         
         # --- ステップ 2: 特徴量抽出と進捗更新 ---
         start_time = time.time()
@@ -63,65 +134,210 @@ def run_training_logic(root, status_label, progress_bar, time_label):
             for filename in os.listdir(person_dir):
                 if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
                     image_path = os.path.join(person_dir, filename)
+                    processed_count += 1
+                    if image_path in processed:
+                        profiler.count("resumed")
+                        continue # 前回の実行で処理済み
                     
-                    # 1. 画像の読み込みと特徴量抽出
-                    image = face_recognition.load_image_file(image_path)
+                    # 1. 画像の読み込みと特徴量抽出（解析済みの画像はDBから再利用し、CNN推論を省略）
                     #face_locations = face_recognition.face_locations(image, model="hog")
-                    face_locations = face_recognition.face_locations(image, model="cnn")
-                    encodings = face_recognition.face_encodings(image, face_locations)
+                    # ひとまず先頭の顔に人物名を付けてDBに記録する（ステップ3で別の顔を選んだ場合は付け直す）
+                    encodings = encode_training_image(face_db, image_path, name, DETECTION_POLICY, quality,
+                                                      profiler=profiler)
+                    profiler.count("images")
 
-                    if len(encodings) > 0:
-                        known_encodings.append(encodings[0])
-                        known_names.append(name)
+                    add_result(image_path, name, encodings)
 
-                    # 2. 進捗と残り時間の更新
-                    processed_count += 1
-                    
+                    # 2. 途中経過の保存（この画像の結果を追加し、一定時間・一定枚数ごとに追記）
+                    new_count += 1
+                    checkpoint.add({"path": image_path, "name": name,
+                                    "encodings": np.array(encodings, dtype=np.float32).reshape(-1, 128)})
+                    with profiler.stage("checkpoint"):
+                        checkpoint.maybe_save(face_db.flush) # DBの内容もチェックポイントと揃えておく
+
+                    # 3. 進捗と残り時間の更新
                     # 進捗率の計算
                     progress_percent = int((processed_count / total_images) * 100)
                     
                     # 経過時間の計算と残り時間の予測
                     elapsed_time = time.time() - start_time
-                    time_per_image = elapsed_time / processed_count
+                    time_per_image = elapsed_time / new_count
                     remaining_time_sec = (total_images - processed_count) * time_per_image
                     
                     remaining_time_str = time.strftime("%H:%M:%S", time.gmtime(remaining_time_sec))
 
-                    # GUI要素の更新
-                    progress_bar['value'] = progress_percent
-                    status_label.config(text=f"特徴量抽出中: {name} さんの写真 ({processed_count}/{total_images} 枚)")
-                    time_label.config(text=f"進捗: {progress_percent}% | 予想残り時間: {remaining_time_str}")
-                    root.update() # GUIの描画を強制的に更新
+                    # GUI要素の更新（最新の値だけがタイマーで反映される）
+                    bus.progress(progress_percent)
+                    bus.set_label("status", f"特徴量抽出中: {name} さんの写真 ({processed_count}/{total_images} 枚)")
+                    bus.set_label("time", f"進捗: {progress_percent}% | 予想残り時間: {remaining_time_str}")
+
+        # DBへの書き込みをまとめて確定し、特徴量抽出の完了時点を保存（学習中に中断しても抽出はやり直さない）
+        elapsed_time = time.time() - start_time
+        with profiler.stage("checkpoint"):
+            face_db.flush()
+            checkpoint.save()
 
         # --- ステップ 3: モデルの学習と保存 ---
-        status_label.config(text="モデル学習中: SVM分類器の学習を開始...")
-        root.update()
+        bus.set_label("status", "モデル学習中: SVM分類器の学習を開始...")
         
         le = LabelEncoder()
         names_numeric = le.fit_transform(known_names)
-        clf = SVC(kernel='linear', C=1, gamma='scale', probability=True)
-        clf.fit(known_encodings, names_numeric)
+        rows = known_encodings.rows()
 
-        with open(MODEL_FILE, 'wb') as f:
-            pickle.dump((clf, le), f)
+        # 人物ごとの統計（中心・広がり・他の人物との距離）と外れ値の判定
+        with profiler.stage("analyze"):
+            stats = identity_statistics(rows, names_numeric, len(le.classes_))
+            replaced = choose_faces(stats, names_numeric, alternates)
+            if replaced:
+                for row, face_index in replaced.items():
+                    rows[row] = alternates[row][face_index]
+                stats = identity_statistics(rows, names_numeric, len(le.classes_))
+            outliers = find_outliers(stats, names_numeric)
+        if replaced:
+            # DBの人物名も、学習に使う顔に付け直す（抽出時は先頭の顔に付けて記録している）
+            with profiler.stage("db"):
+                for row, face_index in replaced.items():
+                    relabel_training_face(face_db, known_paths[row], known_names[row], face_index, quality)
+        profiler.count("faces_rechosen", len(replaced))
+        profiler.count("outliers", len(outliers))
+        print("\n--- 人物ごとの統計 ---")
+        print("\n".join(summary_lines(stats, le.classes_, outliers, names_numeric)))
+        prune = decide_pruning(bus, train_button, stats, le.classes_, names_numeric, outliers, known_paths)
+        keep = np.setdiff1d(np.arange(len(known_names)), outliers) if prune else None
+
+        # 人物ごとの上限（指定値と、メモリの上限から決まる値の小さい方）で学習サンプルを絞る
+        caps = [cap for cap in (MAX_PER_IDENTITY, budget_cap(known_names)) if cap]
+        cap = min(caps) if caps else 0
+        with profiler.stage("select"):
+            selected = select_samples(names_numeric, rows, cap, SAMPLE_SELECTION, rows=keep)
+        profiler.count("train_samples", len(selected))
+        profiler.count("train_samples_dropped", len(known_names) - len(selected))
+        print(f"学習サンプル: {len(selected)} / {len(known_names)} 件 | "
+              f"ピークメモリの見積もり: {estimate_peak_bytes(len(selected)) / 1024 ** 3:.2f} GB")
+
+        # 除外前のモデル（比較用。学習後すぐに破棄してメモリの見積もりを超えないようにする）
+        support_before = None
+        if prune and COMPARE_BEFORE_PRUNING:
+            bus.set_label("status", "モデル学習中: 比較用に外れ値を除外する前のモデルを学習...")
+            before = select_samples(names_numeric, rows, cap, SAMPLE_SELECTION)
+            clf_before = SVC(kernel='linear', C=1, gamma='scale', probability=True, cache_size=SVM_CACHE_MB)
+            with profiler.stage("fit_before"):
+                clf_before.fit(training_matrix(rows, before), names_numeric[before])
+            support_before = int(clf_before.n_support_.sum())
+            del clf_before
+
+        bus.set_label("status", "モデル学習中: SVM分類器を学習...")
+        X = training_matrix(rows, selected)
+        clf = SVC(kernel='linear', C=1, gamma='scale', probability=True, cache_size=SVM_CACHE_MB)
+        with profiler.stage("fit"):
+            clf.fit(X, names_numeric[selected])
+        support_after = int(clf.n_support_.sum())
+        profiler.count("support_vectors", support_after)
+        support_text = f"サポートベクター: {support_after}"
+        if support_before is not None:
+            profiler.count("support_vectors_before", support_before)
+            support_text = f"サポートベクター: {support_before} → {support_after}（外れ値 {len(outliers)} 枚を除外）"
+        print(support_text)
+
+        with profiler.stage("io"):
+            save_model_bundle(MODEL_FILE, clf, le, quality)
+        checkpoint.clear() # 最後まで完了したので途中経過は不要
+        last_run["ok"] = True
 
         # 最終的な表示
-        progress_bar['value'] = 100
-        messagebox.showinfo("成功", f"学習済みモデルを {MODEL_FILE} に保存しました。\n学習完了！")
-        status_label.config(text="完了: 新しいモデルが保存されました。")
-        time_label.config(text="進捗: 100% | 処理時間: " + time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
+        bus.progress(100)
+        bus.set_label("status", "完了: 新しいモデルが保存されました。")
+        bus.set_label("time", "進捗: 100% | 処理時間: " + time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
+        bus.call(messagebox.showinfo, "成功", f"学習済みモデルを {MODEL_FILE} に保存しました。\n{support_text}\n学習完了！")
         
     except Exception as e:
-        messagebox.showerror("エラー", f"学習中にエラーが発生しました: {e}")
-        status_label.config(text="エラーが発生しました。")
-        time_label.config(text="進捗: 0% | エラー")
+        bus.set_label("status", "エラーが発生しました。")
+        bus.set_label("time", "進捗: 0% | エラー")
+        bus.call(messagebox.showerror, "エラー", f"学習中にエラーが発生しました: {e}")
+
+    finally:
+        face_db.close()
+        if known_encodings is not None:
+            known_encodings.close()
+        profile_path = profiler.stop()
+        print("\n--- 処理統計 ---")
+        print(profiler.summary_text())
+        if profile_path:
+            print(f"cProfileの結果: {profile_path}")
+        if train_button is not None:
+            bus.call(train_button.config, state=tk.NORMAL)
+
+def relabel_training_face(face_db, image_path, name, face_index, quality):
+    """学習に使う顔を選び直した画像について、DBの人物名を選んだ顔（face_index 番目）だけに付ける"""
+    analysis = detect_and_encode(face_db, image_path, DETECTION_POLICY, quality=quality) # DBの結果を再利用する
+    face_locations = analysis["face_locations"]
+    identities = [name if i == face_index else None for i in range(len(face_locations))]
+    confidences = [1.0 if i == face_index else None for i in range(len(face_locations))]
+    face_db.record(image_path, analysis["content_hash"], face_locations, analysis["encodings"],
+                   identities, confidences, model_version="train", source="train", detector=analysis["detector"])
+
+def decide_pruning(bus, train_button, stats, classes, labels, outliers, paths):
+    """
+    OUTLIER_MODE に従って外れ値を除外するか決める。一覧は OUTLIER_REPORT_FILE に書き出す。
+    review の場合はGUIで確認する（GUIなしの実行では除外しない）。
+    """
+    if len(outliers) == 0 or OUTLIER_MODE == OUTLIER_OFF:
+        return False
+    write_outlier_report(OUTLIER_REPORT_FILE, stats, classes, labels, outliers, paths)
+    print(f"外れ値の一覧: {OUTLIER_REPORT_FILE} ({len(outliers)} 枚)")
+    if OUTLIER_MODE == OUTLIER_AUTO:
+        return True
+    if train_button is None:
+        print("確認モードのため外れ値は除外しません（OUTLIER_MODE を auto にすると自動で除外します）。")
+        return False
+    preview = "\n".join(f"  {paths[row]}" for row in outliers[:10])
+    more = f"\n  ...他 {len(outliers) - 10} 枚" if len(outliers) > 10 else ""
+    return ask_on_gui(bus, messagebox.askyesno, "外れ値の確認",
+                      f"他の人物に近い、または本人の写真から大きく離れた学習画像が {len(outliers)} 枚あります"
+                      f"（ラベル間違いの可能性）。\n{preview}{more}\n\n一覧: {OUTLIER_REPORT_FILE}\n"
+                      "これらを除外して学習しますか？")
+
+def ask_on_gui(bus, func, *args):
+    """ダイアログをGUIスレッドで表示し、作業スレッドで結果を待つ"""
+    answer = {"value": False}
+    answered = threading.Event()
+    def ask():
+        try:
+            answer["value"] = func(*args)
+        finally:
+            answered.set()
+    bus.call(ask)
+    answered.wait()
+    return answer["value"]
+
+def run_headless(resume=False):
+    """
+    GUIなしで学習を実行する（メインハブのパイプライン用）。
+    ステータスは標準出力に表示し、メッセージボックスの内容もテキストで出力する。
+    戻り値: 終了コード（0: 成功）
+    """
+    bus = ProgressBus()
+    worker = threading.Thread(target=run_training_logic, args=(bus, None, resume))
+    worker.start()
+    while True:
+        worker.join(HEADLESS_REPORT_SEC)
+        _, _, labels, calls = bus.drain()
+        for name in ("status", "time"):
+            if name in labels:
+                print(labels[name], flush=True)
+        for func, args, kwargs in calls:
+            if func in (messagebox.showinfo, messagebox.showerror):
+                print(f"[{args[0]}] {args[1]}", flush=True)
+        if not worker.is_alive():
+            break
+    return 0 if last_run["ok"] else 1
 
 # --- 3. Tkinter GUI の設定 ---
 
 def create_gui():
     root = tk.Tk()
     root.title("モデル学習ツール v2")
-    root.geometry("400x350")
+    root.geometry("400x390")
 
     # 訓練フォルダのパス表示
     dir_label = tk.Label(root, text=f"訓練データフォルダ: {TRAIN_DIR}", pady=5)
@@ -147,8 +363,8 @@ def create_gui():
     train_button = tk.Button(
         root,
         text="モデル学習開始",
-        # コマンドの引数としてroot, status_label, progress_bar, time_labelを渡す
-        command=lambda: run_training_logic(root, status_label, progress_bar, time_label),
+        # 学習は別スレッドで実行し、進捗は bus 経由で受け取る
+        command=lambda: start_training(bus, train_button),
         font=('Helvetica', 12),
         bg='lightgreen',
         padx=20,
@@ -168,6 +384,14 @@ def create_gui():
     status_label = tk.Label(root, text="待機中...", pady=10)
     status_label.pack()
 
+    # 作業スレッドからのステータス・進捗をタイマーでまとめて反映
+    bus = ProgressBus()
+    BusDrainer(root, bus, progress_bar=progress_bar, labels={"status": status_label, "time": time_label},
+               get_profiler=lambda: last_run.get("profiler"))
+
+    # 処理統計ボタン（直近の学習のステージ別所要時間）
+    stats_button = tk.Button(root, text="📊 処理統計", command=lambda: show_summary_window(root, last_run["profiler"]))
+    stats_button.pack()
 
     root.mainloop()
 
@@ -197,4 +421,6 @@ def open_train_directory():
         messagebox.showerror("エラー", f"フォルダを開けませんでした。手動で開いてください。\nパス: {TRAIN_DIR}\nエラー: {e}")
 
 if __name__ == "__main__":
+    if "--headless" in sys.argv:
+        sys.exit(run_headless(resume="--resume" in sys.argv))
     create_gui()
\ No newline at end of file
@@ -0,0 +1,170 @@
+# training_memory.py
+
+import os
+import numpy as np
+
+# --- 1. 定数設定 ---
+ENCODING_DIM = 128            # face_recognition のエンコーディングの次元数
+MEMMAP_MIN_ROWS = 100000      # この行数以上になりうる場合は、特徴量をディスク上の .npy（メモリマップ）に溜める
+SVM_CACHE_MB = 200            # libsvm のカーネルキャッシュ（sklearn の既定値と同じ）
+TRAIN_MEMORY_BUDGET_MB = 8192 # 学習時のピークメモリの上限目安（16GBのマシンで他の処理と同居できる量）
+PROTOTYPE_ITERATIONS = 10     # 代表サンプル選択（k-means）の反復回数
+DISTANCE_CHUNK_ROWS = 4096    # 距離計算を分割する行数（一時配列の大きさを抑える）
+
+SELECTION_PROTOTYPE = "prototype"  # k-means の各クラスタ中心に最も近い実サンプルを残す（分布を保つ）
+SELECTION_RANDOM = "random"        # 無作為に残す（高速）
+SELECTION_METHODS = (SELECTION_PROTOTYPE, SELECTION_RANDOM)
+
+# ピークメモリの見積もり（1サンプルあたりのバイト数）
+#   蓄積用の float32 行列        : 128 × 4 = 512
+#   SVC.fit に渡す float64 行列   : 128 × 8 = 1024（libsvm はこの配列を直接参照し、値のコピーは作らない）
+#   サポートベクター（最悪で全件）: 128 × 8 = 1024
+#   libsvm の係数・インデックス・ラベル名など : 約 256
+# これにカーネルキャッシュ（SVM_CACHE_MB）を加えたものが学習時のピーク。
+# 例: 30万顔 ≒ 0.8GB + キャッシュ。16GBのマシンでも十分に収まる（Pythonのリストに溜めていた場合の
+# 配列オブジェクト1個あたり約1.1KBと、fit 時の変換コピーが不要になる）。
+BYTES_PER_SAMPLE = ENCODING_DIM * 4 + ENCODING_DIM * 8 + ENCODING_DIM * 8 + 256
+
+# --- 2. 特徴量の蓄積 ---
+
+class EncodingMatrix:
+    """
+    エンコーディングを事前確保した float32 の行列に1行ずつ溜める。
+    capacity が MEMMAP_MIN_ROWS 以上で path を指定した場合は、ディスク上の .npy をメモリマップして使う
+    （メモリに載り切らない分はOSがページアウトできる）。
+    """
+
+    def __init__(self, capacity, path=None, dim=ENCODING_DIM):
+        self.dim = dim
+        self.count = 0
+        self.path = path if path and capacity >= MEMMAP_MIN_ROWS else None
+        capacity = max(int(capacity), 1)
+        if self.path:
+            self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=(capacity, dim))
+        else:
+            self.data = np.empty((capacity, dim), dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, encoding):
+        if self.count == len(self.data):
+            self._grow()
+        self.data[self.count] = encoding
+        self.count += 1
+
+    def extend(self, encodings):
+        for encoding in encodings:
+            self.append(encoding)
+
+    def rows(self):
+        """溜めた行のビュー（コピーしない）"""
+        return self.data[:self.count]
+
+    def _grow(self):
+        """想定より多く溜まった場合だけ容量を2倍にする（メモリ上の場合のみ。メモリマップは作り直す）"""
+        capacity = len(self.data) * 2
+        if self.path:
+            old = np.array(self.rows())
+            del self.data
+            self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+            self.data[:len(old)] = old
+        else:
+            data = np.empty((capacity, self.dim), dtype=np.float32)
+            data[:self.count] = self.rows()
+            self.data = data
+
+    def close(self):
+        """メモリマップのファイルを削除する"""
+        if self.path:
+            del self.data
+            self.data = np.empty((0, self.dim), dtype=np.float32)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# --- 3. 人物ごとのサンプル数の上限と代表サンプルの選択 ---
+
+def select_samples(labels, matrix, max_per_identity, method=SELECTION_PROTOTYPE, seed=0, rows=None):
+    """
+    人物ごとに最大 max_per_identity 件までのサンプルを選ぶ（0 なら全件）。
+    rows: 選択の対象にする行のインデックス（None なら全行。外れ値を除いた残りなど）
+    戻り値: 残す行のインデックス（昇順）
+    """
+    labels = np.asarray(labels)
+    rows = np.arange(len(labels)) if rows is None else np.asarray(rows)
+    if not max_per_identity:
+        return rows
+    rng = np.random.default_rng(seed)
+    keep = []
+    for label in np.unique(labels[rows]):
+        indices = rows[labels[rows] == label]
+        if len(indices) <= max_per_identity:
+            keep.append(indices)
+        elif method == SELECTION_RANDOM:
+            keep.append(rng.choice(indices, max_per_identity, replace=False))
+        else:
+            keep.append(indices[_prototype_indices(matrix[indices], max_per_identity, rng)])
+    return np.sort(np.concatenate(keep))
+
+def _prototype_indices(points, k, rng):
+    """k-means のクラスタ中心に最も近い実サンプルのインデックスを返す（重複した場合は無作為に補う）"""
+    points = np.asarray(points, dtype=np.float32)
+    centers = points[rng.choice(len(points), k, replace=False)].copy()
+    for _ in range(PROTOTYPE_ITERATIONS):
+        assignment = _nearest(points, centers)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assignment, points)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centers[filled] = sums[filled] / counts[filled, None]
+    # 各中心に最も近いサンプルを選ぶ
+    chosen = np.unique(_nearest(centers, points))
+    if len(chosen) < k:
+        rest = np.setdiff1d(np.arange(len(points)), chosen)
+        chosen = np.concatenate([chosen, rng.choice(rest, k - len(chosen), replace=False)])
+    return chosen
+
+def _nearest(points, centers):
+    """points の各行に最も近い centers の行番号（DISTANCE_CHUNK_ROWS 行ずつ計算）"""
+    center_sq = (centers ** 2).sum(axis=1)
+    result = np.empty(len(points), dtype=np.intp)
+    for start in range(0, len(points), DISTANCE_CHUNK_ROWS):
+        chunk = points[start:start + DISTANCE_CHUNK_ROWS]
+        distances = center_sq[None, :] - 2.0 * chunk @ centers.T
+        result[start:start + len(chunk)] = distances.argmin(axis=1)
+    return result
+
+# --- 4. メモリの見積もりと学習用の行列 ---
+
+def estimate_peak_bytes(n_samples, cache_mb=SVM_CACHE_MB):
+    """学習時のピークメモリの見積もり（バイト）"""
+    return n_samples * BYTES_PER_SAMPLE + cache_mb * 1024 * 1024
+
+def budget_cap(labels, budget_mb=TRAIN_MEMORY_BUDGET_MB, cache_mb=SVM_CACHE_MB):
+    """
+    見積もりが budget_mb に収まる人物ごとの上限を返す（全件で収まる場合は 0）。
+    サンプル数の多い人物から順に削られる。
+    """
+    _, counts = np.unique(np.asarray(labels), return_counts=True)
+    max_samples = (budget_mb * 1024 * 1024 - cache_mb * 1024 * 1024) // BYTES_PER_SAMPLE
+    if counts.sum() <= max_samples:
+        return 0
+    cap = int(counts.max())
+    low, high = 1, cap
+    while low < high: # 合計が max_samples 以下になる最大の上限を二分探索
+        middle = (low + high + 1) // 2
+        if np.minimum(counts, middle).sum() <= max_samples:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def training_matrix(matrix, indices):
+    """
+    選んだ行を SVC.fit にそのまま渡せる float64 の連続した配列にコピーする
+    （sklearn 側での変換コピーを発生させない）。
+    """
+    X = np.empty((len(indices), matrix.shape[1]), dtype=np.float64)
+    for start in range(0, len(indices), DISTANCE_CHUNK_ROWS):
+        X[start:start + DISTANCE_CHUNK_ROWS] = matrix[indices[start:start + DISTANCE_CHUNK_ROWS]]
+    return X
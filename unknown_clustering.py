@@ -0,0 +1,235 @@
+# unknown_clustering.py
+
+import os
+import sys
+import numpy as np
+import face_recognition
+from PIL import Image
+from face_database import FaceDatabase, detect_and_encode
+from face_detection import POLICY_ADAPTIVE
+from quality_tiers import tier_settings, TIER_BALANCED
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+UNKNOWN_DIR = os.path.join(PROJECT_ROOT, "sorted_output", "Unknown")
+TRAIN_DIR = os.path.join(PROJECT_ROOT, "train_data")
+CLUSTER_PREFIX = "unknown_cluster_"  # 作成する候補フォルダの名前（学習前にローマ字の人物名へ変更する）
+
+DISTANCE_TOLERANCE = 0.5  # この距離未満の顔どうしを同一人物の候補としてつなぐ
+MAX_NEIGHBORS = 20        # 1つの顔につなぐ近傍の最大数（グラフのメモリ上限を決める）
+BLOCK_SIZE = 2048         # 距離計算のブロックサイズ（一度に作る距離行列は BLOCK_SIZE^2 要素まで）
+MIN_CLUSTER_SIZE = 3      # これより小さいクラスタは候補フォルダにしない
+MAX_ITERATIONS = 30       # Chinese whispers の最大反復回数
+PADDING = 40              # 切り取る顔の周囲の余白（face_crop_tool_gui.py と同じ）
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DETECTION_POLICY = POLICY_ADAPTIVE  # まずHOG、顔がない/質が低い場合だけCNN（face_detection.py）
+QUALITY_TIER = TIER_BALANCED        # 検出・エンコーディングの設定（quality_tiers.py）
+
+# --- 2. 近傍グラフの作成（ブロック単位の距離計算） ---
+
+def build_neighbor_graph(encodings, tolerance=DISTANCE_TOLERANCE, max_neighbors=MAX_NEIGHBORS,
+                         block_size=BLOCK_SIZE):
+    """
+    顔エンコーディングの近傍グラフを作る。
+    全件の距離行列 (N×N) は作らず、BLOCK_SIZE×BLOCK_SIZE のブロックごとに距離を計算し、
+    各顔について距離の近い上位 max_neighbors 件だけを保持する。
+    メモリ使用量は O(N × max_neighbors + BLOCK_SIZE^2) に収まる。
+    戻り値: (rows, cols, weights) の無向辺リスト（両方向を含む）
+    """
+    x = np.ascontiguousarray(encodings, dtype=np.float32)
+    n = len(x)
+    squared_norms = np.einsum('ij,ij->i', x, x)
+    k = min(max_neighbors, max(n - 1, 0))
+    if k == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+
+    best_dist = np.full((n, k), np.inf, dtype=np.float32)
+    best_index = np.full((n, k), -1, dtype=np.int64)
+
+    for row_start in range(0, n, block_size):
+        row_end = min(n, row_start + block_size)
+        rows = x[row_start:row_end]
+        top_dist = best_dist[row_start:row_end]
+        top_index = best_index[row_start:row_end]
+
+        for col_start in range(0, n, block_size):
+            col_end = min(n, col_start + block_size)
+            # ユークリッド距離: |a|^2 + |b|^2 - 2ab
+            dist = squared_norms[row_start:row_end, None] + squared_norms[None, col_start:col_end] \
+                - 2.0 * rows @ x[col_start:col_end].T
+            np.sqrt(np.maximum(dist, 0.0, out=dist), out=dist)
+            if row_start == col_start:
+                np.fill_diagonal(dist, np.inf)  # 自分自身は除外
+            dist[dist >= tolerance] = np.inf
+
+            # これまでの上位k件とこのブロックを合わせて、上位k件を選び直す
+            merged_dist = np.concatenate([top_dist, dist], axis=1)
+            merged_index = np.concatenate(
+                [top_index, np.broadcast_to(np.arange(col_start, col_end), dist.shape)], axis=1
+            )
+            keep = np.argpartition(merged_dist, k - 1, axis=1)[:, :k]
+            top_dist = np.take_along_axis(merged_dist, keep, axis=1)
+            top_index = np.take_along_axis(merged_index, keep, axis=1)
+
+        best_dist[row_start:row_end] = top_dist
+        best_index[row_start:row_end] = top_index
+
+    valid = np.isfinite(best_dist)
+    src = np.repeat(np.arange(n), k)[valid.ravel()]
+    dst = best_index[valid]
+    weights = (1.0 - best_dist[valid] / tolerance).astype(np.float32) + 1e-3  # 近いほど重い
+
+    # 無向グラフにするため両方向の辺を持つ
+    return (np.concatenate([src, dst]), np.concatenate([dst, src]), np.concatenate([weights, weights]))
+
+# --- 3. Chinese whispers によるクラスタリング ---
+
+def chinese_whispers(n, rows, cols, weights, max_iterations=MAX_ITERATIONS, seed=0):
+    """
+    Chinese whispers（ラベル伝播）でクラスタリングする。
+    各反復でランダムに選んだ半数の顔が、近傍の重みの合計が最大のラベルに乗り換える。
+    辺ごとの集計は numpy でまとめて行う。
+    戻り値: 各顔のクラスタ番号（0始まり、連番）
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n, dtype=np.int64)
+    if len(rows) == 0:
+        return labels
+
+    for _ in range(max_iterations):
+        # (顔, 近傍のラベル) ごとに重みを合計
+        keys = rows * n + labels[cols]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights)
+        nodes = unique_keys // n
+        candidate_labels = unique_keys % n
+
+        # 顔ごとに重みの合計が最大のラベルを選ぶ
+        order = np.lexsort((-sums, nodes))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = nodes[order][1:] != nodes[order][:-1]
+        best_nodes = nodes[order][first]
+        best_labels = candidate_labels[order][first]
+
+        # 同時更新による振動を防ぐため、半数だけ更新する
+        update = rng.random(len(best_nodes)) < 0.5
+        new_labels = labels.copy()
+        new_labels[best_nodes[update]] = best_labels[update]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
+def cluster_encodings(encodings, tolerance=DISTANCE_TOLERANCE, max_neighbors=MAX_NEIGHBORS):
+    """エンコーディング行列をクラスタリングし、各顔のクラスタ番号を返す"""
+    rows, cols, weights = build_neighbor_graph(encodings, tolerance, max_neighbors)
+    return chinese_whispers(len(encodings), rows, cols, weights)
+
+# --- 4. 入力の収集と候補フォルダの出力 ---
+
+def collect_unknown_faces(db, unknown_dir=UNKNOWN_DIR, progress=None):
+    """
+    Unknownフォルダ内の画像の顔を集める。解析済みの画像はDBのエンコーディングを再利用する。
+    戻り値: (顔情報のリスト [{"path", "box"}], エンコーディング行列 (N, 128) float32)
+    """
+    file_list = [f for f in os.listdir(unknown_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    faces = []
+    chunks = []
+    for i, filename in enumerate(file_list):
+        image_path = os.path.join(unknown_dir, filename)
+        analysis = detect_and_encode(db, image_path, DETECTION_POLICY, quality=tier_settings(QUALITY_TIER))
+        if not analysis["from_db"]:
+            db.record(image_path, analysis["content_hash"], analysis["face_locations"], analysis["encodings"],
+                      ["Unknown"] * len(analysis["face_locations"]), source="cluster", detector=analysis["detector"])
+        for box, encoding in zip(analysis["face_locations"], analysis["encodings"]):
+            faces.append({"path": image_path, "box": box})
+            chunks.append(np.asarray(encoding, dtype=np.float32))
+        if progress:
+            progress(i + 1, len(file_list))
+    db.flush()
+    matrix = np.vstack(chunks) if chunks else np.zeros((0, 128), dtype=np.float32)
+    return faces, matrix
+
+def next_cluster_dir(train_dir, start):
+    """既存フォルダと重ならない候補フォルダ名を返す"""
+    number = start
+    while os.path.exists(os.path.join(train_dir, f"{CLUSTER_PREFIX}{number:03d}")):
+        number += 1
+    return os.path.join(train_dir, f"{CLUSTER_PREFIX}{number:03d}"), number
+
+def export_clusters(faces, labels, train_dir=TRAIN_DIR, min_cluster_size=MIN_CLUSTER_SIZE):
+    """
+    一定数以上の顔を持つクラスタを train_data/ 形式（人物ごとのフォルダ + 顔画像）で書き出す。
+    顔は face_crop_tool_gui.py と同じ余白で切り取る。
+    戻り値: [(フォルダパス, 顔の数), ...]
+    """
+    os.makedirs(train_dir, exist_ok=True)
+    sizes = np.bincount(labels) if len(labels) else np.zeros(0, dtype=np.int64)
+    large_clusters = [c for c in np.argsort(-sizes) if sizes[c] >= min_cluster_size]
+
+    created = []
+    number = 1
+    for cluster in large_clusters:
+        cluster_dir, number = next_cluster_dir(train_dir, number)
+        os.makedirs(cluster_dir)
+
+        # 同じ画像の顔はまとめて切り取る（画像の読み込みは1回）
+        members = sorted(np.nonzero(labels == cluster)[0], key=lambda i: faces[i]["path"])
+        current_path, pil_image = None, None
+        for i in members:
+            face = faces[i]
+            if face["path"] != current_path:
+                current_path = face["path"]
+                pil_image = Image.fromarray(face_recognition.load_image_file(current_path))
+            top, right, bottom, left = face["box"]
+            cropped_face = pil_image.crop((
+                max(0, left - PADDING),
+                max(0, top - PADDING),
+                min(pil_image.width, right + PADDING),
+                min(pil_image.height, bottom + PADDING)
+            ))
+            base_name, ext = os.path.splitext(os.path.basename(face["path"]))
+            cropped_face.save(os.path.join(cluster_dir, f"{base_name}_face_{i + 1}{ext}"))
+
+        created.append((cluster_dir, int(sizes[cluster])))
+        number += 1
+    return created
+
+def run_clustering(unknown_dir=UNKNOWN_DIR, train_dir=TRAIN_DIR, log=print):
+    """
+    Unknownフォルダの顔をクラスタリングし、候補フォルダを train_data に作成する。
+    unknown_dir=None の場合は、DBで "Unknown" と識別された全ての顔を対象にする。
+    """
+    db = FaceDatabase()
+    try:
+        if unknown_dir is None:
+            log("DBからUnknownの顔を読み込み中...")
+            faces, encodings = db.load_identity_encodings("Unknown")
+        else:
+            log(f"Unknownの顔を収集中: {unknown_dir}")
+            faces, encodings = collect_unknown_faces(db, unknown_dir)
+        log(f"  顔の数: {len(faces)}")
+        if len(faces) == 0:
+            return []
+
+        labels = cluster_encodings(encodings)
+        log(f"  クラスタ数: {labels.max() + 1} (うち {MIN_CLUSTER_SIZE} 顔以上のものを出力)")
+        created = export_clusters(faces, labels, train_dir)
+        for cluster_dir, size in created:
+            log(f"  📁 {os.path.basename(cluster_dir)}: {size} 顔")
+        log("候補フォルダの名前を人物名（ローマ字）に変更してから学習してください。")
+        return created
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python unknown_clustering.py [Unknownフォルダ | --db] [train_dataフォルダ]
+    unknown_dir = sys.argv[1] if len(sys.argv) > 1 else UNKNOWN_DIR
+    if unknown_dir == "--db":
+        unknown_dir = None
+    train_dir = sys.argv[2] if len(sys.argv) > 2 else TRAIN_DIR
+    run_clustering(unknown_dir, train_dir)
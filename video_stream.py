@@ -0,0 +1,325 @@
+# video_stream.py
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+import face_recognition
+from quality_tiers import load_model_bundle, inference_settings, TIER_FAST
+
+# --- 1. 定数設定 ---
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILE = os.path.join(PROJECT_ROOT, "face_classifier_model.pkl")
+CONFIDENCE_THRESHOLD = 0.78
+
+DETECT_EVERY_N_FRAMES = 10     # 通常はNフレームに1回だけ顔検出を行う
+SCENE_CHANGE_THRESHOLD = 0.35  # ヒストグラム距離(Bhattacharyya)がこれを超えたらシーン切替とみなし即検出
+DETECTION_SCALE = 0.5          # 検出・追跡は縮小したフレームで行う
+DETECTION_MODEL = "hog"        # CPUでリアルタイムを狙うためHOGを使用（CNNは毎回数百ms〜秒かかる）
+TRACK_MATCH_THRESHOLD = 0.5    # テンプレートマッチングのスコアがこれ未満なら追跡失敗
+TRACK_IOU_THRESHOLD = 0.3      # 検出結果と既存トラックを同一人物とみなすIoU
+TRACK_MAX_MISSES = 2           # 検出で見つからなかった回数がこれを超えたらトラックを破棄
+CLASSIFY_BATCH_SIZE = 16       # この数の顔が溜まったらまとめて識別する
+CLASSIFY_MAX_WAIT_FRAMES = 15  # 溜まらなくてもこのフレーム数待ったら識別する
+QUALITY_TIER = TIER_FAST       # エンコーディングの設定（検出の設定は上の DETECTION_* を使う）
+
+# --- 2. トラック（追跡中の顔） ---
+
+class FaceTrack:
+    """フレーム間で追跡される1つの顔。識別結果はトラックが続く限り再利用する"""
+
+    def __init__(self, track_id, box, template):
+        self.track_id = track_id
+        self.box = box            # 縮小フレーム上の (top, right, bottom, left)
+        self.template = template  # 追跡用のグレースケール画像
+        self.name = None          # 識別前は None
+        self.confidence = 0.0
+        self.misses = 0
+
+    @property
+    def label(self):
+        if self.name is None:
+            return "..."
+        return f"{self.name} ({self.confidence:.0f}%)"
+
+
+def box_iou(a, b):
+    """(top, right, bottom, left) 形式の2つの矩形のIoU"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    inter = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+# --- 3. 動画識別の本体 ---
+
+class VideoFaceIdentifier:
+    """
+    動画のフレームを順に受け取り、顔の検出・追跡・識別を行う。
+    - 検出は DETECT_EVERY_N_FRAMES ごと、またはシーン切替時のみ
+    - 検出の間はテンプレートマッチングで矩形を追跡し、識別済みの名前を使い回す
+    - 新しい顔のエンコーディングは溜めておき、複数フレーム分をまとめて識別する
+    classify_fn: エンコーディングの配列 (N, 128) を受け取り [(名前, 信頼度%), ...] を返す関数
+    quality: 品質ティアの設定（ジッター回数とランドマークモデルのみ使用。学習時の設定に合わせる）
+    """
+
+    def __init__(self, classify_fn, detect_every=DETECT_EVERY_N_FRAMES, scale=DETECTION_SCALE,
+                 detection_model=DETECTION_MODEL, quality=None):
+        self.classify_fn = classify_fn
+        self.detect_every = detect_every
+        self.scale = scale
+        self.detection_model = detection_model
+        self.quality = quality or inference_settings(QUALITY_TIER, None)
+
+        self.tracks = []
+        self.pending = []  # [(track, encoding)] 識別待ちの顔
+        self.pending_since = None
+        self.next_track_id = 1
+        self.frame_index = 0
+        self.last_detection_frame = None
+        self.last_hist = None
+
+        # 統計
+        self.detections = 0
+        self.scene_changes = 0
+        self.classified_faces = 0
+        self.classify_calls = 0
+
+    def _histogram(self, small_bgr):
+        hsv = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def process_frame(self, frame_bgr):
+        """
+        1フレームを処理し、現在のトラックのリストを返す。
+        トラックの box は縮小フレーム座標なので、描画には to_frame_box() を使う。
+        """
+        small_bgr = cv2.resize(frame_bgr, (0, 0), fx=self.scale, fy=self.scale)
+        small_gray = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2GRAY)
+        hist = self._histogram(small_bgr)
+
+        # 1. 検出するかどうかの判定（一定間隔 or シーン切替）
+        scene_changed = False
+        if self.last_hist is not None:
+            distance = cv2.compareHist(self.last_hist, hist, cv2.HISTCMP_BHATTACHARYYA)
+            scene_changed = distance > SCENE_CHANGE_THRESHOLD
+
+        due = (self.last_detection_frame is None or
+               self.frame_index - self.last_detection_frame >= self.detect_every)
+
+        if scene_changed:
+            # シーンが切り替わったら以前のトラックは当てにならないので破棄
+            self.scene_changes += 1
+            self.tracks = []
+            self.pending = []
+
+        if due or scene_changed:
+            self._detect(small_bgr, small_gray)
+            self.last_hist = hist
+        else:
+            self._track(small_gray)
+
+        # 2. 識別待ちの顔をまとめて識別
+        if self.pending and (len(self.pending) >= CLASSIFY_BATCH_SIZE or
+                             self.frame_index - self.pending_since >= CLASSIFY_MAX_WAIT_FRAMES):
+            self.flush()
+
+        self.frame_index += 1
+        return self.tracks
+
+    def _detect(self, small_bgr, small_gray):
+        """縮小フレームで顔検出し、既存トラックと対応付ける"""
+        self.detections += 1
+        self.last_detection_frame = self.frame_index
+
+        small_rgb = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2RGB)
+        boxes = face_recognition.face_locations(small_rgb, model=self.detection_model)
+
+        # IoUの大きい順に、既存トラックと検出結果を貪欲に対応付ける
+        pairs = sorted(
+            ((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        matched_tracks, matched_boxes = set(), set()
+        for iou, t, b in pairs:
+            if iou < TRACK_IOU_THRESHOLD:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+            track = self.tracks[t]
+            track.box = boxes[b]
+            track.template = self._crop(small_gray, boxes[b])
+            track.misses = 0
+
+        # 見つからなかったトラックは一定回数で破棄
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > TRACK_MAX_MISSES:
+                    continue
+            survivors.append(track)
+        self.tracks = survivors
+
+        # 新しい顔だけエンコーディングを計算し、識別待ちに追加
+        new_boxes = [box for b, box in enumerate(boxes) if b not in matched_boxes]
+        if new_boxes:
+            encodings = face_recognition.face_encodings(small_rgb, new_boxes, num_jitters=self.quality["num_jitters"],
+                                                        model=self.quality["landmark_model"])
+            for box, encoding in zip(new_boxes, encodings):
+                track = FaceTrack(self.next_track_id, box, self._crop(small_gray, box))
+                self.next_track_id += 1
+                self.tracks.append(track)
+                if not self.pending:
+                    self.pending_since = self.frame_index
+                self.pending.append((track, encoding))
+
+    def _crop(self, gray, box):
+        top, right, bottom, left = box
+        return gray[max(0, top):max(0, bottom), max(0, left):max(0, right)].copy()
+
+    def _track(self, small_gray):
+        """検出しないフレームでは、前回位置の周辺をテンプレートマッチングで探す"""
+        height, width = small_gray.shape
+        for track in self.tracks:
+            top, right, bottom, left = track.box
+            box_h, box_w = bottom - top, right - left
+            if track.template.size == 0 or box_h <= 0 or box_w <= 0:
+                continue
+
+            # 探索範囲は矩形の周囲に半分ずつ広げた領域
+            margin_y, margin_x = box_h // 2, box_w // 2
+            y0, y1 = max(0, top - margin_y), min(height, bottom + margin_y)
+            x0, x1 = max(0, left - margin_x), min(width, right + margin_x)
+            region = small_gray[y0:y1, x0:x1]
+            if region.shape[0] < track.template.shape[0] or region.shape[1] < track.template.shape[1]:
+                continue
+
+            scores = cv2.matchTemplate(region, track.template, cv2.TM_CCOEFF_NORMED)
+            _, best_score, _, (best_x, best_y) = cv2.minMaxLoc(scores)
+            if best_score < TRACK_MATCH_THRESHOLD:
+                track.misses += 1
+                continue
+
+            new_top, new_left = y0 + best_y, x0 + best_x
+            track.box = (new_top, new_left + box_w, new_top + box_h, new_left)
+
+    def flush(self):
+        """識別待ちの顔をまとめて識別する（1回の predict_proba で複数フレーム分を処理）"""
+        if not self.pending:
+            return
+        tracks = [track for track, _ in self.pending]
+        encodings = np.array([encoding for _, encoding in self.pending])
+        self.pending = []
+        self.pending_since = None
+
+        results = self.classify_fn(encodings)
+        self.classify_calls += 1
+        self.classified_faces += len(tracks)
+        for track, (name, confidence) in zip(tracks, results):
+            track.name = name
+            track.confidence = confidence
+
+    def to_frame_box(self, box):
+        """縮小フレーム座標の矩形を元フレーム座標に戻す"""
+        top, right, bottom, left = box
+        inv = 1.0 / self.scale
+        return int(top * inv), int(right * inv), int(bottom * inv), int(left * inv)
+
+    def draw(self, frame_bgr):
+        """トラックの矩形と名前をフレームに描画する"""
+        for track in self.tracks:
+            top, right, bottom, left = self.to_frame_box(track.box)
+            color = (0, 160, 0) if track.name not in (None, "Unknown") else (0, 0, 220)
+            cv2.rectangle(frame_bgr, (left, top), (right, bottom), color, 2)
+            cv2.putText(frame_bgr, track.label, (left, max(0, top - 8)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        return frame_bgr
+
+    def stats(self):
+        return {
+            "frames": self.frame_index,
+            "detections": self.detections,
+            "scene_changes": self.scene_changes,
+            "classified_faces": self.classified_faces,
+            "classify_calls": self.classify_calls,
+        }
+
+# --- 4. コマンドラインからの実行（ローカル動画での検証用） ---
+
+def open_source(source):
+    """動画ファイルのパス、またはカメラ番号（数字）から VideoCapture を開く"""
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+def run_video(source, classify_fn, detect_every=DETECT_EVERY_N_FRAMES, max_frames=None, show=False, quality=None):
+    """動画を最後まで（または max_frames まで）処理し、統計とfpsを返す"""
+    capture = open_source(source)
+    if not capture.isOpened():
+        raise IOError(f"動画を開けませんでした: {source}")
+
+    identifier = VideoFaceIdentifier(classify_fn, detect_every=detect_every, quality=quality)
+    start_time = time.time()
+    try:
+        while max_frames is None or identifier.frame_index < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            identifier.process_frame(frame)
+            if show:
+                cv2.imshow("PICA video", identifier.draw(frame))
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        identifier.flush()
+    finally:
+        capture.release()
+        if show:
+            cv2.destroyAllWindows()
+
+    elapsed = time.time() - start_time
+    stats = identifier.stats()
+    stats["seconds"] = elapsed
+    stats["fps"] = stats["frames"] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+def make_classifier(clf, le, threshold=CONFIDENCE_THRESHOLD):
+    """学習済みモデルから classify_fn を作る"""
+    def classify(encodings):
+        results = []
+        for probabilities in clf.predict_proba(encodings):
+            max_index = int(np.argmax(probabilities))
+            confidence = probabilities[max_index] * 100
+            name = le.classes_[max_index] if probabilities[max_index] >= threshold else "Unknown"
+            results.append((name, confidence))
+        return results
+    return classify
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="動画ファイル/カメラの顔識別（検出間引き＋追跡）")
+    parser.add_argument("source", help="動画ファイルのパス、またはカメラ番号 (例: 0)")
+    parser.add_argument("--detect-every", type=int, default=DETECT_EVERY_N_FRAMES, help="検出を行うフレーム間隔")
+    parser.add_argument("--max-frames", type=int, default=None, help="処理する最大フレーム数")
+    parser.add_argument("--show", action="store_true", help="処理中の映像を表示する")
+    args = parser.parse_args()
+
+    try:
+        clf, le, model_quality = load_model_bundle(MODEL_FILE)
+    except FileNotFoundError:
+        print(f"モデルファイルが見つかりません: {MODEL_FILE}\n先に学習を実行してください。")
+        sys.exit(1)
+
+    result = run_video(args.source, make_classifier(clf, le), args.detect_every, args.max_frames, args.show,
+                       inference_settings(QUALITY_TIER, model_quality))
+    print(f"フレーム数: {result['frames']} | 処理時間: {result['seconds']:.1f}s | {result['fps']:.1f} fps")
+    print(f"検出回数: {result['detections']} (シーン切替 {result['scene_changes']}) | "
+          f"識別: {result['classified_faces']} 顔 / {result['classify_calls']} 回")